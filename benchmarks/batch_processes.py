@@ -0,0 +1,130 @@
+"""Compares thread and process batch senders as the number of workers grows.
+
+Every request is answered in memory by CannedTransport, so the benchmark measures the
+client-side cost of a send, which is dominated by pure-Python RSA signing. Threads share one
+GIL and stop scaling almost immediately; processes scale with the number of cores.
+
+Usage: python benchmarks/batch_processes.py DEVICE_INFO.json [JOBS]
+where DEVICE_INFO.json is a client file written by ``stkclient login``.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Iterable, List, Mapping, Optional
+
+from stkclient import Client, ratelimit
+from stkclient.batch import (
+    AIMDController,
+    BatchSender,
+    ProcessBatchSender,
+    SendJob,
+    SendResult,
+)
+from stkclient.timeouts import DEFAULT_TIMEOUT, Timeout
+from stkclient.transport import Body, Response, Transport
+
+RESPONSES = {
+    "/GetUploadUrl": {
+        "expiryTime": 600,
+        "statusCode": 0,
+        "stkToken": "token",
+        "uploadUrl": "https://upload.example.com/file",
+    },
+    "/SendToKindle": {"sku": "sku", "statusCode": 0},
+}
+
+
+class CannedResponse(Response):
+    """A complete in-memory response."""
+
+    def __init__(self, body: bytes) -> None:
+        """Constructs a 200 response with the given body."""
+        self.status = 200
+        self.reason = "OK"
+        self._body = body
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Returns default; canned responses have no headers."""
+        return default
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        """Returns the rest of the body."""
+        body, self._body = self._body, b""
+        return body
+
+    def close(self) -> None:
+        """Does nothing."""
+
+
+class CannedTransport(Transport):
+    """Answers send-to-kindle requests without touching the network."""
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Mapping[str, str],
+        body: Body = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+    ) -> Response:
+        """Drains any streamed body and returns the canned response for the path."""
+        if body is not None and not isinstance(body, bytes):
+            while body.read(64 * 1024):
+                pass
+        path = urllib.parse.urlsplit(url).path
+        return CannedResponse(json.dumps(RESPONSES.get(path, {})).encode())
+
+
+def unlimited() -> None:
+    """Removes request rate limiting, which would otherwise dominate the measurement."""
+    ratelimit.set_default_limiter(ratelimit.RateLimiter(rate=1e9, burst=1e9, max_rate=1e9))
+
+
+def make_jobs(directory: Path, n: int) -> List[SendJob]:
+    """Creates n small files to send."""
+    jobs = []
+    for i in range(n):
+        path = directory / f"{i}.txt"
+        path.write_bytes(b"x" * 1024)
+        jobs.append(SendJob(path, ["device"], author="a", title=str(i), format="txt"))
+    return jobs
+
+
+def run(name: str, results: Iterable[SendResult], jobs: int, workers: int) -> None:
+    """Times a batch and prints its throughput."""
+    start = time.perf_counter()
+    for result in results:
+        if result.error is not None:
+            raise result.error
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10}{workers:>8}{jobs / elapsed:>12.1f}")
+
+
+def main(argv: List[str]) -> None:
+    """Runs the benchmark."""
+    with open(argv[0]) as f:
+        client = Client.load(f, CannedTransport())
+    n = int(argv[1]) if len(argv) > 1 else 200
+    unlimited()
+    counts = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    print(f"{'mode':<10}{'workers':>8}{'sends/s':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = make_jobs(Path(tmp), n)
+        for workers in counts:
+            controller = AIMDController(workers, min_limit=workers, max_limit=workers)
+            run("threads", BatchSender(client, controller=controller).send(jobs), n, workers)
+        for workers in counts:
+            sender = ProcessBatchSender(
+                client, processes=workers, transport=CannedTransport, initializer=unlimited
+            )
+            run("processes", sender.send(jobs), n, workers)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,97 @@
+"""Measures the memory held by a cache of 10,000 owned devices.
+
+Device lists for many accounts are parsed from JSON and kept, as a daemon caching them would.
+"legacy" reproduces the previous dict-per-device dataclasses; "current" uses the slotted
+OwnedDevice with shared capabilities.
+
+Usage: python benchmarks/device_cache_memory.py [ACCOUNTS] [DEVICES_PER_ACCOUNT]
+"""
+
+import gc
+import json
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, List, Mapping
+
+from stkclient.model import GetOwnedDevicesResponse
+
+CAPABILITIES = [
+    {"PDF_CONTENT_ENABLED": True, "WAN_ENABLED": False, "WIFI_CAPABLE": True},
+    {"PDF_CONTENT_ENABLED": True, "WAN_ENABLED": True, "WIFI_CAPABLE": True},
+    {"PDF_CONTENT_ENABLED": False, "WAN_ENABLED": False, "WIFI_CAPABLE": True},
+]
+
+
+@dataclass(frozen=True)
+class LegacyOwnedDevice:
+    """OwnedDevice as it was before slots and shared capabilities."""
+
+    device_capabilities: Mapping[str, bool]
+    device_name: str
+    device_serial_number: str
+
+
+@dataclass(frozen=True)
+class LegacyResponse:
+    """GetOwnedDevicesResponse as it was before devices were slotted."""
+
+    owned_devices: List[LegacyOwnedDevice]
+    status_code: int
+
+    @staticmethod
+    def from_dict(d: Mapping[str, Any]) -> "LegacyResponse":
+        """Builds every device eagerly."""
+        return LegacyResponse(
+            [
+                LegacyOwnedDevice(v["deviceCapabilities"], v["deviceName"], v["deviceSerialNumber"])
+                for v in d["ownedDevices"]
+            ],
+            d["statusCode"],
+        )
+
+
+def payloads(accounts: int, per_account: int) -> List[bytes]:
+    """Returns one GetListOfOwnedDevices response body per account."""
+    return [
+        json.dumps(
+            {
+                "ownedDevices": [
+                    {
+                        "deviceCapabilities": CAPABILITIES[(a + i) % len(CAPABILITIES)],
+                        "deviceName": f"Kindle {i}",
+                        "deviceSerialNumber": f"G000PP{a:05d}{i:05d}",
+                    }
+                    for i in range(per_account)
+                ],
+                "statusCode": 0,
+            }
+        ).encode()
+        for a in range(accounts)
+    ]
+
+
+def measure(name: str, build: Callable[[bytes], object], bodies: List[bytes]) -> None:
+    """Prints the memory retained by the cache built from bodies."""
+    gc.collect()
+    tracemalloc.start()
+    cache = [build(body) for body in bodies]
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cache
+    print(f"{name:<14}{current / 1024 / 1024:>8.2f} MiB")
+
+
+def main(argv: List[str]) -> None:
+    """Runs the benchmark."""
+    accounts = int(argv[0]) if argv else 1000
+    per_account = int(argv[1]) if len(argv) > 1 else 10
+    bodies = payloads(accounts, per_account)
+    print(f"{accounts * per_account} devices across {accounts} accounts")
+    measure("legacy", lambda b: LegacyResponse.from_dict(json.loads(b)), bodies)
+    measure("current", lambda b: GetOwnedDevicesResponse.from_dict(json.loads(b)), bodies)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+"""Measures the time to build a signed SendToKindle request body, before and after compaction.
+
+"legacy" re-merges ClientInfo and pretty-prints with indent=4, as requests were built before;
+"compact" is stkclient.api._encode_request. Each is timed on its own and together with signing,
+which hashes the body and applies the (pure-Python) RSA private key.
+
+Usage: python benchmarks/request_build.py [ITERATIONS]
+"""
+
+import json
+import sys
+import timeit
+from typing import Any, Callable, Dict
+
+import rsa
+
+from stkclient import api
+from stkclient.signer import Signer
+
+BODY: Dict[str, Any] = {
+    "DocumentMetadata": {
+        "author": "Jane Austen",
+        "crc32": 0,
+        "inputFormat": "epub",
+        "title": "Pride and Prejudice",
+    },
+    "archive": True,
+    "deliveryMechanism": "WIFI",
+    "outputFormat": "EPUB",
+    "stkToken": "9214b056b98b44238db291b3f2bb786c",
+    "targetDevices": ["35C6D8B149E345848BF462CC13824AA2", "G000PP1311850V4X"],
+}
+
+
+def legacy() -> str:
+    """Builds the body the way _request used to."""
+    return json.dumps({"ClientInfo": api.DEFAULT_CLIENT_INFO, **BODY}, indent=4)
+
+
+def compact() -> str:
+    """Builds the body with the current encoder."""
+    return api._encode_request(BODY)
+
+
+def report(name: str, fn: Callable[[], object], number: int) -> None:
+    """Prints the best per-call time of fn over 5 repeats."""
+    best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"{name:<24}{best * 1e6:>12.2f} us")
+
+
+def main(argv: Any) -> None:
+    """Runs the benchmark."""
+    number = int(argv[0]) if argv else 20000
+    _, key = rsa.newkeys(2048)
+    signer = Signer(key, "adp_token")
+    backend = "orjson" if api._fast_dumps is not None else "json"
+    print(f"JSON backend: {backend}")
+    print(f"body bytes: legacy {len(legacy())}, compact {len(compact())}")
+    report("encode legacy", legacy, number)
+    report("encode compact", compact, number)
+    signed = max(1, number // 1000)
+    date = "2021-10-09T05:02:38Z"
+    report(
+        "encode+sign legacy",
+        lambda: signer.digest_header_for_request("POST", "/SendToKindle", legacy(), date),
+        signed,
+    )
+    report(
+        "encode+sign compact",
+        lambda: signer.digest_header_for_request("POST", "/SendToKindle", compact(), date),
+        signed,
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
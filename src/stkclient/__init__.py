@@ -5,34 +5,120 @@ import dataclasses
 import hashlib
 import json
 import os
+import time
 import urllib.parse
 import urllib.request
 from pathlib import Path
-from typing import Any, BinaryIO, List, Mapping, TextIO, Union
-
-from stkclient import api, model, signer
+from typing import (
+    IO,
+    Any,
+    BinaryIO,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from stkclient import api, epub, formats, model, phases, relay, signer
+from stkclient.cancel import CancelledError, CancelToken
+from stkclient.formats import Policy, PreflightError
+from stkclient.progress import Progress, ProgressCallback
+from stkclient.relay import SourceError
+from stkclient.timeouts import DEFAULT_TIMEOUT, Deadline, DeadlineExceeded, Timeout
+from stkclient.transport import Transport
 
 OwnedDevice = model.OwnedDevice
+UploadLease = model.UploadLease
 
 
 @dataclasses.dataclass()
 class Client:
-    """Supports listing devices and sending files to specific devices."""
+    """Supports listing devices and sending files to specific devices.
+
+    A Client may be shared by many threads, such as the workers of a web server. Its only
+    mutable state is the last-seen upload URL, a hint used to pre-connect, which is replaced in
+    a single assignment. For connection reuse across calls, give it a
+    :class:`stkclient.transport.PooledTransport`; with ``per_thread=True`` each thread reuses its
+    own connections::
+
+        client = Client.load(fp, PooledTransport(per_thread=True))
+
+    Attributes:
+        transport: Transport used for all HTTP requests, or None for the stdlib default.
+    """
 
     _device_info: model.DeviceInfo
     _signer: signer.Signer = dataclasses.field(init=False, repr=False)
+    transport: Optional[Transport] = dataclasses.field(default=None, repr=False, compare=False)
+    _upload_url: Optional[str] = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def __post_init__(self) -> None:
         """Initialize _signer."""
-        self._signer = signer.Signer.from_device_info(self._device_info)
+        with phases.phase("key parse"):
+            self._signer = signer.Signer.from_device_info(self._device_info)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Pickles the client without its transport, which belongs to this process."""
+        state = dict(self.__dict__)
+        state["transport"] = None
+        state["_upload_url"] = None
+        return state
+
+    def warm_up(self, *, background: bool = False) -> None:
+        """Opens connections to the send-to-kindle service and the last-seen upload host.
 
-    def get_owned_devices(self) -> List[OwnedDevice]:
+        Only has an effect with a transport that keeps connections alive, such as
+        :class:`stkclient.transport.PooledTransport`.
+
+        Args:
+            background: If true, return immediately and connect on a background thread.
+        """
+        if self.transport is None:
+            return
+        urls = [f"https://{api.STK_HOST}/"]
+        if self._upload_url is not None:
+            urls.append(self._upload_url)
+        self.transport.warm_up(urls, background=background)
+
+    def get_owned_devices(
+        self,
+        *,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        hedged: bool = False,
+        cancel: Optional[CancelToken] = None,
+    ) -> List[OwnedDevice]:
         """Returns a list of kindle devices owned by the end-user.
 
+        Args:
+            timeout: Connect and read timeouts for the request.
+            hedged: If true, issue a second request when the first is slow, to cut tail latency.
+            cancel: Optional token; CancelledError is raised if it is cancelled before the request.
+
         Returns:
             List of OwnedDevice instances.
         """
-        return api.get_list_of_owned_devices(self._signer).owned_devices
+        return api.get_list_of_owned_devices(
+            self._signer, transport=self.transport, timeout=timeout, hedged=hedged, cancel=cancel
+        ).owned_devices
+
+    def get_upload_lease(
+        self, file_size: int, *, timeout: Timeout = DEFAULT_TIMEOUT
+    ) -> UploadLease:
+        """Obtains an upload URL ahead of time, for a later call to send_file.
+
+        Args:
+            file_size: Size in bytes of the file to be sent.
+            timeout: Connect and read timeouts for the request.
+
+        Returns:
+            UploadLease instance.
+        """
+        return self._get_upload_lease(file_size, timeout, None)
 
     def send_file(
         self,
@@ -41,7 +127,14 @@ class Client:
         *,
         author: str,
         title: str,
-        format: str,
+        format: Optional[str] = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        deadline: Optional[float] = None,
+        progress: Optional[ProgressCallback] = None,
+        lease: Optional[UploadLease] = None,
+        cancel: Optional[CancelToken] = None,
+        policy: Optional[Policy] = formats.DEFAULT_POLICY,
+        minimizer: Optional[epub.Minimizer] = None,
     ) -> str:
         """Sends a file to the specified kindle devices.
 
@@ -50,15 +143,163 @@ class Client:
             target_device_serial_numbers: The devices to receive the file.
             author: The author of the document.
             title: The title of the document.
-            format: The format of the document.
+            format: The format of the document, or None to detect it from the file's content.
+            timeout: Connect and read timeouts for each request.
+            deadline: Seconds within which the whole send must complete, or None for no limit.
+                DeadlineExceeded is raised once it passes.
+            progress: Optional callback receiving Progress snapshots during the upload.
+            lease: Upload URL from get_upload_lease. It is only used if it was obtained for the
+                file's current size and has not expired; otherwise a new one is requested.
+            cancel: Optional token checked between phases and during the upload. CancelledError is
+                raised once it is cancelled. Once it is draining, a send that has not started
+                uploading raises CancelledError, and one that has runs to completion.
+            policy: The formats and sizes to accept. The file is checked against it before any
+                request is made, and PreflightError is raised if the service would reject it.
+                None skips the check, for files the caller has checked; format is then required.
+            minimizer: Optional Minimizer to shrink EPUBs with before uploading them. Its
+                on_report callback receives the bytes and upload time saved.
 
         Returns:
             sku identifier assigned by amazon.
+
+        Raises:
+            ValueError: Neither a policy nor a format was given.
         """
-        file_size = file_path.stat().st_size
-        upload = api.get_upload_url(self._signer, file_size)
+        if cancel is not None:
+            cancel.check_start()
+        d = Deadline(deadline) if deadline is not None else None
+        if policy is not None:
+            with phases.phase("preflight"):
+                format = policy.check(file_path, format)
+        elif format is None:
+            raise ValueError("A format is required when the file isn't checked against a policy")
+        minimized = None
+        if minimizer is not None and formats.normalize(format) == "epub":
+            minimized = minimizer.minimize(file_path)
+            file_path = minimized.path
         with open(file_path, "rb") as f:
-            api.upload_file(upload.upload_url, file_size, f)
+            sku, upload_seconds = self._upload_and_send(
+                f,
+                file_path.stat().st_size,
+                target_device_serial_numbers,
+                author=author,
+                title=title,
+                format=format,
+                timeout=timeout,
+                deadline=d,
+                progress=progress,
+                lease=lease,
+                cancel=cancel,
+            )
+        if minimized is not None and minimizer is not None:
+            minimizer.report(dataclasses.replace(minimized, upload_seconds=upload_seconds))
+        return sku
+
+    def send_from_url(
+        self,
+        url: str,
+        target_device_serial_numbers: List[str],
+        *,
+        author: str,
+        title: str,
+        format: Optional[str] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        source_transport: Optional[Transport] = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        deadline: Optional[float] = None,
+        progress: Optional[ProgressCallback] = None,
+        cancel: Optional[CancelToken] = None,
+        policy: Policy = formats.DEFAULT_POLICY,
+    ) -> str:
+        """Sends a document downloaded from a URL to the specified kindle devices.
+
+        The download is relayed into the upload as it arrives, without writing it to disk, when
+        the source sends a Content-Length. Otherwise it is spooled first; see
+        :func:`stkclient.relay.open_source`.
+
+        Args:
+            url: The document's URL.
+            target_device_serial_numbers: The devices to receive the document.
+            author: The author of the document.
+            title: The title of the document.
+            format: The format of the document, or None to detect it from the document's content.
+            headers: Additional headers for the request to the source, such as Authorization.
+            source_transport: Transport used for the request to the source, or None for the
+                client's transport.
+            timeout: Connect and read timeouts for each request, including the source's.
+            deadline: Seconds within which the whole send must complete, or None for no limit.
+            progress: Optional callback receiving Progress snapshots during the upload.
+            cancel: Optional token checked between phases and during the upload.
+            policy: The formats and sizes to accept, checked before the upload starts.
+
+        Returns:
+            sku identifier assigned by amazon.
+        """
+        if cancel is not None:
+            cancel.check_start()
+        d = Deadline(deadline) if deadline is not None else None
+        with phases.phase("source"):
+            source = relay.open_source(
+                url,
+                transport=source_transport or self.transport,
+                headers=headers,
+                timeout=timeout.clip(d),
+            )
+        with source:
+            with phases.phase("preflight"):
+                header = source.peek(formats.HEADER_BYTES)
+                format = policy.check_header(header, source.size, format, url)
+            sku, _ = self._upload_and_send(
+                source.body,
+                source.size,
+                target_device_serial_numbers,
+                author=author,
+                title=title,
+                format=format,
+                timeout=timeout,
+                deadline=d,
+                progress=progress,
+                lease=None,
+                cancel=cancel,
+            )
+        return sku
+
+    def _upload_and_send(
+        self,
+        fp: IO[bytes],
+        file_size: int,
+        target_device_serial_numbers: List[str],
+        *,
+        author: str,
+        title: str,
+        format: str,
+        timeout: Timeout,
+        deadline: Optional[Deadline],
+        progress: Optional[ProgressCallback],
+        lease: Optional[UploadLease],
+        cancel: Optional[CancelToken],
+    ) -> Tuple[str, float]:
+        """Uploads fp and sends it, returning the sku and the seconds the upload took."""
+        if self.transport is not None and self._upload_url is not None:
+            # Connect to the upload host while waiting for GetUploadUrl
+            self.transport.warm_up([self._upload_url], background=True)
+        if lease is None or lease.file_size != file_size or lease.expired():
+            lease = self._get_upload_lease(file_size, timeout, deadline, cancel)
+        upload = lease.upload
+        self._upload_url = upload.upload_url
+        upload_started = time.monotonic()
+        api.upload_file(
+            upload.upload_url,
+            file_size,
+            fp,
+            transport=self.transport,
+            timeout=timeout,
+            deadline=deadline,
+            progress=progress,
+            cancel=cancel,
+            expires_at=lease.expires_at,
+        )
+        upload_seconds = time.monotonic() - upload_started
         ret = api.send_to_kindle(
             self._signer,
             upload.stk_token,
@@ -66,28 +307,50 @@ class Client:
             author=author,
             title=title,
             format=format,
+            transport=self.transport,
+            timeout=timeout,
+            deadline=deadline,
+            cancel=cancel,
+        )
+        return ret.sku, upload_seconds
+
+    def _get_upload_lease(
+        self,
+        file_size: int,
+        timeout: Timeout,
+        deadline: Optional[Deadline],
+        cancel: Optional[CancelToken] = None,
+    ) -> UploadLease:
+        requested_at = time.monotonic()
+        upload = api.get_upload_url(
+            self._signer,
+            file_size,
+            transport=self.transport,
+            timeout=timeout,
+            deadline=deadline,
+            cancel=cancel,
         )
-        return ret.sku
+        return UploadLease.from_response(upload, file_size, requested_at)
 
     def logout(self) -> None:
         """Logs out the client."""
-        api.logout(self._signer)
+        api.logout(self._signer, transport=self.transport)
 
     @staticmethod
-    def load(fp: Union[TextIO, BinaryIO]) -> "Client":
+    def load(fp: Union[TextIO, BinaryIO], transport: Optional[Transport] = None) -> "Client":
         """Deserializes a client from a file-like object."""
-        return Client._from_dict(json.load(fp))
+        return Client._from_dict(json.load(fp), transport)
 
     @staticmethod
-    def loads(s: str) -> "Client":
+    def loads(s: str, transport: Optional[Transport] = None) -> "Client":
         """Deserializes a client from a string."""
-        return Client._from_dict(json.loads(s))
+        return Client._from_dict(json.loads(s), transport)
 
     @staticmethod
-    def _from_dict(s: Mapping[str, Any]) -> "Client":
+    def _from_dict(s: Mapping[str, Any], transport: Optional[Transport]) -> "Client":
         if s.get("version") != 1:
             raise ValueError("Invalid version")
-        return Client(model.DeviceInfo.from_dict(s.get("device_info", {})))
+        return Client(model.DeviceInfo.from_dict(s.get("device_info", {})), transport)
 
     def dump(self, fp: TextIO) -> None:
         """Serializes the client into a file-like object."""
@@ -104,9 +367,14 @@ class Client:
 class OAuth2:
     """Authenticates an end-user using amazon's OAuth2."""
 
-    def __init__(self) -> None:
-        """Constructs an OAuth2."""
+    def __init__(self, transport: Optional[Transport] = None) -> None:
+        """Constructs an OAuth2.
+
+        Args:
+            transport: Transport used for all HTTP requests, or None for the stdlib default.
+        """
         self._verifier = _base64_url_encode(os.urandom(32))
+        self._transport = transport
 
     def get_signin_url(self) -> str:
         """Gets the signin URL. Open in a web browser to start authentication."""
@@ -142,9 +410,9 @@ class OAuth2:
             Client instance.
         """
         code = _parse_authorization_code(redirect_url)
-        access_token = api.token_exchange(code, self._verifier)
-        device_info = api.register_device_with_token(access_token)
-        return Client(device_info)
+        access_token = api.token_exchange(code, self._verifier, transport=self._transport)
+        device_info = api.register_device_with_token(access_token, transport=self._transport)
+        return Client(device_info, self._transport)
 
 
 def _parse_authorization_code(redirect_url: str) -> str:
@@ -177,4 +445,18 @@ def _sha256(s: bytes) -> bytes:
     return m.digest()
 
 
-__all__ = ["OAuth2", "OwnedDevice", "Client"]
+__all__ = [
+    "OAuth2",
+    "OwnedDevice",
+    "Client",
+    "Timeout",
+    "DeadlineExceeded",
+    "CancelToken",
+    "CancelledError",
+    "Policy",
+    "PreflightError",
+    "SourceError",
+    "Transport",
+    "Progress",
+    "UploadLease",
+]
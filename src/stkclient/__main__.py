@@ -1,11 +1,20 @@
 """Command-line interface."""
 import argparse
+import cProfile
+import glob
+import json
 import os
+import re
 import sys
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, TextIO, Tuple
 
 import stkclient
+from stkclient import batch
+from stkclient import bench as benchmark
+from stkclient import epub, httplog
+from stkclient import loadtest as load
+from stkclient import phases, ratelimit
 
 # Try to import the readline module for improved input() behavior. Without this, pasting a line
 # longer than 1024 chars causes the process to hang on my machine.
@@ -15,6 +24,10 @@ except ModuleNotFoundError:
     pass  # not available on windows
 
 DEFAULT_CLIENT_PATH = os.path.join("$XDG_DATA_HOME", "pystkclient", "client.json")
+DEFAULT_CACHE_PATH = os.path.join("$XDG_CACHE_HOME", "pystkclient", "epub")
+
+# The fields of --title and --author templates
+_TEMPLATE_FIELD = re.compile(r"\{(title|author|name|stem|parent)\}")
 
 
 def arg_parser() -> argparse.ArgumentParser:
@@ -23,6 +36,24 @@ def arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         prog="stkclient", description="Command-line interface for Amazon's Send-to-Kindle service"
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print the time spent in each phase of the command to stderr",
+    )
+    parser.add_argument(
+        "--profile-dump",
+        type=Path,
+        metavar="FILE",
+        help="like --profile, and also write cProfile statistics to FILE for pstats",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="log each HTTP request to stderr; repeat to include its redacted headers",
+    )
     subparsers = parser.add_subparsers()
 
     # create the parser for the "login" command
@@ -49,7 +80,11 @@ def arg_parser() -> argparse.ArgumentParser:
     parser_devices.set_defaults(func=devices)
 
     # create the parser for the "send" command
-    parser_send = subparsers.add_parser("send", help=send.__doc__)
+    parser_send = subparsers.add_parser(
+        "send",
+        help=send.__doc__,
+        epilog="Exits with status 0 if every file was sent, 1 if none was and 3 if some were.",
+    )
     parser_send.add_argument(
         "--client",
         type=str,
@@ -57,23 +92,146 @@ def arg_parser() -> argparse.ArgumentParser:
         help="path to the client details",
     )
     parser_send.add_argument(
-        "--title", type=str, required=True, help="title of the work (required)"
+        "--title",
+        type=str,
+        default="{title}",
+        help="title of each work, a template with the fields {title} (from the file's metadata,"
+        " or else its name without extension), {author} (as given by --author), {name}, {stem}"
+        ' and {parent}, other braces being kept as they are (default "{title}")',
     )
     parser_send.add_argument(
-        "--author", type=str, required=True, help="author of the work (required)"
+        "--author",
+        type=str,
+        default="{author}",
+        help="author of each work, a template with the same fields as --title, {author} being"
+        ' the author in the file\'s metadata, if any (default "{author}")',
     )
     parser_send.add_argument(
-        "--format", type=str, required=True, help='file format, for example "mobi" (required)'
+        "--format",
+        type=str,
+        help='file format, for example "epub" (default: detected from each file\'s content)',
     )
-    parser_send.add_argument("file", type=Path, help="file to send")
     parser_send.add_argument(
-        "target",
+        "-t",
+        "--target",
+        type=str,
+        action="append",
+        metavar="SERIAL",
+        help='device serial number to send the files to, or "all" to send to all devices;'
+        " may be repeated",
+    )
+    parser_send.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="number of files to send at once (default 1)",
+    )
+    parser_send.add_argument(
+        "--limit-rate",
+        type=_parse_rate,
+        metavar="RATE",
+        help='maximum upload rate in bytes/s, optionally suffixed with K, M or G (e.g. "500K")',
+    )
+    parser_send.add_argument(
+        "--minimize",
+        action="store_true",
+        help="shrink EPUBs before uploading them: recompress, downscale images, drop unused"
+        " images and fonts",
+    )
+    parser_send.add_argument(
+        "--cache",
+        type=str,
+        default=DEFAULT_CACHE_PATH,
+        help="directory caching minimized EPUBs",
+    )
+    parser_send.add_argument(
+        "files",
         type=str,
         nargs="+",
-        help='device serial numbers to send the file to, or "all" to send to all devices',
+        metavar="file",
+        help="files or glob patterns to send; without --target, a single file followed by the"
+        " targets",
     )
     parser_send.set_defaults(func=send)
 
+    # create the parser for the "bench" command
+    parser_bench = subparsers.add_parser("bench", help=bench.__doc__)
+    parser_bench.add_argument(
+        "--client",
+        type=str,
+        default=DEFAULT_CLIENT_PATH,
+        help="path to the client details",
+    )
+    parser_bench.add_argument(
+        "--offline",
+        action="store_true",
+        help="measure the network against a local stand-in server instead of amazon",
+    )
+    parser_bench.add_argument(
+        "--json", action="store_true", help="print the results as JSON, times in seconds"
+    )
+    parser_bench.add_argument(
+        "--requests",
+        type=int,
+        default=20,
+        help="number of GetListOfOwnedDevices requests to time (default 20)",
+    )
+    parser_bench.add_argument(
+        "--payload-size",
+        type=_parse_size,
+        default=1024 * 1024,
+        metavar="SIZE",
+        help='size of the synthetic upload, optionally suffixed with K, M or G (default "1M")',
+    )
+    parser_bench.set_defaults(func=bench)
+
+    # create the parser for the "loadtest" command
+    parser_loadtest = subparsers.add_parser("loadtest", help=loadtest.__doc__)
+    parser_loadtest.add_argument(
+        "--client",
+        type=str,
+        default=DEFAULT_CLIENT_PATH,
+        help="path to the client details",
+    )
+    parser_loadtest.add_argument(
+        "--rate", type=float, required=True, help="mean arrival rate in sends per second (required)"
+    )
+    parser_loadtest.add_argument(
+        "--duration",
+        type=float,
+        default=10.0,
+        help="seconds during which sends arrive (default 10)",
+    )
+    parser_loadtest.add_argument(
+        "--sizes",
+        type=_parse_sizes,
+        default="fixed:1M",
+        metavar="DIST",
+        help='file sizes: "fixed:SIZE", "uniform:MIN:MAX" or "lognormal:MEDIAN:SIGMA"'
+        ' (default "fixed:1M")',
+    )
+    parser_loadtest.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=8,
+        help="maximum number of sends in flight (default 8)",
+    )
+    parser_loadtest.add_argument(
+        "--service-latency",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="delay the stand-in server adds to every response (default 0)",
+    )
+    parser_loadtest.add_argument("--seed", type=int, help="seed for repeatable runs")
+    parser_loadtest.add_argument(
+        "--json", action="store_true", help="print the results as JSON, times in seconds"
+    )
+    parser_loadtest.set_defaults(func=loadtest)
+
     # create the parser for the "logout" command
     parser_logout = subparsers.add_parser("logout", help=logout.__doc__)
     parser_logout.add_argument(
@@ -84,7 +242,6 @@ def arg_parser() -> argparse.ArgumentParser:
     )
     parser_logout.set_defaults(func=logout)
 
-    # TODO verbosity
     return parser
 
 
@@ -95,7 +252,12 @@ def main(args: Optional[List[str]] = None) -> None:
     if not hasattr(parsed, "func"):
         parser.print_usage()
         exit(1)
-    parsed.func(parsed)
+    if parsed.verbose:
+        httplog.configure(parsed.verbose)
+    if parsed.profile or parsed.profile_dump is not None:
+        _run_profiled(parsed)
+    else:
+        parsed.func(parsed)
 
 
 def login(args: argparse.Namespace) -> None:
@@ -120,41 +282,353 @@ def login(args: argparse.Namespace) -> None:
 
 def devices(args: argparse.Namespace) -> None:
     """List available kindle reader devices."""
-    client_path = _get_client_path(args)
-    if not client_path.exists():
-        print(f"{client_path} does not exist", file=sys.stderr)
-        exit(1)
-    with open(client_path) as f:
-        client = stkclient.Client.load(f)
-    devices = client.get_owned_devices()
+    client = _load_client(args)
+    with phases.phase("device lookup"):
+        devices = client.get_owned_devices()
     for device in devices:
         print(f"{device.device_serial_number}: {device.device_name}")
 
 
 def send(args: argparse.Namespace) -> None:
-    """Send a file to one or more devices."""
+    """Send files to one or more devices."""
+    patterns, target = _send_targets(args)
+    paths = _expand_files(patterns)
+    if len(paths) == 1:
+        _send_one(paths[0], target, args)
+        return
+    jobs: List[batch.SendJob] = []
+    results: List[batch.SendResult] = []
+    for path in paths:
+        try:
+            jobs.append(_send_job(path, target, args))
+        except (stkclient.PreflightError, OSError) as e:
+            job = batch.SendJob(path, target, author="", title="", format=args.format or "")
+            results.append(batch.SendResult(job, error=e))
+    if jobs:
+        client, minimizer = _prepare_send(jobs, args)
+        # The files were checked by _send_job
+        sender = batch.BatchSender(client, max_workers=args.jobs, minimizer=minimizer, policy=None)
+        results.extend(sender.send(jobs))
+    sent = _print_send_summary(results)
+    if sent < len(results):
+        exit(1 if sent == 0 else 3)
+
+
+def bench(args: argparse.Namespace) -> None:
+    """Measure signing, connection and request performance of a client."""
     client_path = _get_client_path(args)
     if not client_path.exists():
         print(f"{client_path} does not exist", file=sys.stderr)
         exit(1)
-    with open(client_path) as f:
-        client = stkclient.Client.load(f)
-    target: List[str] = args.target
-    if any(t == "all" for t in args.target):
-        target = [d.device_serial_number for d in client.get_owned_devices()]
-    client.send_file(args.file, target, author=args.author, title=args.title, format=args.format)
+    report = benchmark.run(
+        client_path.read_text(),
+        offline=args.offline,
+        requests=args.requests,
+        payload_size=args.payload_size,
+    )
+    if args.json:
+        print(json.dumps(report.to_dict(), indent=2))
+    else:
+        print(report.format())
+
+
+def loadtest(args: argparse.Namespace) -> None:
+    """Drive sends at a target rate against a local stand-in server."""
+    client = _load_client(args)
+    report = load.run(
+        client,
+        rate=args.rate,
+        duration=args.duration,
+        sizes=args.sizes,
+        concurrency=args.concurrency,
+        service_latency=args.service_latency,
+        seed=args.seed,
+    )
+    if args.json:
+        print(json.dumps(report.to_dict(), indent=2))
+    else:
+        print(report.format())
 
 
 def logout(args: argparse.Namespace) -> None:
     """Deauthorize and delete a client."""
+    c = _load_client(args)
+    c.logout()
+    _get_client_path(args).unlink()
+
+
+class _ProgressBar:
+    """Renders upload progress as a single self-updating terminal line."""
+
+    def __init__(self, out: TextIO, width: int = 30) -> None:
+        self._out = out
+        self._width = width
+
+    def __call__(self, p: stkclient.Progress) -> None:
+        filled = int(p.fraction * self._width)
+        bar = "#" * filled + "-" * (self._width - filled)
+        eta = "--" if p.eta is None else f"{p.eta:.0f}s"
+        line = (
+            f"\r[{bar}] {p.fraction:4.0%} {_format_bytes(p.bytes_sent)}/{_format_bytes(p.total)}"
+            f" {_format_bytes(p.rate)}/s (avg {_format_bytes(p.average_rate)}/s) ETA {eta} "
+        )
+        self._out.write(line)
+        if p.bytes_sent >= p.total:
+            self._out.write("\n")
+        self._out.flush()
+
+
+def _send_targets(args: argparse.Namespace) -> Tuple[List[str], List[str]]:
+    """Returns the file patterns and targets of a send, from the legacy form if no --target."""
+    if args.jobs < 1:
+        print("--jobs must be at least 1", file=sys.stderr)
+        exit(2)
+    if args.target is not None:
+        return args.files, args.target
+    if len(args.files) < 2:
+        print("No target devices; pass them with --target", file=sys.stderr)
+        exit(2)
+    file, *target = args.files
+    # Without --target every argument after the first is a device serial, so a second file
+    # would be taken for one
+    if _is_pattern(file) or any(_is_file_name(t) for t in target):
+        print("Pass the target devices with --target to send several files", file=sys.stderr)
+        exit(2)
+    return [file], target
+
+
+def _is_pattern(s: str) -> bool:
+    return any(c in s for c in "*?[")
+
+
+def _is_file_name(s: str) -> bool:
+    """Returns whether s is spelled like a file name or pattern, which no device serial is.
+
+    Example:
+        >>> from stkclient.__main__ import _is_file_name
+        >>> _is_file_name("G000PP1234567890"), _is_file_name("b.epub"), _is_file_name("*")
+        (False, True, True)
+    """
+    return _is_pattern(s) or any(c in s for c in ("/", os.sep, "."))
+
+
+def _expand_files(patterns: List[str]) -> List[Path]:
+    """Expands glob patterns, for shells that don't, keeping patterns that match nothing."""
+    paths: Dict[Path, None] = {}
+    for pattern in patterns:
+        for match in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            paths.setdefault(Path(match))
+    return list(paths)
+
+
+def _send_job(path: Path, target: List[str], args: argparse.Namespace) -> batch.SendJob:
+    """Checks a file and renders its title and author templates.
+
+    Example:
+        >>> import argparse, tempfile
+        >>> from pathlib import Path
+        >>> from stkclient.__main__ import _send_job
+        >>> path = Path(tempfile.mkdtemp()) / "moby-dick.txt"
+        >>> _ = path.write_text("Call me Ishmael.")
+        >>> args = argparse.Namespace(title="{title} ({name})", author="{author}", format=None)
+        >>> job = _send_job(path, ["all"], args)
+        >>> job.title, job.author, job.format
+        ('moby-dick (moby-dick.txt)', '', 'txt')
+    """
+    with phases.phase("preflight"):
+        format = stkclient.formats.DEFAULT_POLICY.check(path, args.format)
+    metadata = epub.read_metadata(path) if stkclient.formats.normalize(format) == "epub" else {}
+    fields = {
+        "title": metadata.get("title", path.stem),
+        "author": metadata.get("author", ""),
+        "name": path.name,
+        "stem": path.stem,
+        "parent": path.resolve().parent.name,
+    }
+    fields["author"] = author = _render(args.author, fields)
+    return batch.SendJob(
+        path, target, author=author, title=_render(args.title, fields), format=format
+    )
+
+
+def _render(template: str, fields: Dict[str, str]) -> str:
+    """Replaces the {field} placeholders of a --title or --author template with their values.
+
+    Any other text, braces included, is kept as it is.
+
+    Example:
+        >>> from stkclient.__main__ import _render
+        >>> _render("{stem} {draft} {}", {"stem": "notes"})
+        'notes {draft} {}'
+    """
+    return _TEMPLATE_FIELD.sub(lambda m: fields.get(m.group(1), m.group(0)), template)
+
+
+def _send_one(path: Path, target: List[str], args: argparse.Namespace) -> None:
+    """Sends a single file, drawing a progress bar if stderr is a terminal."""
+    try:
+        job = _send_job(path, target, args)
+    except (stkclient.PreflightError, OSError) as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    client, minimizer = _prepare_send([job], args)
+    client.send_file(
+        job.file_path,
+        job.target_device_serial_numbers,
+        author=job.author,
+        title=job.title,
+        format=job.format,
+        progress=_ProgressBar(sys.stderr) if sys.stderr.isatty() else None,
+        policy=None,  # Checked by _send_job
+        minimizer=minimizer,
+    )
+
+
+def _prepare_send(
+    jobs: List[batch.SendJob], args: argparse.Namespace
+) -> Tuple[stkclient.Client, Optional[epub.Minimizer]]:
+    """Loads the client, resolves the "all" target and applies the upload options."""
+    client = _load_client(args)
+    if any(t == "all" for t in jobs[0].target_device_serial_numbers):
+        with phases.phase("device lookup"):
+            target = [d.device_serial_number for d in client.get_owned_devices()]
+        for job in jobs:
+            job.target_device_serial_numbers = target
+    if args.limit_rate is not None:
+        ratelimit.default_bandwidth_limiter().set_rate(args.limit_rate)
+    return client, _minimizer(args)
+
+
+def _minimizer(args: argparse.Namespace) -> Optional[epub.Minimizer]:
+    if not args.minimize:
+        return None
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join("~", ".cache"))
+    cache_dir = Path(args.cache.replace("$XDG_CACHE_HOME", cache_home)).expanduser()
+    return epub.Minimizer(cache_dir, on_report=_print_minimize_report)
+
+
+def _print_send_summary(results: List[batch.SendResult]) -> int:
+    """Prints a line per file and a total, and returns the number of files sent."""
+    for r in results:
+        status = "sent" if r.ok else "error"
+        detail = r.sku if r.ok else f"{type(r.error).__name__}: {r.error}"
+        print(f"{status:<6}{r.job.file_path}  {r.elapsed:.2f}s  {detail}")
+    sent = sum(r.ok for r in results)
+    print(f"{sent} of {len(results)} files sent")
+    return sent
+
+
+def _print_minimize_report(report: epub.MinimizeReport) -> None:
+    saved = report.upload_seconds_saved
+    print(
+        f"minimized {report.source.name}{' (cached)' if report.cached else ''}:"
+        f" {_format_bytes(report.original_size)} -> {_format_bytes(report.size)},"
+        f" saved {_format_bytes(report.bytes_saved)}"
+        + (f" and about {saved:.1f}s of upload" if saved is not None else ""),
+        file=sys.stderr,
+    )
+
+
+def _parse_rate(s: str) -> float:
+    """Parses a byte rate with an optional binary K, M or G suffix.
+
+    Example:
+        >>> from stkclient.__main__ import _parse_rate
+        >>> _parse_rate("500K"), _parse_rate("1.5m"), _parse_rate("100")
+        (512000.0, 1572864.0, 100.0)
+    """
+    return _parse_quantity(s, "rate")
+
+
+def _parse_size(s: str) -> int:
+    """Parses a byte count with an optional binary K, M or G suffix.
+
+    Example:
+        >>> from stkclient.__main__ import _parse_size
+        >>> _parse_size("1M"), _parse_size("10")
+        (1048576, 10)
+    """
+    return int(_parse_quantity(s, "size"))
+
+
+def _parse_sizes(s: str) -> load.SizeDistribution:
+    """Parses a file size distribution such as "uniform:100K:2M".
+
+    Example:
+        >>> import random
+        >>> from stkclient.__main__ import _parse_sizes
+        >>> _parse_sizes("fixed:1K")(random.Random())
+        1024
+    """
+    kind, *params = s.split(":")
+    try:
+        if kind == "fixed" and len(params) == 1:
+            return load.fixed(_parse_size(params[0]))
+        if kind == "uniform" and len(params) == 2:
+            return load.uniform(_parse_size(params[0]), _parse_size(params[1]))
+        if kind == "lognormal" and len(params) == 2:
+            return load.lognormal(_parse_size(params[0]), float(params[1]))
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"invalid size distribution: {s!r}")
+
+
+def _parse_quantity(s: str, name: str) -> float:
+    multipliers = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    s = s.strip().upper()
+    multiplier = multipliers.get(s[-1:], 1)
+    if multiplier != 1:
+        s = s[:-1]
+    try:
+        value = float(s) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid {name}: {s!r}") from None
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"{name} must be positive")
+    return value
+
+
+def _format_bytes(n: float) -> str:
+    """Formats a byte count with a binary unit suffix.
+
+    Example:
+        >>> from stkclient.__main__ import _format_bytes
+        >>> _format_bytes(512), _format_bytes(3 * 1024 * 1024)
+        ('512B', '3.0MiB')
+    """
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GiB"
+
+
+def _run_profiled(args: argparse.Namespace) -> None:
+    """Runs the command, then prints its phase timings and writes any cProfile dump."""
+    timer = phases.PhaseTimer()
+    previous = phases.phase_timer()
+    phases.set_phase_timer(timer)
+    profiler = cProfile.Profile() if args.profile_dump is not None else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        with timer.phase(args.func.__name__):
+            args.func(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_dump)
+        phases.set_phase_timer(previous)
+        print(timer.report(), file=sys.stderr)
+
+
+def _load_client(args: argparse.Namespace) -> stkclient.Client:
     client_path = _get_client_path(args)
     if not client_path.exists():
         print(f"{client_path} does not exist", file=sys.stderr)
         exit(1)
-    with open(client_path) as f:
-        c = stkclient.Client.load(f)
-    c.logout()
-    client_path.unlink()
+    with phases.phase("client load"), open(client_path) as f:
+        return stkclient.Client.load(f)
 
 
 def _get_client_path(args: argparse.Namespace) -> Path:
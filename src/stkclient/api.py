@@ -1,19 +1,59 @@
-"""Typed wrapper functions for the amazon auth and stk APIs."""
+"""Typed wrapper functions for the amazon auth and stk APIs.
 
+All requests are sent by a :class:`stkclient.transport.Transport` (by default the stdlib-based
+``stkclient.transport.DEFAULT_TRANSPORT``) and pass through the process-wide
+:class:`stkclient.ratelimit.RateLimiter`, which paces requests per endpoint and retries throttled
+(HTTP 429 or 503) responses with backoff. Every request is bounded by a
+:class:`stkclient.timeouts.Timeout` and, optionally, a :class:`stkclient.timeouts.Deadline`
+shared by a sequence of calls. Each attempt of a request can be logged with
+:mod:`stkclient.httplog`.
+
+The functions are safe to call from many threads at once: they keep no state between calls
+besides the rate limiter and latency trackers, which are locked.
+"""
+
+import functools
 import http.client
+import io
 import json
+import socket
+import ssl
+import time
 import urllib.error
 import urllib.parse
-import urllib.request
-from typing import IO, Any, List, Mapping, Optional
+from dataclasses import dataclass
+from typing import IO, Any, Callable, List, Mapping, Optional, Tuple, cast
 
+from stkclient import httplog, phases, ratelimit
+from stkclient.cancel import CancellableReader, CancelToken
 from stkclient.model import (
     DeviceInfo,
     GetOwnedDevicesResponse,
     GetUploadUrlResponse,
     SendToKindleResponse,
 )
+from stkclient.progress import DEFAULT_PROGRESS_BYTES, ProgressCallback, ProgressReader
+from stkclient.readers import ReaderWrapper
 from stkclient.signer import Signer
+from stkclient.timeouts import (
+    DEFAULT_TIMEOUT,
+    Deadline,
+    DeadlineExceeded,
+    DeadlineReader,
+    Timeout,
+    hedge,
+    hedge_delay,
+    latency_tracker,
+)
+from stkclient.transport import DEFAULT_TRANSPORT, Body, Transport
+
+_fast_dumps: Optional[Callable[[Any], bytes]]
+try:
+    from orjson import dumps as _fast_dumps
+except ImportError:
+    _fast_dumps = None
+
+STK_HOST = "stkservice.amazon.com"
 
 DEFAULT_CLIENT_INFO = {
     "appName": "ShellExtension",
@@ -26,23 +66,104 @@ DEFAULT_CLIENT_INFO = {
 class APIError(ValueError):
     """Represents errors returned in HTTP response of the API."""
 
-    def __init__(self, msg: str, body: Optional[bytes]):
+    def __init__(self, msg: str, body: Optional[bytes] = None):
         """Construct an APIError with a given message and response body."""
         if body is not None:
             try:
-                body = json.loads(body)
-            except json.JSONDecodeError:
-                body = body
-            msg += f" {json.dumps(body)}"
+                detail = json.loads(body)
+            except ValueError:
+                detail = body.decode("utf-8", "replace")
+            msg += f" {json.dumps(detail)}"
         super().__init__(msg)
 
 
-def token_exchange(authorization_code: str, code_verifier: str) -> str:
+@dataclass(frozen=True)
+class UploadRetry:
+    """How upload_file retries an upload that fails part way, such as on a connection reset.
+
+    A retry rewinds the body and sends it again on a new connection to the same URL, after the
+    rate limiter's backoff. Only failures for which :func:`is_retryable` is true are retried.
+    Throttled attempts are retried up to the rate limiter's max_retries, and count towards the
+    same total as failed ones.
+
+    Attributes:
+        max_retries: How many times an upload is retried after failing, throttled attempts
+            included.
+        spool_size: Largest body of a non-seekable file that is kept in memory as it is sent, so
+            that it can be sent again. Larger ones are not retried.
+        expiry_margin: Seconds of validity the upload URL must have left for a retry to start.
+    """
+
+    max_retries: int = 3
+    spool_size: int = 16 * 1024 * 1024
+    expiry_margin: float = 5.0
+
+
+DEFAULT_UPLOAD_RETRY = UploadRetry()
+
+
+class _HTTPStatusError(Exception):
+    """Raised internally for a non-2xx HTTP response, before conversion to APIError.
+
+    Attributes:
+        status: The HTTP status code.
+        reason: The HTTP reason phrase.
+        body: The response body.
+        retry_after: The parsed Retry-After header, if any.
+    """
+
+    def __init__(
+        self, status: int, reason: str, body: bytes, retry_after: Optional[float] = None
+    ) -> None:
+        """Construct an _HTTPStatusError from the parts of a response."""
+        super().__init__(f"HTTP Error {status}: {reason}")
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Returns whether a request that failed with error may succeed if it is sent again.
+
+    Network errors (connection resets and refusals, timeouts, TLS connections cut short,
+    truncated responses), throttling and 5xx responses are retryable. Client errors (4xx), other
+    OS errors such as failing to read the file being sent, deadlines, cancellation and a failing
+    body source, such as a relayed download, are not.
+
+    Example:
+        >>> from stkclient.api import is_retryable
+        >>> is_retryable(ConnectionResetError()), is_retryable(PermissionError())
+        (True, False)
+    """
+    if isinstance(error, _HTTPStatusError):
+        return error.status >= 500 or error.status in ratelimit.THROTTLE_STATUSES
+    if isinstance(error, urllib.error.URLError) and isinstance(error.reason, BaseException):
+        return is_retryable(error.reason)  # How urllib reports network errors
+    if isinstance(error, DeadlineExceeded):
+        return False
+    return isinstance(
+        error,
+        (ConnectionError, TimeoutError, socket.timeout, ssl.SSLEOFError, http.client.HTTPException),
+    )
+
+
+def token_exchange(
+    authorization_code: str,
+    code_verifier: str,
+    *,
+    transport: Optional[Transport] = None,
+    timeout: Timeout = DEFAULT_TIMEOUT,
+    deadline: Optional[Deadline] = None,
+) -> str:
     """Exchange an authorization code obtained from the final oauth redirect for an access token.
 
     Args:
         authorization_code: The authorization code obtained from the final oauth redirect.
         code_verifier: The code verifier that was originally generated before the auth request.
+        transport: Transport used to send the request, or None for the default.
+        timeout: Connect and read timeouts for the request.
+        deadline: Optional deadline for the request, including retries.
 
     Returns:
         The access token as a string.
@@ -60,31 +181,36 @@ def token_exchange(authorization_code: str, code_verifier: str) -> str:
         "source_token": authorization_code,
         "source_token_type": "authorization_code",
     }
-    req = urllib.request.Request(
-        url="https://api.amazon.com/auth/token",
-        data=json.dumps(body).encode("utf-8"),
-        headers={
-            "Accept-Language": "en-US",
-            "x-amzn-identity-auth-domain": "api.amazon.com",
-            "Content-Type": "application/json",
-            "User-Agent": "Mozilla/5.0",
-        },
-        method="POST",
-    )
+    headers = {
+        "Accept-Language": "en-US",
+        "x-amzn-identity-auth-domain": "api.amazon.com",
+        "Content-Type": "application/json",
+        "User-Agent": "Mozilla/5.0",
+    }
+    data = json.dumps(body).encode("utf-8")
+    url = "https://api.amazon.com/auth/token"
     try:
-        with urllib.request.urlopen(req) as r:  # noqa S310
-            res = json.load(r)
-    except urllib.error.HTTPError as e:
-        raise APIError(str(e), _text(e)) from e
+        res = json.loads(_send(transport, "POST", url, headers, data, timeout, deadline))
+    except _HTTPStatusError as e:
+        raise APIError(str(e), e.body) from e
     access_token: str = res["access_token"]
     return access_token
 
 
-def register_device_with_token(access_token: str) -> DeviceInfo:
+def register_device_with_token(
+    access_token: str,
+    *,
+    transport: Optional[Transport] = None,
+    timeout: Timeout = DEFAULT_TIMEOUT,
+    deadline: Optional[Deadline] = None,
+) -> DeviceInfo:
     """Creates a long-lived device capable of interacting with the STK API from an access_token.
 
     Args:
         access_token: The access token obtained from token exchange
+        transport: Transport used to send the request, or None for the default.
+        timeout: Connect and read timeouts for the request.
+        deadline: Optional deadline for the request, including retries.
 
     Returns:
         DeviceInfo instance with the newly created device.
@@ -104,29 +230,40 @@ def register_device_with_token(access_token: str) -> DeviceInfo:
     }
     body = f"""<?xml version='1.0' encoding='UTF-8'?>
 <request><parameters><deviceType>{q["device_type"]}</deviceType><deviceSerialNumber>{q["device_serial_number"]}</deviceSerialNumber><pid>{q["pid"]}</pid><authToken>{q["auth_token"]}</authToken><authTokenType>{q["auth_token_type"]}</authTokenType><softwareVersion>{q["software_version"]}</softwareVersion><os_version>{q["os_version"]}</os_version><device_model>{q["device_model"]}</device_model></parameters></request>"""
-    req = urllib.request.Request(
-        url="https://firs-ta-g7g.amazon.com/FirsProxy/registerDeviceWithToken",
-        data=body.encode(),
-        headers={
-            "Content-Type": "text/xml",
-            "Expect": "",
-            "Accept-Language": "en-US,*",
-            "User-Agent": "Mozilla/5.0",
-        },
-        method="POST",
-    )
+    headers = {
+        "Content-Type": "text/xml",
+        "Expect": "",
+        "Accept-Language": "en-US,*",
+        "User-Agent": "Mozilla/5.0",
+    }
+    url = "https://firs-ta-g7g.amazon.com/FirsProxy/registerDeviceWithToken"
     try:
-        with urllib.request.urlopen(req) as r:  # noqa S310
-            return DeviceInfo.from_xml(r.read())
-    except urllib.error.HTTPError as e:
-        raise APIError(str(e), _text(e)) from e
+        return DeviceInfo.from_xml(
+            _send(transport, "POST", url, headers, body.encode(), timeout, deadline)
+        )
+    except _HTTPStatusError as e:
+        raise APIError(str(e), e.body) from e
 
 
-def get_list_of_owned_devices(signer: Signer) -> GetOwnedDevicesResponse:
+def get_list_of_owned_devices(
+    signer: Signer,
+    *,
+    transport: Optional[Transport] = None,
+    timeout: Timeout = DEFAULT_TIMEOUT,
+    deadline: Optional[Deadline] = None,
+    hedged: bool = False,
+    cancel: Optional[CancelToken] = None,
+) -> GetOwnedDevicesResponse:
     """Gets a list of send-to-kindle target devices.
 
     Args:
         signer: Signer instance to authenticate the client.
+        transport: Transport used to send the request, or None for the default.
+        timeout: Connect and read timeouts for the request.
+        deadline: Optional deadline for the request, including retries.
+        hedged: If true, issue a second request when the first is slower than the endpoint's
+            recent p95 latency, and use whichever response arrives first.
+        cancel: Optional token checked before each attempt.
 
     Returns:
         GetOwnedDevicesResponse containing owned devices.
@@ -134,18 +271,36 @@ def get_list_of_owned_devices(signer: Signer) -> GetOwnedDevicesResponse:
     Raises:
         APIError: The HTTP request failed.
     """
+    path = "/GetListOfOwnedDevices"
+    call = functools.partial(_request, path, signer, {}, transport, timeout, deadline, cancel)
     try:
-        return GetOwnedDevicesResponse.from_dict(_request("/GetListOfOwnedDevices", signer, {}))
-    except urllib.error.HTTPError as e:
-        raise APIError(str(e), _text(e)) from e
+        with phases.phase("GetListOfOwnedDevices"):
+            if hedged:
+                delay = hedge_delay(latency_tracker(STK_HOST + path))
+                return GetOwnedDevicesResponse.from_dict(hedge(call, delay))
+            return GetOwnedDevicesResponse.from_dict(call())
+    except _HTTPStatusError as e:
+        raise APIError(str(e), e.body) from e
 
 
-def get_upload_url(signer: Signer, file_size: int) -> GetUploadUrlResponse:
+def get_upload_url(
+    signer: Signer,
+    file_size: int,
+    *,
+    transport: Optional[Transport] = None,
+    timeout: Timeout = DEFAULT_TIMEOUT,
+    deadline: Optional[Deadline] = None,
+    cancel: Optional[CancelToken] = None,
+) -> GetUploadUrlResponse:
     """Gets a URL where the client can send the file contents via HTTP POST request.
 
     Args:
         signer: Signer instance to authenticate the client.
         file_size: Size of the file to be uploaded.
+        transport: Transport used to send the request, or None for the default.
+        timeout: Connect and read timeouts for the request.
+        deadline: Optional deadline for the request, including retries.
+        cancel: Optional token checked before each attempt.
 
     Returns:
         GetUploadUrlResponse containing the upload URL and token.
@@ -153,21 +308,54 @@ def get_upload_url(signer: Signer, file_size: int) -> GetUploadUrlResponse:
     Raises:
         APIError: The HTTP request failed.
     """
+    body = {"fileSize": file_size}
     try:
-        return GetUploadUrlResponse.from_dict(
-            _request("/GetUploadUrl", signer, {"fileSize": file_size})
-        )
-    except urllib.error.HTTPError as e:
-        raise APIError(str(e), _text(e)) from e
-
-
-def upload_file(url: str, file_size: int, fp: IO[Any]) -> None:
+        with phases.phase("GetUploadUrl"):
+            return GetUploadUrlResponse.from_dict(
+                _request("/GetUploadUrl", signer, body, transport, timeout, deadline, cancel)
+            )
+    except _HTTPStatusError as e:
+        raise APIError(str(e), e.body) from e
+
+
+def upload_file(
+    url: str,
+    file_size: int,
+    fp: IO[Any],
+    *,
+    transport: Optional[Transport] = None,
+    timeout: Timeout = DEFAULT_TIMEOUT,
+    deadline: Optional[Deadline] = None,
+    progress: Optional[ProgressCallback] = None,
+    progress_every: int = DEFAULT_PROGRESS_BYTES,
+    bandwidth: Optional[ratelimit.BandwidthLimiter] = None,
+    cancel: Optional[CancelToken] = None,
+    retry: UploadRetry = DEFAULT_UPLOAD_RETRY,
+    expires_at: Optional[float] = None,
+) -> None:
     """Perform a streaming upload of a file to the supplied URL via HTTP PUT request.
 
+    Throttled uploads (HTTP 429 or 503) are retried with backoff, and uploads that fail with a
+    retryable error are retried as configured by retry, while the URL has not expired. Both
+    count towards one limit on retries, and are only retried if fp is seekable, or small enough
+    to be kept in memory as it is sent.
+
     Args:
         url: Where to upload the file
         file_size: Size of the file to be uploaded.
         fp: Readable binary file-like object to upload.
+        transport: Transport used to send the request, or None for the default.
+        timeout: Connect timeout, and timeout for each socket read or write of the upload.
+        deadline: Optional deadline for the upload, including retries. It is checked between
+            chunks, and the upload stops, closing its connection, once it passes.
+        progress: Optional callback receiving Progress snapshots as the file is sent.
+        progress_every: Minimum number of bytes between progress callbacks.
+        bandwidth: Limiter capping upload throughput, or None for the process-wide limiter.
+        cancel: Optional token. The upload doesn't start once it is draining, and stops between
+            chunks, closing its connection, once it is cancelled.
+        retry: How uploads that fail part way are retried.
+        expires_at: Time on the monotonic clock after which the URL must not be used, such as
+            UploadLease.expires_at, or None if it is unknown.
 
     Raises:
         ValueError: The supplied URL is invalid.
@@ -176,27 +364,126 @@ def upload_file(url: str, file_size: int, fp: IO[Any]) -> None:
     u = urllib.parse.urlparse(url)
     if u.hostname is None:
         raise ValueError("Invalid URL")
-    conn = http.client.HTTPSConnection(u.hostname)  # noqa: S309
+    if cancel is not None:
+        cancel.check_start()
+    headers = {
+        "Accept-Encoding": "gzip, deflate",
+        "Accept-Language": "en-US,*",
+        "Content-Length": str(file_size),
+        "User-Agent": "Mozilla/5.0",
+    }
+    if retry.max_retries > 0 and not fp.seekable() and file_size <= retry.spool_size:
+        fp = cast(IO[Any], _SpoolingReader(fp))
+    if bandwidth is None:
+        bandwidth = ratelimit.default_bandwidth_limiter()
+    fp = cast(IO[Any], ratelimit.ThrottledReader(fp, bandwidth))
+    if progress is not None:
+        fp = cast(IO[Any], ProgressReader(fp, file_size, progress, progress_every))
+    if cancel is not None:
+        fp = cast(IO[Any], CancellableReader(fp, cancel))
+    if deadline is not None:
+        fp = cast(IO[Any], DeadlineReader(fp, deadline))
     try:
-        headers = {
-            "Accept-Encoding": "gzip, deflate",
-            "Accept-Language": "en-US,*",
-            "Content-Length": str(file_size),
-            "User-Agent": "Mozilla/5.0",
-        }
-        conn.request(
-            "PUT",
-            url,
-            body=fp,
-            headers=headers,
-        )
-        res = conn.getresponse()
-        text = res.read()
-        if res.status != 200:
-            msg = f"HTTP Status Error {res.status} {res.reason}"
-            raise APIError(msg, text)
-    finally:
-        conn.close()
+        _put(transport, url, headers, fp, timeout, deadline, cancel, retry, expires_at)
+    except _HTTPStatusError as e:
+        raise APIError(str(e), e.body) from e
+
+
+def _put(
+    transport: Optional[Transport],
+    url: str,
+    headers: Mapping[str, str],
+    fp: IO[Any],
+    timeout: Timeout,
+    deadline: Optional[Deadline],
+    cancel: Optional[CancelToken],
+    retry: UploadRetry,
+    expires_at: Optional[float],
+) -> None:
+    """Sends fp in a PUT request, rewinding it and sending it again while it fails retryably.
+
+    Throttled attempts are retried here rather than by _send, so that they share the count of
+    retries with failed ones.
+    """
+    offset = fp.tell() if fp.seekable() else None
+    limiter = ratelimit.default_limiter()
+    attempt = 0
+    while True:
+        try:
+            with phases.phase("upload"):
+                _send(
+                    transport,
+                    "PUT",
+                    url,
+                    headers,
+                    fp,
+                    timeout,
+                    deadline,
+                    cancel,
+                    attempt=attempt,
+                    retry_throttled=False,
+                )
+            return
+        except Exception as e:
+            retry_after = e.retry_after if isinstance(e, _HTTPStatusError) else None
+            delay = limiter.backoff(attempt, retry_after)
+            if offset is None or not _may_retry_upload(e, attempt, delay, retry, expires_at):
+                raise
+        limiter.sleep(delay)
+        if deadline is not None:
+            deadline.check()
+        fp.seek(offset)
+        attempt += 1
+
+
+def _may_retry_upload(
+    error: Exception,
+    attempt: int,
+    delay: float,
+    retry: UploadRetry,
+    expires_at: Optional[float],
+) -> bool:
+    throttled = isinstance(error, _HTTPStatusError) and error.status in ratelimit.THROTTLE_STATUSES
+    max_retries = ratelimit.default_limiter().max_retries if throttled else retry.max_retries
+    if attempt >= max_retries or not is_retryable(error):
+        return False
+    return expires_at is None or time.monotonic() + delay + retry.expiry_margin < expires_at
+
+
+class _SpoolingReader(ReaderWrapper):
+    """Keeps what is read from a non-seekable file in memory, so that it can be read again."""
+
+    def __init__(self, fp: IO[bytes]) -> None:
+        super().__init__(fp)
+        self._spool = bytearray()
+        self._pos = 0
+
+    def read(self, amt: Optional[int] = -1) -> bytes:
+        if amt is None or amt < 0:
+            data = bytes(self._spool[self._pos :]) + self._read_source(-1)
+        elif self._pos < len(self._spool):
+            data = bytes(self._spool[self._pos : self._pos + amt])
+        else:
+            data = self._read_source(amt)
+        self._pos += len(data)
+        return data
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence != io.SEEK_SET or not 0 <= offset <= len(self._spool):
+            raise io.UnsupportedOperation("Can only seek to data already read")
+        self._pos = offset
+        return offset
+
+    def _read_source(self, amt: int) -> bytes:
+        data = self._fp.read(amt)
+        self._spool += data
+        return data
 
 
 def send_to_kindle(
@@ -207,6 +494,10 @@ def send_to_kindle(
     author: str,
     title: str,
     format: str,
+    transport: Optional[Transport] = None,
+    timeout: Timeout = DEFAULT_TIMEOUT,
+    deadline: Optional[Deadline] = None,
+    cancel: Optional[CancelToken] = None,
 ) -> SendToKindleResponse:
     """Send an uploaded file to the specified kindle devices.
 
@@ -217,6 +508,10 @@ def send_to_kindle(
         author: The author of the document.
         title: The title of the document.
         format: The format of the document.
+        transport: Transport used to send the request, or None for the default.
+        timeout: Connect and read timeouts for the request.
+        deadline: Optional deadline for the request, including retries.
+        cancel: Optional token checked before each attempt.
 
     Returns:
         SendToKindleResponse containing metadata about the sent file.
@@ -238,68 +533,236 @@ def send_to_kindle(
         "targetDevices": target_device_serial_numbers,
     }
     try:
-        return SendToKindleResponse.from_dict(_request("/SendToKindle", signer, body))
-    except urllib.error.HTTPError as e:
-        raise APIError(str(e), _text(e)) from e
+        with phases.phase("SendToKindle"):
+            return SendToKindleResponse.from_dict(
+                _request("/SendToKindle", signer, body, transport, timeout, deadline, cancel)
+            )
+    except _HTTPStatusError as e:
+        raise APIError(str(e), e.body) from e
 
 
-def logout(signer: Signer) -> None:
+def logout(
+    signer: Signer,
+    *,
+    transport: Optional[Transport] = None,
+    timeout: Timeout = DEFAULT_TIMEOUT,
+    deadline: Optional[Deadline] = None,
+) -> None:
     """Logs out a send-to-kindle client.
 
     Args:
         signer: Signer instance to authenticate the client.
+        transport: Transport used to send the request, or None for the default.
+        timeout: Connect and read timeouts for the request.
+        deadline: Optional deadline for the request, including retries.
 
     Raises:
         APIError: The HTTP request failed.
     """
     path = "/FirsProxy/disownFiona?contentDeleted=false"
-    req = urllib.request.Request(
-        url="https://firs-ta-g7g.amazon.com" + path,
-        headers={
-            "Content-Type": "text/xml",
-            "X-ADP-Request-Digest": signer.digest_header_for_request("GET", path, ""),
-            "X-ADP-Authentication-Token": signer.adp_token,
-            "Accept-Language": "en-US,*",
-            "User-Agent": "Mozilla/5.0",
-        },
-        method="GET",
-    )
+    headers = {
+        "Content-Type": "text/xml",
+        "X-ADP-Request-Digest": signer.digest_header_for_request("GET", path, ""),
+        "X-ADP-Authentication-Token": signer.adp_token,
+        "Accept-Language": "en-US,*",
+        "User-Agent": "Mozilla/5.0",
+    }
+    url = "https://firs-ta-g7g.amazon.com" + path
     try:
-        with urllib.request.urlopen(req) as r:  # noqa S310
-            r.read()  # Read and discard
-    except urllib.error.HTTPError as e:
-        raise APIError(str(e), _text(e)) from e
+        _send(transport, "GET", url, headers, None, timeout, deadline)  # Read and discard
+    except _HTTPStatusError as e:
+        raise APIError(str(e), e.body) from e
 
 
-def _request(path: str, signer: Signer, body: Mapping[str, Any]) -> Mapping[str, Any]:
-    data = json.dumps(
-        {
-            "ClientInfo": DEFAULT_CLIENT_INFO,
-            **body,
-        },
-        indent=4,
-    )
-    req = urllib.request.Request(
-        url="https://stkservice.amazon.com" + path,
-        data=data.encode("utf-8"),
-        headers={
-            "Accept": "application/json",
-            "Accept-Encoding": "gzip, deflate",
-            "Content-Type": "application/json",
-            "X-ADP-Request-Digest": signer.digest_header_for_request("POST", path, data),
-            "X-ADP-Authentication-Token": signer.adp_token,
-            "Accept-Language": "en-US,*",
-            "User-Agent": "Mozilla/5.0",
-        },
-        method="POST",
+def _request(
+    path: str,
+    signer: Signer,
+    body: Mapping[str, Any],
+    transport: Optional[Transport],
+    timeout: Timeout,
+    deadline: Optional[Deadline],
+    cancel: Optional[CancelToken] = None,
+) -> Mapping[str, Any]:
+    data = _encode_request(body)
+    with phases.phase("sign"):
+        digest = signer.digest_header_for_request("POST", path, data)
+    headers = {
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate",
+        "Content-Type": "application/json",
+        "X-ADP-Request-Digest": digest,
+        "X-ADP-Authentication-Token": signer.adp_token,
+        "Accept-Language": "en-US,*",
+        "User-Agent": "Mozilla/5.0",
+    }
+    res = _send(
+        transport,
+        "POST",
+        f"https://{STK_HOST}{path}",
+        headers,
+        data.encode("utf-8"),
+        timeout,
+        deadline,
+        cancel,
     )
-    with urllib.request.urlopen(req) as r:  # noqa S310
-        val: Mapping[str, Any] = json.load(r)
-        return val
+    val: Mapping[str, Any] = json.loads(res)
+    return val
+
+
+def _dumps(obj: Any) -> str:
+    r"""Serializes obj to compact, ASCII-only JSON, using orjson when it is installed.
+
+    Both backends produce the same text for ASCII-only data; orjson output containing other
+    characters is re-encoded with the json module so that they are escaped as before.
+
+    Example:
+        >>> from stkclient.api import _dumps
+        >>> print(_dumps({"fileSize": 100, "title": "Café"}))
+        {"fileSize":100,"title":"Caf\u00e9"}
+    """
+    if _fast_dumps is not None:
+        data = _fast_dumps(obj).decode("utf-8")
+        if data.isascii():
+            return data
+    return json.dumps(obj, separators=(",", ":"))
+
+
+# The ClientInfo member that starts every stk request body, serialized once
+_CLIENT_INFO_PREFIX = '{"ClientInfo":' + _dumps(DEFAULT_CLIENT_INFO)
+
 
+def _encode_request(body: Mapping[str, Any]) -> str:
+    """Serializes an stk request body, prefixed with ClientInfo.
 
-def _text(e: urllib.error.HTTPError) -> Optional[bytes]:
+    The result is both signed and sent, so it must not be re-encoded in between.
+
+    Example:
+        >>> from stkclient.api import _encode_request
+        >>> _encode_request({"fileSize": 100}).endswith('"x64"},"fileSize":100}')
+        True
+    """
+    if not body:
+        return _CLIENT_INFO_PREFIX + "}"
+    return _CLIENT_INFO_PREFIX + "," + _dumps(body)[1:]
+
+
+def _send(
+    transport: Optional[Transport],
+    method: str,
+    url: str,
+    headers: Mapping[str, str],
+    body: Body,
+    timeout: Timeout,
+    deadline: Optional[Deadline],
+    cancel: Optional[CancelToken] = None,
+    *,
+    attempt: int = 0,
+    retry_throttled: bool = True,
+) -> bytes:
+    """Sends a request through the shared rate limiter, retrying while it is throttled.
+
+    Streamed bodies are only retried if they are seekable. The cancel token, if any, is checked
+    before each attempt. Callers that retry requests themselves pass the number of earlier
+    attempts, for logging, and turn retry_throttled off to have throttling raised as an error.
+    """
+    if transport is None:
+        transport = DEFAULT_TRANSPORT
+    limiter = ratelimit.default_limiter()
+    key = _limiter_key(method, url)
+    stream = None if body is None or isinstance(body, bytes) else body
+    offset = stream.tell() if stream is not None and stream.seekable() else None
+    while True:
+        if cancel is not None:
+            cancel.check()
+        waited = time.monotonic()
+        with phases.phase("rate limit"):
+            limiter.acquire(key)
+        start = time.monotonic()
+        status, reason, retry_after, data = _attempt(
+            transport,
+            method,
+            url,
+            headers,
+            body,
+            timeout.clip(deadline),
+            key,
+            attempt,
+            start - waited,
+        )
+        if status in ratelimit.THROTTLE_STATUSES:
+            limiter.on_throttle(key, retry_after)
+            retryable = retry_throttled and (stream is None or offset is not None)
+            if retryable and attempt < limiter.max_retries:
+                if stream is not None and offset is not None:
+                    stream.seek(offset)
+                limiter.sleep(limiter.backoff(attempt, retry_after))
+                attempt += 1
+                continue
+        if not 200 <= status < 300:
+            raise _HTTPStatusError(status, reason, data, retry_after)
+        latency_tracker(key).record(time.monotonic() - start)
+        limiter.on_success(key)
+        return data
+
+
+def _attempt(
+    transport: Transport,
+    method: str,
+    url: str,
+    headers: Mapping[str, str],
+    body: Body,
+    timeout: Timeout,
+    endpoint: str,
+    attempt: int,
+    wait: float,
+) -> Tuple[int, str, Optional[float], bytes]:
+    """Sends one attempt of a request, logging it to ``stkclient.http`` if that is enabled.
+
+    Returns the response's status, reason, parsed Retry-After and body.
+    """
+    start = time.monotonic()
+    responded = None
     try:
-        return e.read()
-    except AttributeError:
-        return None
+        with transport.request(method, url, headers=headers, body=body, timeout=timeout) as r:
+            responded = time.monotonic()
+            status, reason = r.status, r.reason
+            retry_after = ratelimit.parse_retry_after(r.getheader("Retry-After"))
+            data = r.read()
+            if httplog.enabled():
+                httplog.log_request(
+                    method,
+                    endpoint,
+                    headers,
+                    body,
+                    attempt=attempt,
+                    wait=wait,
+                    start=start,
+                    responded=responded,
+                    end=time.monotonic(),
+                    response=r,
+                    received=len(data),
+                )
+    except Exception as e:
+        if httplog.enabled():
+            httplog.log_request(
+                method,
+                endpoint,
+                headers,
+                body,
+                attempt=attempt,
+                wait=wait,
+                start=start,
+                responded=responded,
+                end=time.monotonic(),
+                error=e,
+            )
+        raise
+    return status, reason, retry_after, data
+
+
+def _limiter_key(method: str, url: str) -> str:
+    u = urllib.parse.urlparse(url)
+    if method == "PUT":
+        # Every presigned upload URL has its own path; pace and track the upload host as a whole
+        return f"{u.hostname}"
+    return f"{u.hostname}{u.path}"
@@ -0,0 +1,801 @@
+"""Batch sends with automatically tuned upload concurrency."""
+
+import abc
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import os
+import pickle  # noqa: S403
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+
+from stkclient import Client, UploadLease, api
+from stkclient.cancel import CancelledError, CancelToken
+from stkclient.epub import Minimizer
+from stkclient.formats import DEFAULT_POLICY, Policy
+from stkclient.timeouts import DEFAULT_TIMEOUT, Timeout
+from stkclient.transport import Transport
+
+logger = logging.getLogger(__name__)
+
+# Jobs a sender takes from its input ahead of sending them, for its scheduler to order
+DEFAULT_MAX_QUEUED = 256
+
+
+@dataclass
+class SendJob:
+    """A file to send as part of a batch.
+
+    Attributes:
+        file_path: The file to send.
+        target_device_serial_numbers: The devices to receive the file.
+        author: The author of the document.
+        title: The title of the document.
+        format: The format of the document.
+        priority: Priority class; jobs in a lower class are sent before any in a higher class.
+    """
+
+    file_path: Path
+    target_device_serial_numbers: List[str]
+    author: str
+    title: str
+    format: str
+    priority: int = 0
+
+    def size(self) -> int:
+        """Returns the size of the file in bytes, or 0 if it can't be read."""
+        try:
+            return self.file_path.stat().st_size
+        except OSError:
+            return 0
+
+
+@dataclass
+class SendResult:
+    """The outcome of sending one job.
+
+    Attributes:
+        job: The job that was sent.
+        sku: The sku assigned by amazon, or None if the send failed.
+        error: The exception raised by the send, or None if it succeeded.
+        bytes_sent: Size of the uploaded file, or 0 if the send failed.
+        elapsed: Seconds spent sending the job.
+    """
+
+    job: SendJob
+    sku: Optional[str] = None
+    error: Optional[Exception] = None
+    bytes_sent: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """Whether the send succeeded."""
+        return self.error is None
+
+
+@dataclass(frozen=True)
+class AIMDDecision:
+    """A concurrency adjustment made by an AIMDController at the end of a window.
+
+    Attributes:
+        previous: The concurrency limit during the window.
+        limit: The concurrency limit for the next window.
+        throughput: Aggregate upload throughput over the window, in bytes per second.
+        errors: Number of sends in the window that failed from contention.
+        samples: Number of sends completed in the window.
+        reason: Why the limit was changed or kept.
+    """
+
+    previous: int
+    limit: int
+    throughput: float
+    errors: int
+    samples: int
+    reason: str
+
+
+class AIMDController:
+    """Tunes the number of concurrent uploads with additive-increase/multiplicative-decrease.
+
+    Completed sends are grouped into windows of as many sends as the current limit. At the end
+    of each window the aggregate throughput is compared with the previous window's: the limit
+    grows by ``increase`` while throughput keeps rising, holds once it has flattened out (the
+    knee of the curve), and is multiplied by ``decrease`` when throughput falls or any send in
+    the window failed with a network error or timeout, the first signs of contention. Sends that
+    fail for reasons of their own, such as a missing file or a rejected request, only count as
+    samples.
+
+    Every decision is appended to ``history`` and logged to the ``stkclient.batch`` logger.
+    """
+
+    def __init__(
+        self,
+        initial: int = 2,
+        *,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        increase: int = 1,
+        decrease: float = 0.5,
+        tolerance: float = 0.05,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Constructs an AIMDController.
+
+        Args:
+            initial: Starting concurrency limit.
+            min_limit: Lowest concurrency limit.
+            max_limit: Highest concurrency limit.
+            increase: Amount added to the limit while throughput rises.
+            decrease: Factor applied to the limit on errors or falling throughput.
+            tolerance: Relative change in throughput treated as noise.
+            clock: Monotonic clock returning seconds.
+
+        Raises:
+            ValueError: The limits are inconsistent.
+        """
+        if not 1 <= min_limit <= initial <= max_limit:
+            raise ValueError("Expected 1 <= min_limit <= initial <= max_limit")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.history: List[AIMDDecision] = []
+        self._increase = increase
+        self._decrease = decrease
+        self._tolerance = tolerance
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._limit = initial
+        self._last_throughput: Optional[float] = None
+        self._start = clock()
+        self._bytes = 0
+        self._samples = 0
+        self._errors = 0
+
+    @property
+    def limit(self) -> int:
+        """The current concurrency limit."""
+        return self._limit
+
+    def record(self, nbytes: int, error: bool = False) -> Optional[AIMDDecision]:
+        """Records a completed send, adjusting the limit if it closes a window.
+
+        Args:
+            nbytes: Bytes uploaded by the send.
+            error: Whether the send failed in a way that points to contention.
+
+        Returns:
+            The decision made, or None if the window is still open.
+        """
+        with self._lock:
+            self._bytes += nbytes
+            self._samples += 1
+            self._errors += error
+            if self._samples < self._limit:
+                return None
+            now = self._clock()
+            elapsed = now - self._start
+            throughput = self._bytes / elapsed if elapsed > 0 else 0.0
+            decision = self._decide(throughput)
+            self._limit = decision.limit
+            self._last_throughput = throughput
+            self._start = now
+            self._bytes = self._samples = self._errors = 0
+            self.history.append(decision)
+        logger.info(
+            "Upload concurrency %d -> %d (%s): %.0f B/s, %d of %d sends failed",
+            decision.previous,
+            decision.limit,
+            decision.reason,
+            decision.throughput,
+            decision.errors,
+            decision.samples,
+        )
+        return decision
+
+    def _decide(self, throughput: float) -> AIMDDecision:
+        last = self._last_throughput
+        limit = self._limit
+        if self._errors:
+            reason = "errors"
+            limit = int(limit * self._decrease)
+        elif last is None or throughput > last * (1 + self._tolerance):
+            reason = "throughput rose"
+            limit += self._increase
+        elif throughput < last * (1 - self._tolerance):
+            reason = "throughput fell"
+            limit = int(limit * self._decrease)
+        else:
+            reason = "throughput flat"
+        limit = max(self.min_limit, min(self.max_limit, limit))
+        return AIMDDecision(self._limit, limit, throughput, self._errors, self._samples, reason)
+
+
+class Scheduler(abc.ABC):
+    """Decides the order in which queued jobs are sent."""
+
+    @abc.abstractmethod
+    def push(self, job: SendJob) -> None:
+        """Queues a job."""
+
+    @abc.abstractmethod
+    def pop(self) -> SendJob:
+        """Removes and returns the job to send next.
+
+        Raises IndexError if no jobs are queued.
+        """
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        """Returns the number of queued jobs."""
+
+
+class FIFOScheduler(Scheduler):
+    """Sends jobs in the order they were queued."""
+
+    def __init__(self) -> None:
+        """Constructs an empty FIFOScheduler."""
+        self._queue: Deque[SendJob] = collections.deque()
+
+    def push(self, job: SendJob) -> None:
+        """Queues a job."""
+        self._queue.append(job)
+
+    def pop(self) -> SendJob:
+        """Removes and returns the oldest job."""
+        return self._queue.popleft()
+
+    def __len__(self) -> int:
+        """Returns the number of queued jobs."""
+        return len(self._queue)
+
+
+class ShortestJobFirstScheduler(Scheduler):
+    """Sends jobs by priority class, then smallest file first, with aging.
+
+    Within a priority class, a job's effective size shrinks by ``aging`` bytes for every second
+    it has been queued, so a large job is eventually sent ahead of small jobs queued after it
+    rather than starving. Because every job ages at the same rate, the order only depends on
+    each job's size and queueing time and a heap keeps pops logarithmic. Senders take jobs from
+    their input as the scheduler has room, so a job's queueing time is when it was taken.
+    """
+
+    def __init__(
+        self,
+        *,
+        aging: float = 1024 * 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Constructs an empty ShortestJobFirstScheduler.
+
+        Args:
+            aging: Bytes deducted from a job's effective size per second queued.
+            clock: Monotonic clock returning seconds.
+        """
+        self._aging = aging
+        self._clock = clock
+        self._start = clock()
+        self._heap: List[Tuple[int, float, int, SendJob]] = []
+        self._counter = itertools.count()
+
+    def push(self, job: SendJob) -> None:
+        """Queues a job."""
+        rank = job.size() + self._aging * (self._clock() - self._start)
+        heapq.heappush(self._heap, (job.priority, rank, next(self._counter), job))
+
+    def pop(self) -> SendJob:
+        """Removes and returns the job with the lowest priority class and effective size."""
+        return heapq.heappop(self._heap)[-1]
+
+    def __len__(self) -> int:
+        """Returns the number of queued jobs."""
+        return len(self._heap)
+
+
+class FairScheduler(Scheduler):
+    """Round-robins between groups of jobs, such as targets or accounts.
+
+    Each group is ordered by its own scheduler, so one group's backlog cannot hold up another's.
+    """
+
+    def __init__(
+        self,
+        key: Optional[Callable[[SendJob], Hashable]] = None,
+        scheduler: Callable[[], Scheduler] = ShortestJobFirstScheduler,
+    ) -> None:
+        """Constructs an empty FairScheduler.
+
+        Args:
+            key: Returns the group of a job, or None to group by target devices.
+            scheduler: Creates the scheduler ordering jobs within a group.
+        """
+        self._key = key if key is not None else _targets_key
+        self._scheduler = scheduler
+        self._groups: Dict[Hashable, Scheduler] = {}
+        self._turns: Deque[Hashable] = collections.deque()
+        self._len = 0
+
+    def push(self, job: SendJob) -> None:
+        """Queues a job in its group."""
+        k = self._key(job)
+        group = self._groups.get(k)
+        if group is None:
+            group = self._groups[k] = self._scheduler()
+            self._turns.append(k)
+        group.push(job)
+        self._len += 1
+
+    def pop(self) -> SendJob:
+        """Removes and returns the next job from the group whose turn it is.
+
+        Returns:
+            SendJob instance.
+
+        Raises:
+            IndexError: No jobs are queued.
+        """
+        if not self._turns:
+            raise IndexError("pop from an empty scheduler")
+        k = self._turns.popleft()
+        group = self._groups[k]
+        job = group.pop()
+        if group:
+            self._turns.append(k)
+        else:
+            del self._groups[k]
+        self._len -= 1
+        return job
+
+    def __len__(self) -> int:
+        """Returns the number of queued jobs."""
+        return self._len
+
+
+def _targets_key(job: SendJob) -> Hashable:
+    return tuple(job.target_device_serial_numbers)
+
+
+class LeasePrefetcher:
+    """Requests upload URLs for upcoming jobs in the background, so uploads can start at once.
+
+    Leases are held per job until the job is sent. :meth:`refresh` requests a new one in the
+    background for each lease with less than twice ``margin`` seconds left, and BatchSender calls
+    it at least every ``margin / 2`` seconds. A lease that would still expire within ``margin``
+    seconds when its job is sent is discarded, and the send requests a fresh one, so a lease is
+    never used after it expires.
+
+    Attributes:
+        client: The client to request upload URLs with.
+        lookahead: Number of jobs to hold leases for ahead of the ones being sent.
+        margin: Seconds of validity a lease must have left to be used.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        *,
+        lookahead: int = 4,
+        margin: float = 30.0,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Constructs a LeasePrefetcher.
+
+        Args:
+            client: The client to request upload URLs with.
+            lookahead: Number of jobs to hold leases for ahead of the ones being sent.
+            margin: Seconds of validity a lease must have left to be used.
+            timeout: Connect and read timeouts for each request.
+            clock: Monotonic clock returning seconds.
+        """
+        self.client = client
+        self.lookahead = lookahead
+        self.margin = margin
+        self._timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._leases: Dict[int, Tuple[SendJob, "concurrent.futures.Future[UploadLease]"]] = {}
+        self._pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def prefetch(self, job: SendJob) -> None:
+        """Starts requesting an upload URL for job."""
+        with self._lock:
+            self._leases[id(job)] = (job, self._request(job))
+
+    def refresh(self) -> None:
+        """Requests new upload URLs, in the background, for leases that are close to expiring."""
+        with self._lock:
+            for key, (job, future) in list(self._leases.items()):
+                if not future.done() or future.cancelled() or future.exception() is not None:
+                    continue
+                if future.result().expired(2 * self.margin, self._clock):
+                    logger.debug("Refreshing upload URL for %s close to expiry", job.file_path)
+                    self._leases[key] = (job, self._request(job))
+
+    def acquire(self, job: SendJob) -> Optional[UploadLease]:
+        """Removes and returns the lease held for job, waiting for it if still in flight.
+
+        Args:
+            job: The job about to be sent.
+
+        Returns:
+            The lease, or None if there is none, it could not be obtained, or it is about to
+            expire.
+        """
+        with self._lock:
+            entry = self._leases.pop(id(job), None)
+        if entry is None:
+            return None
+        try:
+            lease = entry[1].result()
+        except Exception as e:
+            logger.debug("Prefetching upload URL for %s failed: %s", job.file_path, e)
+            return None
+        if lease.expired(self.margin, self._clock):
+            logger.debug("Discarding upload URL for %s close to expiry", job.file_path)
+            return None
+        return lease
+
+    def discard(self, job: SendJob) -> None:
+        """Drops the lease held for job, if any, such as when the job won't be sent."""
+        with self._lock:
+            entry = self._leases.pop(id(job), None)
+        if entry is not None:
+            entry[1].cancel()
+
+    def close(self) -> None:
+        """Cancels outstanding requests, drops all leases and stops the background threads.
+
+        The prefetcher can be used again afterwards.
+        """
+        with self._lock:
+            leases, self._leases = self._leases, {}
+            pool, self._pool = self._pool, None
+        for _, future in leases.values():
+            future.cancel()
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _request(self, job: SendJob) -> "concurrent.futures.Future[UploadLease]":
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(max(1, self.lookahead))
+        return self._pool.submit(self.client.get_upload_lease, job.size(), timeout=self._timeout)
+
+
+class BatchSender:
+    """Sends many files concurrently, tuning the number of uploads in flight as it goes.
+
+    Given ``max_workers`` instead of a controller, it keeps that many uploads in flight.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        *,
+        controller: Optional[AIMDController] = None,
+        max_workers: Optional[int] = None,
+        scheduler: Optional[Scheduler] = None,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        prefetcher: Optional[LeasePrefetcher] = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        minimizer: Optional[Minimizer] = None,
+        policy: Optional[Policy] = DEFAULT_POLICY,
+    ) -> None:
+        """Constructs a BatchSender.
+
+        Args:
+            client: The client to send with.
+            controller: Concurrency controller, or None for a default AIMDController unless
+                max_workers is given.
+            max_workers: Fixed number of sends to keep in flight, instead of a controller.
+            scheduler: Orders queued jobs, or None to send them in order.
+            max_queued: Most jobs taken from the input and queued in the scheduler at once.
+            prefetcher: Requests upload URLs for the next jobs while others are being sent, or
+                None to request each when its job starts. It is closed at the end of each send.
+            timeout: Connect and read timeouts for each request.
+            minimizer: Optional Minimizer to shrink EPUBs with before uploading them.
+            policy: The formats and sizes to accept, or None for jobs that were already checked,
+                whose format must then be set.
+
+        Raises:
+            ValueError: Both controller and max_workers were given, or max_workers or max_queued
+                is below 1.
+        """
+        if max_workers is not None and (controller is not None or max_workers < 1):
+            raise ValueError("Expected either a controller or max_workers of at least 1")
+        if max_queued < 1:
+            raise ValueError("Expected max_queued of at least 1")
+        if controller is None and max_workers is None:
+            controller = AIMDController()
+        self.client = client
+        self.controller = controller
+        self.max_workers = max_workers
+        self.scheduler = scheduler if scheduler is not None else FIFOScheduler()
+        self.max_queued = max_queued
+        self.prefetcher = prefetcher
+        self.minimizer = minimizer
+        self.policy = policy
+        self._timeout = timeout
+
+    def send(
+        self, jobs: Iterable[SendJob], *, cancel: Optional[CancelToken] = None
+    ) -> Iterator[SendResult]:
+        """Sends jobs in the scheduler's order, yielding results in order of completion.
+
+        Failed sends are reported in their result rather than raised, so one bad file doesn't
+        stop the batch.
+
+        Args:
+            jobs: The jobs to send.
+            cancel: Optional token. Once it is draining, no more jobs are started and sends that
+                have started uploading are finished; once it is cancelled, running sends stop
+                at their next check. Jobs that were not sent have a CancelledError error.
+
+        Yields:
+            A SendResult for each job.
+        """
+        pending = self.scheduler
+        remaining = iter(jobs)
+        more = True
+        controller = self.controller
+        # One of the two is set, as checked by __init__
+        max_workers = (
+            controller.max_limit if controller is not None else cast(int, self.max_workers)
+        )
+        prefetcher = self.prefetcher
+        # Wake up often enough to refresh prefetched leases before they get too old to use
+        interval = (
+            prefetcher.margin / 2 if prefetcher is not None and prefetcher.margin > 0 else None
+        )
+        # Jobs taken from the scheduler whose upload URLs are being prefetched
+        ready: Deque[SendJob] = collections.deque()
+        running: Set["concurrent.futures.Future[SendResult]"] = set()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+                while more or pending or ready or running:
+                    more = more and _feed(pending, remaining, self.max_queued)
+                    if cancel is not None and cancel.draining:
+                        yield from _unsent(ready, pending, remaining, prefetcher)
+                        if not running:
+                            break
+                    limit = controller.limit if controller is not None else max_workers
+                    while (pending or ready) and len(running) < limit:
+                        job = ready.popleft() if ready else pending.pop()
+                        more = more and _feed(pending, remaining, self.max_queued)
+                        running.add(
+                            pool.submit(
+                                _send_job,
+                                self.client,
+                                job,
+                                self._timeout,
+                                prefetcher,
+                                cancel,
+                                self.minimizer,
+                                self.policy,
+                            )
+                        )
+                    if prefetcher is not None:
+                        _prefetch(prefetcher, pending, ready)
+                    done, running = concurrent.futures.wait(
+                        running, timeout=interval, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        result = future.result()
+                        if controller is not None:
+                            error = _is_contention(result.error)
+                            controller.record(result.bytes_sent, error=error)
+                        yield result
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+
+
+class ProcessBatchSender:
+    """Sends many files from a pool of worker processes.
+
+    Request signing with the pure-Python rsa package holds the GIL, so a thread pool stops
+    scaling after a few workers. This sender shards jobs across processes instead, keeping as
+    many sends in flight as there are processes. The client is pickled to each worker once, when
+    the worker starts, with its already-parsed signing key, so workers never parse PEM.
+
+    Each worker process has its own rate limiter and bandwidth limiter; pass ``initializer`` to
+    configure them.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        *,
+        processes: Optional[int] = None,
+        scheduler: Optional[Scheduler] = None,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+        transport: Optional[Callable[[], Transport]] = None,
+        initializer: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Constructs a ProcessBatchSender.
+
+        Args:
+            client: The client to send with. Its transport is not sent to the workers.
+            processes: Number of worker processes, or None for one per CPU.
+            scheduler: Orders queued jobs, or None to send them in order.
+            max_queued: Most jobs taken from the input and queued in the scheduler at once.
+            timeout: Connect and read timeouts for each request.
+            transport: Picklable factory creating each worker's transport, or None for the
+                stdlib default.
+            initializer: Picklable function run once in each worker after the client is loaded.
+
+        Raises:
+            ValueError: max_queued is below 1.
+        """
+        if max_queued < 1:
+            raise ValueError("Expected max_queued of at least 1")
+        self.client = client
+        self.processes = processes if processes is not None else (os.cpu_count() or 1)
+        self.scheduler = scheduler if scheduler is not None else FIFOScheduler()
+        self.max_queued = max_queued
+        self._timeout = timeout
+        self._transport = transport
+        self._initializer = initializer
+
+    def send(
+        self, jobs: Iterable[SendJob], *, cancel: Optional[CancelToken] = None
+    ) -> Iterator[SendResult]:
+        """Sends jobs in the scheduler's order, yielding results as workers complete them.
+
+        Failed sends are reported in their result rather than raised, so one bad file doesn't
+        stop the batch.
+
+        Args:
+            jobs: The jobs to send.
+            cancel: Optional token. Once it is drained or cancelled, no more jobs are given to
+                workers, and jobs that were not sent have a CancelledError error. Sends already
+                running in a worker process always finish.
+
+        Yields:
+            A SendResult for each job.
+        """
+        pending = self.scheduler
+        remaining = iter(jobs)
+        more = True
+        running: Set["concurrent.futures.Future[SendResult]"] = set()
+        with concurrent.futures.ProcessPoolExecutor(
+            self.processes,
+            initializer=_init_worker,
+            initargs=(self.client, self._transport, self._initializer),
+        ) as pool:
+            while more or pending or running:
+                more = more and _feed(pending, remaining, self.max_queued)
+                if cancel is not None and cancel.draining:
+                    yield from _unsent(collections.deque(), pending, remaining)
+                    if not running:
+                        break
+                while pending and len(running) < self.processes:
+                    running.add(pool.submit(_send_in_worker, pending.pop(), self._timeout))
+                    more = more and _feed(pending, remaining, self.max_queued)
+                done, running = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    yield future.result()
+
+
+def _send_job(
+    client: Client,
+    job: SendJob,
+    timeout: Timeout,
+    prefetcher: Optional[LeasePrefetcher] = None,
+    cancel: Optional[CancelToken] = None,
+    minimizer: Optional[Minimizer] = None,
+    policy: Optional[Policy] = DEFAULT_POLICY,
+) -> SendResult:
+    start = time.monotonic()
+    result = SendResult(job)
+    try:
+        size = job.file_path.stat().st_size
+        lease = prefetcher.acquire(job) if prefetcher is not None else None
+        result.sku = client.send_file(
+            job.file_path,
+            job.target_device_serial_numbers,
+            author=job.author,
+            title=job.title,
+            format=job.format,
+            timeout=timeout,
+            lease=lease,
+            cancel=cancel,
+            minimizer=minimizer,
+            policy=policy,
+        )
+        result.bytes_sent = size
+    except Exception as e:
+        result.error = e
+    result.elapsed = time.monotonic() - start
+    return result
+
+
+def _feed(pending: Scheduler, remaining: Iterator[SendJob], max_queued: int) -> bool:
+    """Queues jobs from remaining until max_queued are queued, and returns whether any are left."""
+    while len(pending) < max_queued:
+        job = next(remaining, None)
+        if job is None:
+            return False
+        pending.push(job)
+    return True
+
+
+def _prefetch(prefetcher: LeasePrefetcher, pending: Scheduler, ready: Deque[SendJob]) -> None:
+    """Moves jobs from pending to ready while fetching their leases, and refreshes old leases."""
+    while pending and len(ready) < prefetcher.lookahead:
+        job = pending.pop()
+        prefetcher.prefetch(job)
+        ready.append(job)
+    prefetcher.refresh()
+
+
+def _is_contention(error: Optional[Exception]) -> bool:
+    """Returns whether a send failed in a way that suggests the link or service is overloaded."""
+    if error is None:
+        return False
+    if isinstance(error, TimeoutError):
+        return True
+    # Public API calls raise APIError from the response's status error
+    cause = error.__cause__ if isinstance(error, api.APIError) else error
+    return cause is not None and api.is_retryable(cause)
+
+
+def _unsent(
+    ready: Deque[SendJob],
+    pending: Scheduler,
+    remaining: Iterator[SendJob],
+    prefetcher: Optional[LeasePrefetcher] = None,
+) -> Iterator[SendResult]:
+    while ready or pending:
+        job = ready.popleft() if ready else pending.pop()
+        if prefetcher is not None:
+            prefetcher.discard(job)
+        yield SendResult(job, error=CancelledError("Draining"))
+    for job in remaining:
+        yield SendResult(job, error=CancelledError("Draining"))
+
+
+_worker_client: Optional[Client] = None
+
+
+def _init_worker(
+    client: Client,
+    transport: Optional[Callable[[], Transport]],
+    initializer: Optional[Callable[[], None]],
+) -> None:
+    global _worker_client
+    _worker_client = client
+    if transport is not None:
+        _worker_client.transport = transport()
+    if initializer is not None:
+        initializer()
+
+
+def _send_in_worker(job: SendJob, timeout: Timeout) -> SendResult:
+    assert _worker_client is not None  # noqa: S101
+    result = _send_job(_worker_client, job, timeout)
+    if result.error is not None:
+        try:
+            pickle.dumps(result.error)
+        except Exception:
+            result.error = RuntimeError(repr(result.error))
+    return result
@@ -0,0 +1,216 @@
+"""Diagnostic measurements of a client's performance, for comparing hosts, regions and releases.
+
+:func:`run` measures key loading, request signing, connection setup to stkservice and the
+upload host, GetListOfOwnedDevices latency and upload throughput. The upload uses a synthetic
+payload that is never delivered to any device. With ``offline=True`` the network measurements
+are taken against a local :class:`stkclient.standin.StandInServer` instead of amazon.
+"""
+
+import dataclasses
+import io
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+from stkclient import Client, api, ratelimit
+from stkclient.standin import RedirectTransport, StandInServer
+from stkclient.timeouts import LatencyTracker
+from stkclient.transport import PooledTransport, Transport
+
+PERCENTILES = (50.0, 90.0, 99.0)
+
+
+@dataclass
+class ConnectionProbe:
+    """Time to connect to a host and receive the first byte of a response.
+
+    Attributes:
+        host: The host probed.
+        dns: Seconds spent resolving the host name.
+        tcp: Seconds spent on the TCP handshake.
+        tls: Seconds spent on the TLS handshake (0 for plain HTTP).
+        ttfb: Seconds from sending the request until the response headers arrived.
+    """
+
+    host: str
+    dns: float
+    tcp: float
+    tls: float
+    ttfb: float
+
+
+@dataclass
+class BenchReport:
+    """The results of a benchmark run.
+
+    Attributes:
+        offline: Whether the network measurements were taken against a local stand-in.
+        key_load: Seconds to load the client and parse its private key (median).
+        signing_rate: Request signatures computed per second.
+        connections: Connection setup timings for stkservice and the upload host.
+        owned_devices_latency: GetListOfOwnedDevices latency in seconds by percentile name,
+            such as "p50", plus "min" and "max".
+        owned_devices_requests: Number of GetListOfOwnedDevices requests timed.
+        upload_bytes: Size of the synthetic upload.
+        upload_seconds: Seconds taken by the upload.
+    """
+
+    offline: bool
+    key_load: float
+    signing_rate: float
+    connections: List[ConnectionProbe]
+    owned_devices_latency: Dict[str, float]
+    owned_devices_requests: int
+    upload_bytes: int
+    upload_seconds: float
+
+    @property
+    def upload_rate(self) -> float:
+        """Upload throughput in bytes per second."""
+        return self.upload_bytes / self.upload_seconds if self.upload_seconds > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the report as JSON-serializable data, times in seconds."""
+        d = dataclasses.asdict(self)
+        d["upload_rate"] = self.upload_rate
+        return d
+
+    def format(self) -> str:
+        """Returns the report as human-readable text."""
+        ms = 1000
+        lines = [
+            f"mode          {'offline (local stand-in)' if self.offline else 'online'}",
+            f"key load      {self.key_load * ms:.1f} ms",
+            f"signing       {self.signing_rate:.1f} signatures/s"
+            f" ({1 / self.signing_rate * ms if self.signing_rate else 0:.2f} ms each)",
+            "",
+            f"{'host':<34}{'dns':>9}{'tcp':>9}{'tls':>9}{'ttfb':>9}  (ms)",
+        ]
+        for c in self.connections:
+            lines.append(
+                f"{c.host:<34}{c.dns * ms:>9.1f}{c.tcp * ms:>9.1f}{c.tls * ms:>9.1f}"
+                f"{c.ttfb * ms:>9.1f}"
+            )
+        latency = "  ".join(f"{k} {v * ms:.1f}" for k, v in self.owned_devices_latency.items())
+        lines += [
+            "",
+            f"GetListOfOwnedDevices  n={self.owned_devices_requests}  {latency}  (ms)",
+            f"upload        {self.upload_bytes} bytes in {self.upload_seconds:.3f} s"
+            f" ({self.upload_rate / 1024 / 1024:.2f} MiB/s)",
+        ]
+        return "\n".join(lines)
+
+
+def run(
+    client_data: str,
+    *,
+    offline: bool = False,
+    requests: int = 20,
+    payload_size: int = 1024 * 1024,
+    signatures: int = 50,
+    key_loads: int = 5,
+) -> BenchReport:
+    """Runs every measurement and returns the report.
+
+    The upload passes through the process-wide bandwidth limiter, as it would for a real send.
+    Requests are not paced by the process-wide rate limiter, so that their latency is the
+    service's, but throttled requests are still retried with backoff.
+
+    Args:
+        client_data: The serialized client, as written by Client.dumps.
+        offline: If true, measure against a local stand-in server instead of amazon.
+        requests: Number of GetListOfOwnedDevices requests to time.
+        payload_size: Size in bytes of the synthetic upload.
+        signatures: Number of request signatures to time.
+        key_loads: Number of times to load the client when timing key parsing.
+
+    Returns:
+        BenchReport instance.
+    """
+    key_load = _median([_time(lambda: Client.loads(client_data)) for _ in range(key_loads)])
+    client = Client.loads(client_data)
+    signing_rate = _signing_rate(client, signatures)
+    server = StandInServer().start() if offline else None
+    limiter = ratelimit.default_limiter()
+    ratelimit.set_default_limiter(ratelimit.RateLimiter(burst=float(requests + 2)))
+    try:
+
+        def new_transport(pool: PooledTransport) -> Transport:
+            return RedirectTransport(server.url, pool) if server is not None else pool
+
+        pool = PooledTransport()
+        client.transport = new_transport(pool)
+        connections = [_probe(f"https://{api.STK_HOST}/", new_transport)]
+        tracker = LatencyTracker(size=requests)
+        for _ in range(requests):
+            tracker.record(_time(client.get_owned_devices))
+        upload = api.get_upload_url(client._signer, payload_size, transport=client.transport)
+        connections.append(_probe(upload.upload_url, new_transport))
+        payload = io.BytesIO(bytes(payload_size))
+        upload_seconds = _time(
+            lambda: api.upload_file(
+                upload.upload_url, payload_size, payload, transport=client.transport
+            )
+        )
+        pool.close()
+    finally:
+        ratelimit.set_default_limiter(limiter)
+        if server is not None:
+            server.close()
+    latency = {f"p{p:g}": tracker.percentile(p) or 0.0 for p in PERCENTILES}
+    latency["min"] = tracker.percentile(0) or 0.0
+    latency["max"] = tracker.percentile(100) or 0.0
+    return BenchReport(
+        offline=offline,
+        key_load=key_load,
+        signing_rate=signing_rate,
+        connections=connections,
+        owned_devices_latency=latency,
+        owned_devices_requests=requests,
+        upload_bytes=payload_size,
+        upload_seconds=upload_seconds,
+    )
+
+
+def _probe(url: str, new_transport: Callable[[PooledTransport], Transport]) -> ConnectionProbe:
+    """Times connecting to url's host on a fresh connection, and a HEAD request over it."""
+    pool = PooledTransport()
+    transport = new_transport(pool)
+    start = time.perf_counter()
+    with transport.request("HEAD", url, headers={"User-Agent": "Mozilla/5.0"}):
+        elapsed = time.perf_counter() - start
+    pool.close()
+    [timing] = pool.connect_timings
+    host = url.split("/")[2]
+    connect = timing.dns + timing.tcp + timing.tls
+    return ConnectionProbe(host, timing.dns, timing.tcp, timing.tls, max(0.0, elapsed - connect))
+
+
+def _signing_rate(client: Client, n: int) -> float:
+    body = api._encode_request({"fileSize": 1024 * 1024})
+    signer = client._signer
+    elapsed = _time(
+        lambda: [signer.digest_header_for_request("POST", "/GetUploadUrl", body) for _ in range(n)]
+    )
+    return n / elapsed if elapsed > 0 else 0.0
+
+
+def _time(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _median(values: List[float]) -> float:
+    """Returns the median of values.
+
+    Example:
+        >>> from stkclient.bench import _median
+        >>> _median([3.0, 1.0, 2.0]), _median([4.0, 1.0, 2.0, 3.0])
+        (2.0, 2.5)
+    """
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[mid]
+    return (ordered[mid - 1] + ordered[mid]) / 2
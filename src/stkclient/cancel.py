@@ -0,0 +1,103 @@
+"""Cancellation tokens for stopping sends between phases and mid-upload."""
+
+import threading
+from typing import IO, Optional
+
+from stkclient.readers import ReaderWrapper
+
+
+class CancelledError(Exception):
+    """Raised when an operation stops because its CancelToken was cancelled or drained."""
+
+
+class CancelToken:
+    """Signals running and future operations to stop, from any thread.
+
+    A token has two levels. :meth:`cancel` stops operations as soon as they next check the token:
+    between requests, and between the chunks of an upload, whose connection is then closed.
+    :meth:`drain` is gentler: operations that have started uploading run to completion, but none
+    starts a new upload. Both are one-way; create a new token to start over.
+
+    Example:
+        >>> from stkclient.cancel import CancelToken
+        >>> token = CancelToken()
+        >>> token.drain()
+        >>> token.draining, token.cancelled
+        (True, False)
+        >>> token.check()
+        >>> token.check_start()
+        Traceback (most recent call last):
+        ...
+        stkclient.cancel.CancelledError: Draining
+    """
+
+    def __init__(self) -> None:
+        """Constructs a CancelToken that is neither cancelled nor draining."""
+        self._cancelled = threading.Event()
+        self._draining = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether cancel has been called."""
+        return self._cancelled.is_set()
+
+    @property
+    def draining(self) -> bool:
+        """Whether drain or cancel has been called."""
+        return self._draining.is_set()
+
+    def cancel(self) -> None:
+        """Stops operations at their next check, including those part way through an upload."""
+        self._draining.set()
+        self._cancelled.set()
+
+    def drain(self) -> None:
+        """Lets in-flight uploads finish their delivery but stops operations from starting more."""
+        self._draining.set()
+
+    def check(self) -> None:
+        """Raises CancelledError if the token has been cancelled.
+
+        Raises:
+            CancelledError: The token has been cancelled.
+        """
+        if self._cancelled.is_set():
+            raise CancelledError("Cancelled")
+
+    def check_start(self) -> None:
+        """Raises CancelledError if the token is draining or cancelled, before starting new work.
+
+        Raises:
+            CancelledError: The token has been drained or cancelled.
+        """
+        self.check()
+        if self._draining.is_set():
+            raise CancelledError("Draining")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until the token is cancelled or timeout seconds pass.
+
+        Args:
+            timeout: Seconds to wait, or None to wait forever.
+
+        Returns:
+            Whether the token was cancelled.
+        """
+        return self._cancelled.wait(timeout)
+
+
+class CancellableReader(ReaderWrapper):
+    """Wraps a readable binary file so that reading it fails once a CancelToken is cancelled."""
+
+    def __init__(self, fp: IO[bytes], token: CancelToken) -> None:
+        """Constructs a CancellableReader.
+
+        Args:
+            fp: The file to read from.
+            token: The token to check before each read.
+        """
+        super().__init__(fp)
+        self._token = token
+
+    def _before_read(self) -> None:
+        self._token.check()
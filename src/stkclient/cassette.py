@@ -0,0 +1,432 @@
+"""Recording HTTP exchanges with their timing, and replaying them offline.
+
+A :class:`RecordingTransport` wraps the transport given to a client or to the
+:mod:`stkclient.api` functions and records each request and its response in a
+:class:`Cassette`, together with when it was sent, how long the response headers took to arrive
+and how long the body took to read. Credentials are removed as exchanges are recorded: the
+X-ADP-* and other credential headers, tokens and keys in JSON and XML bodies and the query
+strings of URLs, which carry the signatures of presigned upload URLs. Response bodies that are
+neither JSON nor XML are not recorded, as they can't be checked for credentials, and neither
+are request bodies, only their sizes.
+
+A :class:`ReplayServer` serves a cassette from localhost with the recorded latencies, optionally
+scaled, so that a recorded send, batch or sequence of retries can be timed again without a
+network::
+
+    recorder = RecordingTransport(PooledTransport())
+    Client(device_info, recorder).send_file(...)
+    with open("send.json", "w") as f:
+        recorder.cassette.dump(f)
+
+    with open("send.json") as f, ReplayServer(Cassette.load(f), scale=0.5) as server:
+        Client(device_info, server.transport()).send_file(...)
+"""
+
+import base64
+import collections
+import json
+import re
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    TextIO,
+    Tuple,
+)
+
+from stkclient import httplog
+from stkclient.standin import StandInServer, _Reply
+from stkclient.timeouts import DEFAULT_TIMEOUT, Timeout
+from stkclient.transport import Body, Response, Transport
+
+# Response headers recorded and replayed; Content-Length is recomputed on replay
+RESPONSE_HEADERS = tuple(h for h in httplog.RESPONSE_HEADERS if h != "Content-Length")
+
+_SECRET_KEYS = ("token", "key", "secret", "password", "signature", "cookie")
+
+# A leaf element: its text contains no further elements
+_XML_ELEMENT = re.compile(r"<(?P<tag>[\w:.-]+)(?P<attrs>[^<>]*)>[^<]*</(?P=tag)>")
+
+
+@dataclass
+class Exchange:
+    """A recorded request and its response.
+
+    Attributes:
+        method: The HTTP method.
+        url: The URL requested, without its query string.
+        request_headers: The request headers, with credentials redacted.
+        request_size: Size of the request body, or None if it was streamed without a length.
+        status: The response's status, or None if the request failed without a response.
+        reason: The response's reason phrase.
+        response_headers: The recorded response headers, with credentials redacted.
+        body: The response body with credentials redacted, or empty if it is neither JSON nor
+            XML.
+        start: Seconds from the start of the recording until the request was sent.
+        latency: Seconds from sending the request until the response headers arrived, or until
+            it failed.
+        duration: Seconds from sending the request until its body was read and it was closed.
+        error: Description of the exception that ended the request, if it failed.
+    """
+
+    method: str
+    url: str
+    request_headers: Dict[str, str] = field(default_factory=dict)
+    request_size: Optional[int] = 0
+    status: Optional[int] = 200
+    reason: str = ""
+    response_headers: Dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+    start: float = 0.0
+    latency: float = 0.0
+    duration: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        """The path of the URL requested."""
+        return urllib.parse.urlsplit(self.url).path or "/"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the exchange as a JSON-compatible dict."""
+        d: Dict[str, Any] = {
+            "method": self.method,
+            "url": self.url,
+            "request_headers": self.request_headers,
+            "request_size": self.request_size,
+            "status": self.status,
+            "reason": self.reason,
+            "response_headers": self.response_headers,
+            "start": self.start,
+            "latency": self.latency,
+            "duration": self.duration,
+            "error": self.error,
+        }
+        try:
+            d["body"] = self.body.decode("utf-8")
+        except UnicodeDecodeError:
+            d["body_base64"] = base64.b64encode(self.body).decode("ascii")
+        return d
+
+    @staticmethod
+    def from_dict(d: Mapping[str, Any]) -> "Exchange":
+        """Constructs an Exchange from a dict returned by to_dict."""
+        if "body_base64" in d:
+            body = base64.b64decode(d["body_base64"])
+        else:
+            body = d.get("body", "").encode("utf-8")
+        return Exchange(
+            method=d["method"],
+            url=d["url"],
+            request_headers=dict(d.get("request_headers", {})),
+            request_size=d.get("request_size"),
+            status=d.get("status"),
+            reason=d.get("reason", ""),
+            response_headers=dict(d.get("response_headers", {})),
+            body=body,
+            start=d.get("start", 0.0),
+            latency=d.get("latency", 0.0),
+            duration=d.get("duration", 0.0),
+            error=d.get("error"),
+        )
+
+
+@dataclass
+class Cassette:
+    """A sequence of recorded exchanges, in the order their requests were sent.
+
+    Attributes:
+        exchanges: The recorded exchanges.
+    """
+
+    exchanges: List[Exchange] = field(default_factory=list)
+
+    @staticmethod
+    def load(fp: TextIO) -> "Cassette":
+        """Deserializes a cassette from a file-like object."""
+        return Cassette._from_dict(json.load(fp))
+
+    @staticmethod
+    def loads(s: str) -> "Cassette":
+        """Deserializes a cassette from a string."""
+        return Cassette._from_dict(json.loads(s))
+
+    @staticmethod
+    def _from_dict(s: Mapping[str, Any]) -> "Cassette":
+        if s.get("version") != 1:
+            raise ValueError("Invalid version")
+        return Cassette([Exchange.from_dict(e) for e in s.get("exchanges", [])])
+
+    def dump(self, fp: TextIO) -> None:
+        """Serializes the cassette into a file-like object."""
+        json.dump(self._to_dict(), fp, indent=2)
+
+    def dumps(self) -> str:
+        """Serializes the cassette into a string."""
+        return json.dumps(self._to_dict(), indent=2)
+
+    def _to_dict(self) -> Mapping[str, Any]:
+        return {"version": 1, "exchanges": [e.to_dict() for e in self.exchanges]}
+
+
+def sanitize_url(url: str) -> str:
+    """Returns url without its query string and fragment.
+
+    Example:
+        >>> from stkclient.cassette import sanitize_url
+        >>> sanitize_url("https://s3.amazonaws.com/RpaDKq?AWSAccessKeyId=AKIA&Signature=x")
+        'https://s3.amazonaws.com/RpaDKq'
+    """
+    u = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit((u.scheme, u.netloc, u.path, "", ""))
+
+
+def sanitize_json(obj: Any) -> Any:
+    """Returns a copy of a decoded JSON value with credentials redacted.
+
+    Values of keys naming a token, key, secret, password or signature are replaced by
+    ``httplog.REDACTED``, and the query strings of URLs are removed.
+
+    Example:
+        >>> from stkclient.cassette import sanitize_json
+        >>> sanitize_json({"stkToken": "abc", "uploadUrl": "https://x/y?Signature=z"})
+        {'stkToken': '<redacted>', 'uploadUrl': 'https://x/y'}
+    """
+    if isinstance(obj, dict):
+        return {
+            k: httplog.REDACTED if _is_secret_key(k) else sanitize_json(v) for k, v in obj.items()
+        }
+    if isinstance(obj, list):
+        return [sanitize_json(v) for v in obj]
+    if isinstance(obj, str) and obj.startswith(("http://", "https://")):
+        return sanitize_url(obj)
+    return obj
+
+
+def sanitize_xml(text: str) -> str:
+    """Returns XML text with the content of credential elements redacted.
+
+    The text of elements whose name is a token, key, secret, password, signature or cookie is
+    replaced by ``httplog.REDACTED``.
+
+    Example:
+        >>> from stkclient.cassette import sanitize_xml
+        >>> sanitize_xml("<r><adp_token>abc</adp_token><name>Max</name></r>")
+        '<r><adp_token><redacted></adp_token><name>Max</name></r>'
+    """
+
+    def redact(m: "re.Match[str]") -> str:
+        if not _is_secret_key(m.group("tag")):
+            return m.group(0)
+        return f"<{m.group('tag')}{m.group('attrs')}>{httplog.REDACTED}</{m.group('tag')}>"
+
+    return _XML_ELEMENT.sub(redact, text)
+
+
+def _is_secret_key(key: str) -> bool:
+    lower = key.lower()
+    return any(s in lower for s in _SECRET_KEYS)
+
+
+def _sanitize_body(body: bytes) -> bytes:
+    """Returns body with credentials redacted, or b"" if it is neither JSON nor XML."""
+    if not body:
+        return body
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        return b""
+    if text.lstrip().startswith("<"):
+        return sanitize_xml(text).encode("utf-8")
+    try:
+        obj = json.loads(text)
+    except ValueError:
+        return b""
+    return json.dumps(sanitize_json(obj)).encode("utf-8")
+
+
+class RecordingTransport(Transport):
+    """Records every request sent through an inner transport into a cassette.
+
+    Attributes:
+        inner: The transport that sends the requests.
+        cassette: The cassette being recorded.
+    """
+
+    def __init__(
+        self,
+        inner: Transport,
+        cassette: Optional[Cassette] = None,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Constructs a RecordingTransport.
+
+        Args:
+            inner: Transport that sends the requests.
+            cassette: Cassette to append exchanges to, or None for a new one.
+            clock: Clock returning seconds, for timing the exchanges.
+        """
+        self.inner = inner
+        self.cassette = cassette if cassette is not None else Cassette()
+        self._clock = clock
+        self._origin = clock()
+        self._lock = threading.Lock()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Mapping[str, str],
+        body: Body = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+    ) -> Response:
+        """Sends the request through the inner transport, recording it.
+
+        Args:
+            method: The HTTP method.
+            url: The absolute URL to request.
+            headers: Request headers.
+            body: Request body.
+            timeout: Connect and read timeouts for the request.
+
+        Returns:
+            The Response, which the caller must close for its body to be recorded.
+
+        Raises:
+            Exception: Whatever the inner transport raised, after recording the failure.
+        """
+        start = self._clock()
+        exchange = Exchange(
+            method=method,
+            url=sanitize_url(url),
+            request_headers=httplog.redact_headers(headers),
+            request_size=httplog.body_size(headers, body),
+            start=start - self._origin,
+        )
+        with self._lock:
+            self.cassette.exchanges.append(exchange)
+        try:
+            r = self.inner.request(method, url, headers=headers, body=body, timeout=timeout)
+        except Exception as e:
+            exchange.status = None
+            exchange.latency = exchange.duration = self._clock() - start
+            exchange.error = f"{type(e).__name__}: {e}"
+            raise
+        exchange.latency = self._clock() - start
+        exchange.status, exchange.reason = r.status, r.reason
+        for name in RESPONSE_HEADERS:
+            value = r.getheader(name)
+            if value is not None:
+                exchange.response_headers[name] = value
+        exchange.response_headers = httplog.redact_headers(exchange.response_headers)
+        return _RecordingResponse(r, exchange, lambda: self._clock() - start)
+
+    def warm_up(self, urls: Iterable[str], *, background: bool = False) -> None:
+        """Warms up connections of the inner transport.
+
+        Args:
+            urls: URLs whose hosts will be requested soon.
+            background: If true, return immediately and warm up on a background thread.
+        """
+        self.inner.warm_up(urls, background=background)
+
+    def close(self) -> None:
+        """Closes the inner transport."""
+        self.inner.close()
+
+
+class _RecordingResponse(Response):
+    def __init__(self, r: Response, exchange: Exchange, elapsed: Callable[[], float]) -> None:
+        self.status = r.status
+        self.reason = r.reason
+        self._r = r
+        self._exchange = exchange
+        self._elapsed = elapsed
+        self._chunks: List[bytes] = []
+        self._closed = False
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self._r.getheader(name, default)
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        data = self._r.read(amt)
+        self._chunks.append(data)
+        return data
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._exchange.duration = self._elapsed()
+            self._exchange.body = _sanitize_body(b"".join(self._chunks))
+        self._r.close()
+
+
+class ReplayServer(StandInServer):
+    """A local HTTP server replaying the responses of a cassette.
+
+    Requests are matched to exchanges by method and path, and each matching exchange is
+    replayed once, in recorded order; once they run out, the last one is repeated. Its response
+    headers are delayed by its recorded latency and its body by the time it took to read, both
+    multiplied by ``scale``. Exchanges that failed without a response are replayed by closing
+    the connection. Requests without a recorded exchange get a 404.
+
+    Attributes:
+        cassette: The cassette being replayed.
+        scale: Factor applied to the recorded delays; 0 replays without delays.
+    """
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        *,
+        scale: float = 1.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        """Constructs a ReplayServer, which listens once started.
+
+        Args:
+            cassette: The cassette to replay.
+            scale: Factor applied to the recorded delays.
+            host: Address to listen on.
+            port: Port to listen on, or 0 to pick a free one.
+        """
+        super().__init__(host=host, port=port)
+        self.cassette = cassette
+        self.scale = scale
+        self._pending: Dict[Tuple[str, str], Deque[Exchange]] = collections.defaultdict(
+            collections.deque
+        )
+        for exchange in cassette.exchanges:
+            self._pending[(exchange.method, exchange.path)].append(exchange)
+        self._last: Dict[Tuple[str, str], Exchange] = {}
+
+    def _reply(self, method: str, path: str, body: bytes) -> _Reply:
+        key = (method, path)
+        with self._lock:
+            self.requests[path] += 1
+            if method == "PUT":
+                self.bytes_uploaded += len(body)
+            pending = self._pending.get(key)
+            if pending:
+                self._last[key] = pending.popleft()
+            exchange = self._last.get(key)
+        if exchange is None:
+            data = json.dumps({"message": f"No recorded exchange for {method} {path}"})
+            return _Reply(404, {"Content-Type": "application/json"}, data.encode(), 0.0)
+        delay = exchange.latency * self.scale
+        if exchange.status is None:
+            return _Reply(0, {}, None, delay)
+        body_delay = max(0.0, exchange.duration - exchange.latency) * self.scale
+        return _Reply(exchange.status, exchange.response_headers, exchange.body, delay, body_delay)
@@ -0,0 +1,441 @@
+"""Shrinking EPUB files before they are uploaded.
+
+EPUBs as produced by many tools are larger than they need to be: entries stored uncompressed
+or weakly compressed, images at print resolution, and embedded fonts that no document uses.
+:class:`Minimizer` rewrites an EPUB one entry at a time, recompressing entries, downscaling
+images larger than a kindle screen and dropping unreferenced images and fonts. The result is
+cached by the content hash of the original, so sending the same book again costs nothing.
+The least recently used results are evicted once the cache outgrows its size or age limit.
+
+Downscaling images requires Pillow; without it images are left as they are.
+"""
+
+import hashlib
+import io
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import time
+import urllib.parse
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterator, Optional, Set, Tuple
+
+from stkclient import phases
+
+try:
+    from defusedxml.ElementTree import fromstring as xml_parse
+except ImportError:
+    from xml.etree.ElementTree import fromstring as xml_parse  # noqa: S405
+
+try:
+    from PIL import Image
+
+    _HAS_PIL = True
+except ImportError:  # pragma: no cover
+    _HAS_PIL = False
+
+# Bump when the output for a given input and options changes, to invalidate cached results
+_VERSION = 1
+
+# Entries already compressed by their format, which deflate can't shrink
+_STORED_EXTENSIONS = frozenset([".gif", ".jpeg", ".jpg", ".png", ".woff", ".woff2"])
+
+_TEXT_EXTENSIONS = frozenset([".css", ".htm", ".html", ".ncx", ".svg", ".xhtml", ".xml"])
+
+# Dublin Core elements of the package metadata returned by read_metadata, by their key
+_METADATA_KEYS = {"title": "title", "creator": "author"}
+
+# Attribute values and CSS url()/@import targets that may name another entry of the archive
+_REFERENCE = re.compile(
+    r"""\b(?P<attr>href|src|srcset|poster)\s*=\s*(?P<q>["'])(?P<value>.*?)(?P=q)"""
+    r"""|\burl\(\s*(?P<uq>["']?)(?P<url>[^"')]*)(?P=uq)\s*\)"""
+    r"""|@import\s+(?P<iq>["'])(?P<import>[^"']*)(?P=iq)""",
+    re.IGNORECASE | re.DOTALL,
+)
+
+_ITEM_TAG = re.compile(r"<(?:\w+:)?item\b[^>]*?(?:/>|>\s*</(?:\w+:)?item>)", re.DOTALL)
+
+
+@dataclass(frozen=True)
+class Options:
+    """How an EPUB is minimized.
+
+    Attributes:
+        max_image_size: Images larger than this (width, height) in pixels are downscaled to fit.
+            The default is the screen of a 300 ppi kindle.
+        jpeg_quality: Quality of re-encoded JPEG images, from 1 to 95.
+        compresslevel: Deflate compression level of the entries, from 0 to 9.
+        drop_unused: Whether to drop images and fonts that nothing in the book refers to.
+    """
+
+    max_image_size: Tuple[int, int] = (1264, 1680)
+    jpeg_quality: int = 85
+    compresslevel: int = 9
+    drop_unused: bool = True
+
+
+DEFAULT_OPTIONS = Options()
+
+# Bytes of minimized files kept in the cache
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# Seconds a cached result is kept since it was last used
+DEFAULT_CACHE_AGE = 30 * 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class MinimizeReport:
+    """The outcome of minimizing one EPUB.
+
+    Attributes:
+        source: The original file.
+        path: The file to upload instead, which is source itself if minimizing didn't help.
+        original_size: Size of the original file in bytes.
+        size: Size of the file to upload in bytes.
+        cached: Whether the result came from the cache.
+        dropped: Names of the entries dropped as unused.
+        upload_seconds: Seconds the upload of path took, once it has been uploaded.
+    """
+
+    source: Path
+    path: Path
+    original_size: int
+    size: int
+    cached: bool
+    dropped: Tuple[str, ...] = ()
+    upload_seconds: Optional[float] = field(default=None, compare=False)
+
+    @property
+    def bytes_saved(self) -> int:
+        """Bytes not uploaded thanks to minimizing."""
+        return self.original_size - self.size
+
+    @property
+    def upload_seconds_saved(self) -> Optional[float]:
+        """Estimated upload time saved, at the throughput of the actual upload, if known."""
+        if self.upload_seconds is None or self.size == 0:
+            return None
+        return self.upload_seconds * self.bytes_saved / self.size
+
+
+MinimizeCallback = Callable[[MinimizeReport], None]
+
+
+class Minimizer:
+    """Minimizes EPUBs into a cache directory.
+
+    A Minimizer may be shared by threads. Concurrent minimizations of the same content do the
+    work twice but produce the same cached file. Each time a result is stored, results unused for
+    longer than max_cache_age are evicted, then the least recently used ones until the cache
+    holds at most max_cache_size bytes.
+
+    Example:
+        >>> import io, tempfile, zipfile
+        >>> from pathlib import Path
+        >>> from stkclient.epub import Minimizer
+        >>> tmp = Path(tempfile.mkdtemp())
+        >>> with zipfile.ZipFile(tmp / "book.epub", "w") as z:
+        ...     z.writestr("mimetype", "application/epub+zip")
+        ...     z.writestr("chapter.xhtml", "<p>All work and no play.</p>" * 1000)
+        >>> m = Minimizer(tmp / "cache")
+        >>> first, second = m.minimize(tmp / "book.epub"), m.minimize(tmp / "book.epub")
+        >>> first.bytes_saved > 20000, first.cached, second.cached, second.path == first.path
+        (True, False, True, True)
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        options: Options = DEFAULT_OPTIONS,
+        on_report: Optional[MinimizeCallback] = None,
+        max_cache_size: int = DEFAULT_CACHE_SIZE,
+        max_cache_age: float = DEFAULT_CACHE_AGE,
+    ) -> None:
+        """Constructs a Minimizer.
+
+        Args:
+            cache_dir: Directory holding minimized files, created if missing.
+            options: How EPUBs are minimized.
+            on_report: Optional callback receiving a report once a minimized file is uploaded.
+            max_cache_size: Bytes of minimized files the cache may hold.
+            max_cache_age: Seconds a cached result is kept since it was last used.
+        """
+        self.cache_dir = cache_dir
+        self.options = options
+        self.max_cache_size = max_cache_size
+        self.max_cache_age = max_cache_age
+        self._on_report = on_report
+
+    def minimize(self, file_path: Path) -> MinimizeReport:
+        """Returns the minimized version of an EPUB, from the cache if it was minimized before.
+
+        Files that aren't valid EPUB archives are returned as they are.
+
+        Args:
+            file_path: The EPUB to minimize.
+
+        Returns:
+            MinimizeReport instance, whose upload_seconds is None.
+        """
+        with phases.phase("minimize"):
+            original_size = file_path.stat().st_size
+            key = self._cache_key(file_path)
+            cached = self.cache_dir / f"{key}.epub"
+            unchanged = self.cache_dir / f"{key}.unchanged"
+            if _touch(cached):
+                return MinimizeReport(file_path, cached, original_size, cached.stat().st_size, True)
+            if _touch(unchanged):
+                return MinimizeReport(file_path, file_path, original_size, original_size, True)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    dropped = _minimize(file_path, out, self.options)
+                size = os.path.getsize(tmp)
+                if size < original_size:
+                    os.replace(tmp, cached)
+                    self._evict(keep=cached)
+                    return MinimizeReport(file_path, cached, original_size, size, False, dropped)
+                unchanged.touch()
+                self._evict(keep=unchanged)
+            except (
+                zipfile.BadZipFile,
+                zipfile.LargeZipFile,
+                NotImplementedError,  # An unsupported compression method
+                KeyError,
+                ValueError,
+                SyntaxError,
+            ):
+                pass  # Not an archive this can rewrite; send it as it is
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+            return MinimizeReport(file_path, file_path, original_size, original_size, False)
+
+    def report(self, report: MinimizeReport) -> None:
+        """Passes the report of an uploaded file to the on_report callback, if there is one."""
+        if self._on_report is not None:
+            self._on_report(report)
+
+    def _evict(self, keep: Path) -> None:
+        """Deletes cached results past max_cache_age, then the oldest past max_cache_size."""
+        entries = []
+        for path in self.cache_dir.iterdir():
+            if path.suffix not in (".epub", ".unchanged") or path == keep:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # Evicted by another thread or process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(reverse=True)
+        expiry = time.time() - self.max_cache_age
+        total = keep.stat().st_size
+        for mtime, size, path in entries:
+            total += size
+            if mtime < expiry or total > self.max_cache_size:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass  # Evicted by another thread or process
+
+    def _cache_key(self, file_path: Path) -> str:
+        h = hashlib.sha256(f"{_VERSION} {self.options!r} {_HAS_PIL}\n".encode())
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+
+def _touch(path: Path) -> bool:
+    """Marks a cached result as just used, and returns whether it exists."""
+    try:
+        os.utime(path)
+    except OSError:
+        return False
+    return True
+
+
+def read_metadata(file_path: Path) -> Dict[str, str]:
+    """Returns the title and author of an EPUB, as far as its package document records them.
+
+    Example:
+        >>> import tempfile, zipfile
+        >>> from pathlib import Path
+        >>> from stkclient.epub import read_metadata
+        >>> path = Path(tempfile.mkdtemp()) / "book.epub"
+        >>> with zipfile.ZipFile(path, "w") as z:
+        ...     z.writestr("META-INF/container.xml", '<container><rootfiles>'
+        ...                '<rootfile full-path="content.opf"/></rootfiles></container>')
+        ...     z.writestr("content.opf", '<package><metadata '
+        ...                'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        ...                '<dc:title> Moby-Dick </dc:title><dc:creator>Herman Melville'
+        ...                '</dc:creator></metadata></package>')
+        >>> read_metadata(path)
+        {'title': 'Moby-Dick', 'author': 'Herman Melville'}
+    """
+    try:
+        with zipfile.ZipFile(file_path) as zin:
+            opf_name = _find_opf(zin)
+            if opf_name is None:
+                return {}
+            package = xml_parse(zin.read(opf_name))  # noqa S314
+    except (zipfile.BadZipFile, KeyError, ValueError, SyntaxError):
+        return {}
+    metadata: Dict[str, str] = {}
+    for element in package.iter():
+        key = _METADATA_KEYS.get(element.tag.rsplit("}", 1)[-1])
+        text = (element.text or "").strip()
+        if key is not None and text and key not in metadata:
+            metadata[key] = text
+    return metadata
+
+
+def _minimize(file_path: Path, out: IO[bytes], options: Options) -> Tuple[str, ...]:
+    """Writes a minimized copy of an EPUB to out, and returns the names of dropped entries."""
+    with zipfile.ZipFile(file_path) as zin:
+        infos = zin.infolist()
+        opf_name = _find_opf(zin)
+        unused: Dict[str, str] = {}
+        opf = zin.read(opf_name).decode("utf-8") if opf_name is not None else None
+        if opf is not None and opf_name is not None and options.drop_unused:
+            unused = _unused_resources(zin, opf_name, opf)
+            opf = _ITEM_TAG.sub(lambda m: "" if _item_id(m.group(0)) in unused else m.group(0), opf)
+        dropped = set(unused.values())
+        compression = zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(out, "w", compression, compresslevel=options.compresslevel) as zout:
+            # The mimetype entry must come first, uncompressed
+            for info in sorted(infos, key=lambda i: i.filename != "mimetype"):
+                name = info.filename
+                ext = posixpath.splitext(name)[1].lower()
+                if name in dropped or name.endswith("/"):
+                    continue
+                if name == opf_name and opf is not None:
+                    zout.writestr(name, opf.encode("utf-8"))
+                elif ext in (".jpeg", ".jpg", ".png"):
+                    zout.writestr(name, _shrink_image(zin.read(info), options), zipfile.ZIP_STORED)
+                elif name == "mimetype" or ext in _STORED_EXTENSIONS:
+                    zout.writestr(name, zin.read(info), zipfile.ZIP_STORED)
+                else:
+                    with zin.open(info) as src, zout.open(name, "w") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return tuple(sorted(dropped))
+
+
+def _find_opf(zin: zipfile.ZipFile) -> Optional[str]:
+    try:
+        container = xml_parse(zin.read("META-INF/container.xml"))  # noqa S314
+    except KeyError:
+        return None
+    for element in container.iter():
+        if element.tag.endswith("rootfile") and element.get("full-path"):
+            return element.get("full-path")
+    return None
+
+
+def _unused_resources(zin: zipfile.ZipFile, opf_name: str, opf: str) -> Dict[str, str]:
+    """Returns the images and fonts nothing refers to, as a map of manifest id to entry name.
+
+    Example:
+        >>> import io, zipfile
+        >>> from stkclient.epub import _unused_resources
+        >>> opf = '''<package xmlns="http://www.idpf.org/2007/opf"><metadata>
+        ...   <meta name="cover" content="c"/></metadata><manifest>
+        ...   <item id="c" href="img/cover.jpg" media-type="image/jpeg"/>
+        ...   <item id="ch" href="ch.xhtml" media-type="application/xhtml+xml"/>
+        ...   <item id="used" href="img/map%20a.png" media-type="image/png"/>
+        ...   <item id="unused" href="img/b.png" media-type="image/png"/>
+        ...   <item id="font" href="fonts/x.otf" media-type="font/otf"/>
+        ... </manifest></package>'''
+        >>> buf = io.BytesIO()
+        >>> with zipfile.ZipFile(buf, "w") as z:
+        ...     z.writestr("OEBPS/ch.xhtml", '<img src="img/map%20a.png"/> b.png')
+        >>> sorted(_unused_resources(zipfile.ZipFile(buf), "OEBPS/content.opf", opf).items())
+        [('font', 'OEBPS/fonts/x.otf'), ('unused', 'OEBPS/img/b.png')]
+    """
+    package = xml_parse(opf.encode("utf-8"))  # noqa S314
+    base = posixpath.dirname(opf_name)
+    keep: Set[str] = set()
+    candidates: Dict[str, str] = {}
+    for element in package.iter():
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "meta" and element.get("name") == "cover":
+            keep.add(element.get("content", ""))
+        elif tag == "item":
+            media_type = element.get("media-type", "")
+            if "cover-image" in element.get("properties", "").split():
+                keep.add(element.get("id", ""))
+            elif (
+                media_type.startswith("image/") or "font" in media_type or "opentype" in media_type
+            ):
+                href = urllib.parse.unquote(element.get("href", ""))
+                candidates[element.get("id", "")] = posixpath.normpath(posixpath.join(base, href))
+    referenced: Set[str] = set()
+    for info in zin.infolist():
+        ext = posixpath.splitext(info.filename)[1].lower()
+        if info.filename == opf_name or ext not in _TEXT_EXTENSIONS:
+            continue
+        text = zin.read(info).decode("utf-8", "replace")
+        referenced.update(_references(info.filename, text))
+    return {
+        id: name for id, name in candidates.items() if id not in keep and name not in referenced
+    }
+
+
+def _references(entry_name: str, text: str) -> Iterator[str]:
+    """Yields the archive entries a text entry refers to, resolved against its directory.
+
+    Example:
+        >>> from stkclient.epub import _references
+        >>> text = '<a href="../img/caf%C3%A9.png#top"/><p style="background: url(/bg.png)"/>'
+        >>> sorted(_references("OEBPS/text/ch.xhtml", text))
+        ['OEBPS/img/café.png', 'bg.png']
+    """
+    base = posixpath.dirname(entry_name)
+    for m in _REFERENCE.finditer(text):
+        if m.group("attr") is not None and m.group("attr").lower() == "srcset":
+            urls = [c.split()[0] for c in m.group("value").split(",") if c.strip()]
+        else:
+            urls = [m.group("value") or m.group("url") or m.group("import") or ""]
+        for url in urls:
+            parts = urllib.parse.urlsplit(url.strip())
+            path = urllib.parse.unquote(parts.path)
+            if parts.scheme or parts.netloc or not path:
+                continue  # Outside the archive, or a fragment of the entry itself
+            if path.startswith("/"):
+                yield posixpath.normpath(path.lstrip("/"))
+            else:
+                yield posixpath.normpath(posixpath.join(base, path))
+
+
+def _item_id(tag: str) -> Optional[str]:
+    m = re.search(r"""\bid\s*=\s*["']([^"']*)["']""", tag)
+    return m.group(1) if m else None
+
+
+def _shrink_image(data: bytes, options: Options) -> bytes:
+    """Downscales a JPEG or PNG image to fit options.max_image_size, if that makes it smaller."""
+    if not _HAS_PIL:
+        return data  # pragma: no cover
+    max_width, max_height = options.max_image_size
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width <= max_width and image.height <= max_height:
+                return data
+            format = image.format
+            image.thumbnail(options.max_image_size)
+            out = io.BytesIO()
+            if format == "JPEG":
+                image.save(out, "JPEG", quality=options.jpeg_quality, optimize=True)
+            elif format == "PNG":
+                image.save(out, "PNG", optimize=True)
+            else:
+                return data
+    except (OSError, ValueError):
+        return data  # Leave images Pillow can't read as they are
+    shrunk = out.getvalue()
+    return shrunk if len(shrunk) < len(data) else data
@@ -0,0 +1,218 @@
+"""Pre-flight format detection and checks, run before any file is uploaded.
+
+SendToKindle only rejects an unsupported, mislabelled or oversize document after it has been
+uploaded. :func:`sniff` identifies a document from its first few bytes, and :class:`Policy`
+checks it locally, so such sends fail at once instead of after the upload. Only the formats in
+``DEFAULT_FORMATS`` (and their aliases, such as azw3 for mobi) are accepted by default; pass a
+Policy with more formats to send others.
+"""
+
+import codecs
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, FrozenSet, Optional
+
+HEADER_BYTES = 4096
+
+# Formats accepted by the send-to-kindle service
+DEFAULT_FORMATS = frozenset(
+    ["bmp", "doc", "docx", "epub", "gif", "html", "jpeg", "mobi", "pdf", "png", "rtf", "txt"]
+)
+
+DEFAULT_MAX_SIZE = 200 * 1024 * 1024
+
+_MAGIC = [
+    (b"%PDF-", "pdf"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "doc"),
+    (b"{\\rtf", "rtf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"\xff\xd8\xff", "jpeg"),
+]
+
+# AZW3 (KF8) books share MOBI's PalmDB container and signature
+_ALIASES = {
+    "htm": "html",
+    "jpg": "jpeg",
+    "azw": "mobi",
+    "azw3": "mobi",
+    "prc": "mobi",
+    "text": "txt",
+}
+
+
+class PreflightError(ValueError):
+    """Raised when a file would certainly be rejected by the service."""
+
+
+def sniff(header: bytes) -> Optional[str]:
+    """Identifies a document format from the first bytes of a file.
+
+    Args:
+        header: The start of the file; ``HEADER_BYTES`` bytes are enough.
+
+    Returns:
+        A lowercase format name such as "pdf" or "epub", "txt" for anything that looks like
+        plain text, or None if the format is not recognized.
+
+    Example:
+        >>> from stkclient.formats import sniff
+        >>> sniff(b"%PDF-1.7"), sniff(b"Call me Ishmael."), sniff(bytes(16))
+        ('pdf', 'txt', None)
+    """
+    if header.startswith(b"PK\x03\x04"):
+        return _sniff_zip(header)
+    if header[60:68] in (b"BOOKMOBI", b"TEXtREAd"):
+        return "mobi"
+    for magic, format in _MAGIC:
+        if header.startswith(magic):
+            return format
+    if header.startswith(b"BM") and len(header) >= 26 and header[14] in (12, 40, 108, 124):
+        return "bmp"
+    text = _decode_text(header)
+    if text is None:
+        return None
+    start = text.lstrip("\ufeff \t\r\n").lower()
+    if start.startswith(("<!doctype html", "<html")):
+        return "html"
+    return "txt"
+
+
+def sniff_file(file_path: Path) -> Optional[str]:
+    """Identifies the format of a file from its first ``HEADER_BYTES`` bytes.
+
+    ZIP archives that the first bytes don't identify are recognized from the names in their
+    central directory.
+
+    Args:
+        file_path: The file to read.
+
+    Returns:
+        The format name, or None if it is not recognized.
+    """
+    with open(file_path, "rb") as f:
+        return _sniff_open_file(f, f.read(HEADER_BYTES))
+
+
+def normalize(format: str) -> str:
+    """Returns the canonical lowercase name of a format, such as "jpeg" for "JPG"."""
+    name = format.lower().lstrip(".")
+    return _ALIASES.get(name, name)
+
+
+@dataclass(frozen=True)
+class Policy:
+    """Formats and sizes that may be sent.
+
+    Attributes:
+        formats: Canonical names of the formats accepted.
+        max_size: Largest file size in bytes accepted.
+    """
+
+    formats: FrozenSet[str] = DEFAULT_FORMATS
+    max_size: int = DEFAULT_MAX_SIZE
+
+    def check(self, file_path: Path, format: Optional[str] = None) -> str:
+        """Checks a file against the policy without any network access.
+
+        Args:
+            file_path: The file to be sent.
+            format: The declared format, or None to use the detected one.
+
+        Returns:
+            The format to send the file as.
+
+        Raises:
+            PreflightError: The file is empty, too large, of an unknown or unaccepted format, or
+                its content contradicts the declared format.
+
+        # noqa: DAR402 PreflightError
+        """
+        with open(file_path, "rb") as f:
+            detected = _sniff_open_file(f, f.read(HEADER_BYTES))
+        return self._check(detected, file_path.stat().st_size, format, str(file_path))
+
+    def check_header(
+        self, header: bytes, size: int, format: Optional[str] = None, name: str = "document"
+    ) -> str:
+        """Checks a document by its first bytes and size, for documents that aren't files.
+
+        Args:
+            header: The first ``HEADER_BYTES`` bytes of the document, or all of it if shorter.
+            size: Size of the document in bytes.
+            format: The declared format, or None to use the detected one.
+            name: Name of the document in error messages.
+
+        Returns:
+            The format to send the document as.
+
+        Raises:
+            PreflightError: The document is empty, too large, of an unknown or unaccepted format,
+                or its content contradicts the declared format.
+
+        # noqa: DAR402 PreflightError
+        """
+        return self._check(sniff(header), size, format, name)
+
+    def _check(self, detected: Optional[str], size: int, format: Optional[str], name: str) -> str:
+        if size == 0:
+            raise PreflightError(f"{name} is empty")
+        if size > self.max_size:
+            raise PreflightError(f"{name} is {size} bytes, more than the limit of {self.max_size}")
+        if format is None:
+            if detected is None:
+                raise PreflightError(f"Could not detect the format of {name}")
+            format = detected
+        elif detected not in (None, "txt") and normalize(format) != detected:
+            # Text detection is a fallback, so only a binary signature contradicts a declaration
+            raise PreflightError(f"{name} is declared as {format} but looks like {detected}")
+        if normalize(format) not in self.formats:
+            raise PreflightError(f"{format} files can't be sent")
+        return format
+
+
+DEFAULT_POLICY = Policy()
+
+
+def _sniff_zip(header: bytes) -> Optional[str]:
+    # EPUB requires an uncompressed "mimetype" first entry; OOXML documents have a word/ part
+    if header[30:38] == b"mimetype" and b"application/epub+zip" in header[38:100]:
+        return "epub"
+    if b"word/" in header:
+        return "docx"
+    return None
+
+
+def _sniff_open_file(f: IO[bytes], header: bytes) -> Optional[str]:
+    detected = sniff(header)
+    if detected is None and header.startswith(b"PK\x03\x04"):
+        # The entries that identify an archive may come after others larger than the header
+        detected = _sniff_zip_directory(f)
+    return detected
+
+
+def _sniff_zip_directory(f: IO[bytes]) -> Optional[str]:
+    try:
+        with zipfile.ZipFile(f) as z:
+            names = set(z.namelist())
+            if "word/document.xml" in names:
+                return "docx"
+            if "mimetype" in names and z.read("mimetype").strip() == b"application/epub+zip":
+                return "epub"
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, RuntimeError, OSError):
+        pass  # RuntimeError includes encrypted entries and unsupported compression methods
+    return None
+
+
+def _decode_text(header: bytes) -> Optional[str]:
+    if b"\x00" in header:
+        return None
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        text: str = decoder.decode(header, final=False)  # header may end mid-character
+    except UnicodeDecodeError:
+        return None
+    control = sum(1 for c in text if c < " " and c not in "\t\r\n\f")
+    return text if control <= len(text) // 100 else None
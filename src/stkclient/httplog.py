@@ -0,0 +1,202 @@
+"""Structured logging of the HTTP requests sent by :mod:`stkclient.api`.
+
+Every attempt of every request is logged to the ``stkclient.http`` logger as one record, with
+its endpoint, status, byte counts, timings and attempt number in a ``http`` attribute for
+handlers that emit structured logs. At INFO the record carries no headers; at DEBUG it also
+carries the request and a few response headers, with credentials redacted.
+
+The logger is silent until its own level is set to INFO or DEBUG, either by the application,
+through :func:`configure` (the ``-v`` and ``-vv`` options of the stkclient script) or by setting
+the ``STKCLIENT_HTTP_LOG`` environment variable to ``1``/``info`` or ``2``/``debug`` before
+stkclient is imported. A level inherited from the root logger doesn't count, so applications
+logging at INFO don't get a line per request, and importing stkclient leaves the level alone.
+While it is silent, logging a request costs two level checks: no record is built or formatted.
+"""
+
+import logging
+import os
+import sys
+import warnings
+from typing import IO, Any, Dict, Mapping, Optional
+
+from stkclient.transport import Body, Response
+
+logger = logging.getLogger("stkclient.http")
+
+ENV_VAR = "STKCLIENT_HTTP_LOG"
+
+REDACTED = "<redacted>"
+
+# Response headers included in DEBUG records, for matching requests with server-side logs
+RESPONSE_HEADERS = (
+    "Content-Type",
+    "Content-Length",
+    "Retry-After",
+    "x-amzn-RequestId",
+    "x-amz-request-id",
+)
+
+_ENV_LEVELS = {"": 0, "0": 0, "1": 1, "info": 1, "2": 2, "debug": 2}
+
+_handler: Optional[logging.Handler] = None
+
+
+def enabled() -> bool:
+    """Returns whether requests are currently being logged."""
+    return logger.level != logging.NOTSET and logger.isEnabledFor(logging.INFO)
+
+
+def redact_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    """Returns a copy of headers with credentials replaced by REDACTED.
+
+    The X-ADP-* signing headers, Authorization, cookies and anything named like a token are
+    redacted.
+
+    Example:
+        >>> from stkclient.httplog import redact_headers
+        >>> redact_headers({"X-ADP-Authentication-Token": "secret", "Accept": "*/*"})
+        {'X-ADP-Authentication-Token': '<redacted>', 'Accept': '*/*'}
+    """
+    return {k: REDACTED if _is_secret(k) else v for k, v in headers.items()}
+
+
+def _is_secret(name: str) -> bool:
+    lower = name.lower()
+    return (
+        lower.startswith("x-adp-")
+        or lower in ("authorization", "proxy-authorization", "cookie", "set-cookie")
+        or "token" in lower
+    )
+
+
+def log_request(
+    method: str,
+    endpoint: str,
+    headers: Mapping[str, str],
+    body: Body,
+    *,
+    attempt: int,
+    wait: float,
+    start: float,
+    responded: Optional[float],
+    end: float,
+    response: Optional[Response] = None,
+    received: Optional[int] = None,
+    error: Optional[BaseException] = None,
+) -> None:
+    """Logs one attempt of a request, if logging is enabled.
+
+    Times are readings of the same monotonic clock, in seconds.
+
+    Args:
+        method: The HTTP method.
+        endpoint: Host and path of the request, without the query string.
+        headers: The request headers, which are redacted before being logged.
+        body: The request body.
+        attempt: Number of earlier attempts of the request, which were retried.
+        wait: Seconds spent waiting for the rate limiter before the attempt.
+        start: When the request was started.
+        responded: When the response headers arrived, or None if they didn't.
+        end: When the response body was read or the attempt failed.
+        response: The response, if there was one.
+        received: Size of the response body, if it was read.
+        error: The exception that ended the attempt, if it failed.
+    """
+    if not enabled():
+        return
+    record: Dict[str, Any] = {
+        "method": method,
+        "endpoint": endpoint,
+        "status": response.status if response is not None else None,
+        "attempt": attempt,
+        "bytes_sent": body_size(headers, body),
+        "bytes_received": received,
+        "wait": wait,
+        "response": responded - start if responded is not None else None,
+        "read": end - responded if responded is not None else None,
+        "total": end - start,
+        "error": f"{type(error).__name__}: {error}" if error is not None else None,
+    }
+    level = logging.INFO
+    if logger.isEnabledFor(logging.DEBUG):
+        level = logging.DEBUG
+        record["request_headers"] = redact_headers(headers)
+        if response is not None:
+            record["response_headers"] = _response_headers(response)
+    logger.log(
+        level,
+        "%s %s %s in %.3fs (wait %.3fs) sent %sB received %sB attempt %d%s",
+        method,
+        endpoint,
+        record["status"] if error is None else record["error"],
+        record["total"],
+        wait,
+        record["bytes_sent"],
+        received,
+        attempt + 1,
+        "" if level == logging.INFO else f" {record.get('request_headers')}",
+        extra={"http": record},
+    )
+
+
+def body_size(headers: Mapping[str, str], body: Body) -> Optional[int]:
+    """Returns the size of a request body, or None if it is streamed without a Content-Length."""
+    if body is None:
+        return 0
+    if isinstance(body, bytes):
+        return len(body)
+    length = headers.get("Content-Length")
+    return int(length) if length is not None and length.isdigit() else None
+
+
+def _response_headers(response: Response) -> Dict[str, str]:
+    headers = {}
+    for name in RESPONSE_HEADERS:
+        value = response.getheader(name)
+        if value is not None:
+            headers[name] = value
+    return redact_headers(headers)
+
+
+def configure(verbosity: int, stream: Optional[IO[str]] = None) -> None:
+    """Sets how verbosely requests are logged, writing them to stream.
+
+    Calling this again replaces the handler installed by the previous call.
+
+    Args:
+        verbosity: 0 to stop logging requests, 1 to log them at INFO, or 2 or more to log them
+            with headers at DEBUG.
+        stream: Where to write records, by default sys.stderr.
+    """
+    global _handler
+    if _handler is not None:
+        logger.removeHandler(_handler)
+        _handler = None
+    if verbosity <= 0:
+        logger.setLevel(logging.NOTSET)
+        return
+    logger.setLevel(logging.INFO if verbosity == 1 else logging.DEBUG)
+    _handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(_handler)
+
+
+def configure_from_env(environ: Mapping[str, str] = os.environ) -> None:
+    """Configures logging from the STKCLIENT_HTTP_LOG variable of environ, if it is set.
+
+    Args:
+        environ: The environment to read.
+    """
+    value = environ.get(ENV_VAR)
+    if value is None:
+        return
+    verbosity = _ENV_LEVELS.get(value.strip().lower())
+    if verbosity is None:
+        warnings.warn(
+            f"Ignoring {ENV_VAR}={value!r}: expected 0, 1, 2, info or debug", stacklevel=2
+        )
+        return
+    configure(verbosity)
+
+
+configure_from_env()
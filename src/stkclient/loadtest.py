@@ -0,0 +1,284 @@
+"""Open-loop load tests of Client.send_file against a local stand-in server.
+
+Sends arrive at a target rate whether or not earlier sends have finished, as they do in
+production, so a client that falls behind builds a queue instead of quietly slowing the test
+down. The report separates the time sends wait in that queue from the time spent in each phase
+of sending, so queueing collapse shows up as growing queue delay at a steady service time.
+
+Sends go to a :class:`stkclient.standin.StandInServer` through a per-thread connection pool,
+and pass through the process-wide rate and bandwidth limiters like real sends.
+"""
+
+import collections
+import concurrent.futures
+import copy
+import math
+import random
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Counter, Dict, List, Optional, Sequence
+
+from stkclient import Client, phases
+from stkclient.cancel import CancelledError, CancelToken
+from stkclient.standin import StandInServer
+from stkclient.transport import PooledTransport
+
+QUANTILES = (50.0, 95.0, 99.0, 99.9)
+
+SizeDistribution = Callable[[random.Random], int]
+
+
+def fixed(size: int) -> SizeDistribution:
+    """Returns a distribution always producing size bytes."""
+    return lambda rng: size
+
+
+def uniform(low: int, high: int) -> SizeDistribution:
+    """Returns a distribution of sizes uniformly distributed between low and high bytes."""
+    return lambda rng: rng.randint(low, high)
+
+
+def lognormal(median: int, sigma: float) -> SizeDistribution:
+    """Returns a log-normal distribution of sizes, typical of document collections.
+
+    Args:
+        median: The median size in bytes.
+        sigma: Standard deviation of the size's natural logarithm; 1.0 gives a long tail.
+
+    Returns:
+        The distribution.
+    """
+    mu = math.log(median)
+    return lambda rng: max(1, int(rng.lognormvariate(mu, sigma)))
+
+
+@dataclass
+class PhaseLatency:
+    """Latency quantiles of one phase.
+
+    Attributes:
+        phase: Names of the phase and its enclosing phases, joined by "/".
+        count: Number of samples.
+        p50: Median latency in seconds.
+        p95: 95th percentile latency in seconds.
+        p99: 99th percentile latency in seconds.
+        p999: 99.9th percentile latency in seconds.
+    """
+
+    phase: str
+    count: int
+    p50: float
+    p95: float
+    p99: float
+    p999: float
+
+    @staticmethod
+    def from_samples(phase: str, samples: Sequence[float]) -> "PhaseLatency":
+        """Computes the quantiles of samples, which must not be empty."""
+        ordered = sorted(samples)
+        return PhaseLatency(phase, len(ordered), *(_quantile(ordered, q) for q in QUANTILES))
+
+
+@dataclass
+class LoadTestReport:
+    """The results of a load test.
+
+    Attributes:
+        offered_rate: Target arrival rate in sends per second.
+        concurrency: Maximum number of sends in flight.
+        elapsed: Seconds from the first arrival until the last send finished.
+        arrivals: Number of sends that arrived.
+        completed: Number of sends that succeeded.
+        failed: Number of sends that raised an error.
+        unfinished: Number of sends cancelled because they had not finished in time.
+        bytes_sent: Total size of the completed sends.
+        errors: Number of failures by exception type name.
+        phases: Latency of queueing (the "queue" phase) and of each phase of sending.
+    """
+
+    offered_rate: float
+    concurrency: int
+    elapsed: float
+    arrivals: int
+    completed: int
+    failed: int
+    unfinished: int
+    bytes_sent: int
+    errors: Dict[str, int]
+    phases: List[PhaseLatency]
+
+    @property
+    def throughput(self) -> float:
+        """Completed sends per second."""
+        return self.completed / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        """Fraction of finished sends that failed."""
+        finished = self.completed + self.failed
+        return self.failed / finished if finished else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the report as JSON-serializable data, times in seconds."""
+        d = asdict(self)
+        d["throughput"] = self.throughput
+        d["error_rate"] = self.error_rate
+        return d
+
+    def format(self) -> str:
+        """Returns the report as human-readable text."""
+        lines = [
+            f"offered       {self.offered_rate:.2f} sends/s, concurrency {self.concurrency}",
+            f"achieved      {self.throughput:.2f} sends/s,"
+            f" {self.bytes_sent / self.elapsed / 1024 / 1024 if self.elapsed else 0:.2f} MiB/s"
+            f" over {self.elapsed:.2f} s",
+            f"sends         {self.arrivals} arrived, {self.completed} completed,"
+            f" {self.failed} failed, {self.unfinished} unfinished",
+            f"error rate    {self.error_rate:.2%}",
+        ]
+        for name, count in sorted(self.errors.items()):
+            lines.append(f"  {name}: {count}")
+        lines += ["", f"{'phase':<34}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'p999':>10}  (ms)"]
+        for p in self.phases:
+            lines.append(
+                f"{p.phase:<34}{p.count:>7}{p.p50 * 1000:>10.1f}{p.p95 * 1000:>10.1f}"
+                f"{p.p99 * 1000:>10.1f}{p.p999 * 1000:>10.1f}"
+            )
+        return "\n".join(lines)
+
+
+def run(
+    client: Client,
+    *,
+    rate: float,
+    duration: float,
+    sizes: SizeDistribution,
+    concurrency: int = 8,
+    service_latency: float = 0.0,
+    drain_timeout: Optional[float] = None,
+    files: int = 16,
+    seed: Optional[int] = None,
+) -> LoadTestReport:
+    """Runs a load test and returns its report.
+
+    Args:
+        client: The client whose key signs the requests. Its transport is not used.
+        rate: Mean arrival rate in sends per second. Arrivals follow a Poisson process.
+        duration: Seconds during which sends arrive.
+        sizes: Distribution of file sizes.
+        concurrency: Maximum number of sends in flight; later arrivals wait in a queue.
+        service_latency: Seconds the stand-in server delays each response by.
+        drain_timeout: Seconds to wait for queued and in-flight sends once arrivals stop,
+            after which the rest are cancelled; None waits as long as the arrivals took.
+        files: Number of distinct files generated from the size distribution.
+        seed: Seed for arrival times and file sizes, for repeatable runs.
+
+    Returns:
+        LoadTestReport instance.
+
+    Raises:
+        ValueError: rate, duration or concurrency is not positive.
+    """
+    if rate <= 0 or duration <= 0 or concurrency < 1:
+        raise ValueError("rate, duration and concurrency must be positive")
+    rng = random.Random(seed)  # noqa: S311 - not used for security
+    timer = phases.PhaseTimer(keep_samples=True)
+    previous = phases.phase_timer()
+    with tempfile.TemporaryDirectory() as tmp, StandInServer(latency=service_latency) as server:
+        paths = _make_files(Path(tmp), [sizes(rng) for _ in range(files)])
+        serial = server.devices[0]["deviceSerialNumber"]
+        pool = PooledTransport(per_thread=True)
+        client = copy.copy(client)
+        client.transport = server.transport(pool)
+        token = CancelToken()
+        lock = threading.Lock()
+        queue_delays: List[float] = []
+        outcomes: Counter[str] = collections.Counter()
+        errors: Counter[str] = collections.Counter()
+        bytes_sent = [0]
+
+        def send(path: Path, arrived: float) -> None:
+            if not token.cancelled:
+                queue_delays.append(time.monotonic() - arrived)
+            try:
+                with phases.phase("send"):
+                    client.send_file(
+                        path, [serial], author="", title=path.name, format="pdf", cancel=token
+                    )
+            except CancelledError:
+                outcome = "unfinished"
+            except Exception as e:
+                outcome = "failed"
+                with lock:
+                    errors[type(e).__name__] += 1
+            else:
+                outcome = "completed"
+                with lock:
+                    bytes_sent[0] += path.stat().st_size
+            with lock:
+                outcomes[outcome] += 1
+
+        phases.set_phase_timer(timer)
+        executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+        try:
+            futures = []
+            start = time.monotonic()
+            at = rng.expovariate(rate)
+            while at < duration:
+                delay = start + at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(send, rng.choice(paths), time.monotonic()))
+                at += rng.expovariate(rate)
+            arrivals_took = time.monotonic() - start
+            concurrent.futures.wait(
+                futures, drain_timeout if drain_timeout is not None else arrivals_took
+            )
+            token.cancel()
+        finally:
+            executor.shutdown(wait=True)
+            phases.set_phase_timer(previous)
+            pool.close()
+        elapsed = time.monotonic() - start
+    latencies = [PhaseLatency.from_samples("queue", queue_delays)] if queue_delays else []
+    latencies += [
+        PhaseLatency.from_samples("/".join(s.path), s.samples) for s in timer.stats() if s.samples
+    ]
+    return LoadTestReport(
+        offered_rate=rate,
+        concurrency=concurrency,
+        elapsed=elapsed,
+        arrivals=len(futures),
+        completed=outcomes["completed"],
+        failed=outcomes["failed"],
+        unfinished=outcomes["unfinished"],
+        bytes_sent=bytes_sent[0],
+        errors=dict(errors),
+        phases=latencies,
+    )
+
+
+def _make_files(directory: Path, sizes: List[int]) -> List[Path]:
+    paths = []
+    for i, size in enumerate(sizes):
+        path = directory / f"file{i}.pdf"
+        with open(path, "wb") as f:
+            f.truncate(size)
+        paths.append(path)
+    return paths
+
+
+def _quantile(ordered: Sequence[float], q: float) -> float:
+    """Returns the q-th percentile of sorted samples by the nearest-rank method.
+
+    Example:
+        >>> from stkclient.loadtest import _quantile
+        >>> samples = [float(i) for i in range(1, 1001)]
+        >>> _quantile(samples, 50), _quantile(samples, 99.9), _quantile(samples, 100)
+        (500.0, 999.0, 1000.0)
+    """
+    rank = math.ceil(round(q / 100 * len(ordered), 9))  # Round off float error first
+    return ordered[min(len(ordered) - 1, max(0, rank - 1))]
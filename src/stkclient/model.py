@@ -1,7 +1,9 @@
 """Send to Kindle API response and domain objects."""
 
+import sys
+import time
 from dataclasses import dataclass, field, fields
-from typing import Any, List, Mapping, Optional
+from typing import Any, Callable, Dict, List, Mapping, NoReturn, Optional, Tuple
 
 try:
     from defusedxml.ElementTree import fromstring as xml_parse
@@ -55,16 +57,38 @@ class DeviceInfo:
 class OwnedDevice:
     """Represents a user device supported by send-to-kindle.
 
+    Instances have no ``__dict__``, and devices with the same capabilities share a single
+    read-only capabilities dict whose keys are interned.
+
     Attributes:
         device_capabilities: Mapping of capability name to boolean
         device_name: Human readable device name specified by the end user.
         device_serial_number: Unique ID of this device.
     """
 
+    __slots__ = ("device_capabilities", "device_name", "device_serial_number")
+
     device_capabilities: Mapping[str, bool]
     device_name: str
     device_serial_number: str
 
+    def __post_init__(self) -> None:
+        """Replace device_capabilities with the shared mapping for the same capabilities."""
+        object.__setattr__(
+            self, "device_capabilities", _shared_capabilities(self.device_capabilities)
+        )
+
+    def __getstate__(self) -> Tuple[Mapping[str, bool], str, str]:
+        """Returns the fields for pickling."""
+        return (dict(self.device_capabilities), self.device_name, self.device_serial_number)
+
+    def __setstate__(self, state: Tuple[Mapping[str, bool], str, str]) -> None:
+        """Restores the fields when unpickling."""
+        capabilities, name, serial_number = state
+        object.__setattr__(self, "device_capabilities", _shared_capabilities(capabilities))
+        object.__setattr__(self, "device_name", name)
+        object.__setattr__(self, "device_serial_number", serial_number)
+
     @staticmethod
     def from_dict(d: Mapping[str, Any]) -> "OwnedDevice":
         """Constructs an OwnedDevice from a dictionary of attributes, ignoring unknown fields."""
@@ -75,6 +99,43 @@ class OwnedDevice:
         )
 
 
+class _Capabilities(Dict[str, bool]):
+    """A read-only dict of device capabilities, shared by the devices that have them.
+
+    It is a dict so that json and dataclasses.asdict handle it as before; copying returns it
+    unchanged, and unpickling returns the shared instance.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args: Any, **kwargs: Any) -> NoReturn:
+        raise TypeError("Device capabilities are read-only")
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = _read_only
+
+    def __copy__(self) -> "_Capabilities":
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "_Capabilities":
+        return self
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (_shared_capabilities, (dict(self),))
+
+
+_capabilities: Dict[Tuple[Tuple[str, bool], ...], _Capabilities] = {}
+
+
+def _shared_capabilities(capabilities: Mapping[str, bool]) -> Mapping[str, bool]:
+    key = tuple(sorted(capabilities.items()))
+    shared = _capabilities.get(key)
+    if shared is None:
+        shared = _capabilities.setdefault(key, _Capabilities((sys.intern(k), v) for k, v in key))
+    return shared
+
+
 @dataclass(frozen=True)
 class GetOwnedDevicesResponse:
     """Response from get_list_of_owned_devices.
@@ -101,7 +162,7 @@ class GetUploadUrlResponse:
     """Response from get_upload_url.
 
     Attributes:
-        expiry_time: When this URL expires.
+        expiry_time: Milliseconds until this URL expires.
         status_code: 0
         stk_token: Unique identifier for this url.
         upload_url: The upload URL.
@@ -123,6 +184,49 @@ class GetUploadUrlResponse:
         )
 
 
+@dataclass(frozen=True)
+class UploadLease:
+    """An upload URL obtained ahead of time for a file of a given size.
+
+    Attributes:
+        upload: The response from get_upload_url.
+        file_size: The file size the URL was requested for.
+        expires_at: Time on the monotonic clock after which the URL must not be used.
+    """
+
+    upload: GetUploadUrlResponse
+    file_size: int
+    expires_at: float
+
+    @staticmethod
+    def from_response(
+        upload: GetUploadUrlResponse, file_size: int, requested_at: float
+    ) -> "UploadLease":
+        """Constructs an UploadLease, counting its lifetime from when it was requested.
+
+        Args:
+            upload: The response from get_upload_url.
+            file_size: The file size the URL was requested for.
+            requested_at: Time on the monotonic clock at which the request was sent.
+
+        Returns:
+            UploadLease instance.
+        """
+        return UploadLease(upload, file_size, requested_at + upload.expiry_time / 1000)
+
+    def expired(self, margin: float = 0.0, clock: Callable[[], float] = time.monotonic) -> bool:
+        """Returns whether the lease expires within margin seconds.
+
+        Args:
+            margin: Seconds of validity the caller needs.
+            clock: Monotonic clock returning seconds.
+
+        Returns:
+            True if the lease must not be used.
+        """
+        return clock() + margin >= self.expires_at
+
+
 @dataclass(frozen=True)
 class SendToKindleResponse:
     """Response from send_to_kindle.
@@ -0,0 +1,158 @@
+"""Per-phase timing of client operations, for finding out where the time of a command goes.
+
+The client marks its phases (key parsing, signing, each API request and the upload) with
+:func:`phase`. They are only timed while a process-wide :class:`PhaseTimer` is installed with
+:func:`set_phase_timer`; otherwise marking a phase costs a function call.
+"""
+
+import contextlib
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+
+@dataclass
+class PhaseStats:
+    """Time spent in one phase, at one position in the nesting of phases.
+
+    Attributes:
+        path: Names of the enclosing phases, outermost first, ending with this phase's name.
+        calls: Number of times the phase ran.
+        seconds: Total wall-clock time spent in the phase, including nested phases.
+        samples: The duration of each call, if the timer keeps samples.
+    """
+
+    path: Tuple[str, ...]
+    calls: int = 0
+    seconds: float = 0.0
+    samples: List[float] = field(default_factory=list, repr=False)
+
+    @property
+    def name(self) -> str:
+        """The name of the phase."""
+        return self.path[-1]
+
+    @property
+    def depth(self) -> int:
+        """The number of enclosing phases."""
+        return len(self.path) - 1
+
+
+class PhaseTimer:
+    """Accumulates the time spent in named, possibly nested, phases.
+
+    Phases nest per thread, so a timer may be shared by threads running concurrently.
+
+    Example:
+        >>> from stkclient.phases import PhaseTimer
+        >>> ticks = iter([0.0, 0.1, 0.4, 0.5])
+        >>> timer = PhaseTimer(clock=lambda: next(ticks))
+        >>> with timer.phase("send"):
+        ...     with timer.phase("upload"):
+        ...         pass
+        >>> print(timer.report())
+        phase                                calls      total
+        send                                     1   500.0 ms
+          upload                                 1   300.0 ms
+    """
+
+    def __init__(
+        self, clock: Callable[[], float] = time.perf_counter, *, keep_samples: bool = False
+    ) -> None:
+        """Constructs an empty PhaseTimer.
+
+        Args:
+            clock: Clock returning seconds.
+            keep_samples: If true, record the duration of every call, for percentiles.
+        """
+        self._clock = clock
+        self._keep_samples = keep_samples
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats: Dict[Tuple[str, ...], PhaseStats] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Times the enclosed block as a phase nested in the current thread's open phases.
+
+        Args:
+            name: Name of the phase.
+
+        Yields:
+            None.
+        """
+        stack: Optional[List[str]] = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(name)
+        path = tuple(stack)
+        with self._lock:
+            stats = self._stats.get(path)
+            if stats is None:
+                stats = self._stats[path] = PhaseStats(path)
+        start = self._clock()
+        try:
+            yield
+        finally:
+            elapsed = self._clock() - start
+            stack.pop()
+            with self._lock:
+                stats.calls += 1
+                stats.seconds += elapsed
+                if self._keep_samples:
+                    stats.samples.append(elapsed)
+
+    def stats(self) -> List[PhaseStats]:
+        """Returns the phases in the order they were first entered."""
+        with self._lock:
+            return [
+                PhaseStats(s.path, s.calls, s.seconds, list(s.samples))
+                for s in self._stats.values()
+            ]
+
+    def report(self) -> str:
+        """Returns a table of phases, nested phases indented beneath their enclosing phase."""
+        children: Dict[Tuple[str, ...], List[PhaseStats]] = {}
+        for stats in self.stats():
+            children.setdefault(stats.path[:-1], []).append(stats)
+        lines = [f"{'phase':<32}{'calls':>9}{'total':>11}"]
+
+        def add(parent: Tuple[str, ...]) -> None:
+            for s in children.get(parent, []):
+                label = "  " * s.depth + s.name
+                lines.append(f"{label:<32}{s.calls:>9}{s.seconds * 1000:>8.1f} ms")
+                add(s.path)
+
+        add(())
+        return "\n".join(lines)
+
+
+_timer: Optional[PhaseTimer] = None
+_untimed: ContextManager[None] = contextlib.nullcontext()
+
+
+def phase_timer() -> Optional[PhaseTimer]:
+    """Returns the process-wide PhaseTimer, or None if phases are not being timed."""
+    return _timer
+
+
+def set_phase_timer(timer: Optional[PhaseTimer]) -> None:
+    """Installs the process-wide PhaseTimer, or stops timing phases if timer is None."""
+    global _timer
+    _timer = timer
+
+
+def phase(name: str) -> ContextManager[None]:
+    """Times the enclosed block with the process-wide PhaseTimer, if one is installed.
+
+    Args:
+        name: Name of the phase.
+
+    Returns:
+        A context manager.
+    """
+    timer = _timer
+    if timer is None:
+        return _untimed
+    return timer.phase(name)
@@ -0,0 +1,107 @@
+"""Upload progress reporting."""
+
+import time
+from dataclasses import dataclass
+from typing import IO, Callable, Optional
+
+from stkclient.readers import ReaderWrapper
+
+DEFAULT_PROGRESS_BYTES = 256 * 1024
+
+
+@dataclass(frozen=True)
+class Progress:
+    """A snapshot of an upload's progress.
+
+    Attributes:
+        bytes_sent: Bytes handed to the connection so far.
+        total: Total bytes to upload.
+        rate: Throughput since the previous report, in bytes per second.
+        average_rate: Throughput since the upload started, in bytes per second.
+        eta: Estimated seconds until the upload completes, or None if unknown.
+    """
+
+    bytes_sent: int
+    total: int
+    rate: float
+    average_rate: float
+    eta: Optional[float]
+
+    @property
+    def fraction(self) -> float:
+        """Fraction of the upload completed, between 0 and 1."""
+        return min(1.0, self.bytes_sent / self.total) if self.total else 1.0
+
+
+ProgressCallback = Callable[[Progress], None]
+
+
+class ProgressReader(ReaderWrapper):
+    """Wraps a readable binary file, reporting progress as it is read.
+
+    The callback runs on the reading thread every time at least ``every`` bytes have been read
+    since the last report, and once more when the last byte has been read. Between reports a
+    read costs only a counter update.
+    """
+
+    def __init__(
+        self,
+        fp: IO[bytes],
+        total: int,
+        callback: ProgressCallback,
+        every: int = DEFAULT_PROGRESS_BYTES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Constructs a ProgressReader.
+
+        Args:
+            fp: The file to read from.
+            total: Number of bytes expected to be read.
+            callback: Called with a Progress snapshot at each report.
+            every: Minimum number of bytes between reports.
+            clock: Monotonic clock returning seconds.
+        """
+        super().__init__(fp)
+        self._total = total
+        self._callback = callback
+        self._every = every
+        self._clock = clock
+        self._start = clock()
+        self._sent = 0
+        self._last_sent = 0
+        self._last_time = self._start
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        """Seeks the wrapped file, restarting progress from the new position.
+
+        Args:
+            offset: Position relative to whence.
+            whence: One of the io.SEEK_* constants.
+
+        Returns:
+            The new position.
+        """
+        before = self._fp.tell()
+        pos = self._fp.seek(offset, whence)
+        self._sent = max(0, self._sent + pos - before)
+        self._last_sent = self._sent
+        return pos
+
+    def _after_read(self, data: bytes) -> None:
+        self._sent += len(data)
+        if self._sent - self._last_sent >= self._every or (
+            self._sent >= self._total and self._sent > self._last_sent
+        ):
+            self._report()
+
+    def _report(self) -> None:
+        now = self._clock()
+        elapsed = now - self._start
+        interval = now - self._last_time
+        rate = (self._sent - self._last_sent) / interval if interval > 0 else 0.0
+        average = self._sent / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self._total - self._sent)
+        eta = remaining / average if average > 0 else (0.0 if remaining == 0 else None)
+        self._last_sent = self._sent
+        self._last_time = now
+        self._callback(Progress(self._sent, self._total, rate, average, eta))
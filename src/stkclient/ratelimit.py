@@ -0,0 +1,359 @@
+"""Adaptive client-side rate limiting for the amazon auth and stk APIs."""
+
+import asyncio
+import datetime
+import email.utils
+import random
+import threading
+import time
+from typing import IO, Callable, Dict, Optional
+
+from stkclient.readers import ReaderWrapper
+
+THROTTLE_STATUSES = frozenset({429, 503})
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose refill rate can be adjusted at runtime.
+
+    Tokens are reserved rather than waited for, so that the same bucket can be shared by threaded
+    callers (which sleep) and async callers (which await) without holding a lock while waiting.
+    """
+
+    def __init__(
+        self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        """Constructs a TokenBucket.
+
+        Args:
+            rate: Tokens added per second.
+            burst: Maximum number of tokens the bucket can hold.
+            clock: Monotonic clock returning seconds.
+
+        Raises:
+            ValueError: rate or burst is not positive.
+        """
+        if rate <= 0 or burst <= 0:
+            raise ValueError("rate and burst must be positive")
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        """Current refill rate in tokens per second."""
+        return self._rate
+
+    def set_rate(self, rate: float) -> None:
+        """Changes the refill rate, keeping tokens accrued at the old rate."""
+        with self._lock:
+            self._refill()
+            self._rate = rate
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Takes tokens from the bucket, going into debt if necessary.
+
+        Args:
+            tokens: Number of tokens to take.
+
+        Returns:
+            Seconds the caller must wait before proceeding (0 if tokens were available).
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class RateLimiter:
+    """Shared per-endpoint rate limiter with AIMD rate adjustment and throttling backoff.
+
+    Each key (typically host and path of an endpoint) gets its own token bucket. The rate of a
+    bucket increases additively after every successful request and decreases multiplicatively
+    whenever the server throttles, converging on the highest rate the service sustains. A
+    Retry-After value blocks the key until it has elapsed.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: float = 10.0,
+        *,
+        min_rate: float = 0.1,
+        max_rate: float = 100.0,
+        increase: float = 0.1,
+        decrease: float = 0.5,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Callable[[], float] = random.random,
+    ) -> None:
+        """Constructs a RateLimiter.
+
+        Args:
+            rate: Initial requests per second for each key.
+            burst: Number of requests each key may issue back-to-back.
+            min_rate: Lower bound for the adjusted rate.
+            max_rate: Upper bound for the adjusted rate.
+            increase: Requests per second added after each successful request.
+            decrease: Factor applied to the rate when a request is throttled.
+            max_retries: How many times a throttled request is retried.
+            backoff_base: Base delay in seconds of the exponential backoff.
+            backoff_cap: Maximum delay in seconds of the exponential backoff.
+            clock: Monotonic clock returning seconds.
+            sleep: Function used by threaded callers to wait.
+            rng: Source of uniformly distributed random numbers in [0, 1) used for jitter.
+        """
+        self.max_retries = max_retries
+        self._rate = rate
+        self._burst = burst
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase = increase
+        self._decrease = decrease
+        self._backoff_base = backoff_base
+        self._backoff_cap = backoff_cap
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def rate(self, key: str) -> float:
+        """Returns the current rate for key in requests per second."""
+        return self._bucket(key).rate
+
+    def reserve(self, key: str) -> float:
+        """Reserves a request slot for key without waiting.
+
+        Args:
+            key: The key to reserve a slot for.
+
+        Returns:
+            Seconds the caller must wait before sending the request.
+        """
+        wait = self._bucket(key).reserve()
+        with self._lock:
+            blocked = self._blocked_until.get(key, 0.0) - self._clock()
+        return max(wait, blocked, 0.0)
+
+    def acquire(self, key: str) -> None:
+        """Blocks the calling thread until a request for key may be sent."""
+        wait = self.reserve(key)
+        if wait > 0:
+            self._sleep(wait)
+
+    async def acquire_async(self, key: str) -> None:
+        """Waits without blocking the event loop until a request for key may be sent."""
+        wait = self.reserve(key)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self, key: str) -> None:
+        """Records a successful request, additively increasing the rate for key."""
+        bucket = self._bucket(key)
+        bucket.set_rate(min(self._max_rate, bucket.rate + self._increase))
+
+    def on_throttle(self, key: str, retry_after: Optional[float] = None) -> None:
+        """Records a throttled request, multiplicatively decreasing the rate for key.
+
+        Args:
+            key: The throttled key.
+            retry_after: Seconds the server asked the client to wait, if any.
+        """
+        bucket = self._bucket(key)
+        bucket.set_rate(max(self._min_rate, bucket.rate * self._decrease))
+        if retry_after is not None:
+            with self._lock:
+                until = self._clock() + retry_after
+                self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), until)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Computes the delay before retrying a throttled request.
+
+        Uses exponential backoff with full jitter, but never less than the server's Retry-After.
+
+        Args:
+            attempt: Zero-based index of the retry.
+            retry_after: Seconds the server asked the client to wait, if any.
+
+        Returns:
+            Delay in seconds.
+        """
+        delay = self._rng() * min(self._backoff_cap, self._backoff_base * 2.0**attempt)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def sleep(self, seconds: float) -> None:
+        """Waits using the limiter's sleep function."""
+        if seconds > 0:
+            self._sleep(seconds)
+
+    def _bucket(self, key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self._rate, self._burst, self._clock)
+                self._buckets[key] = bucket
+            return bucket
+
+
+class BandwidthLimiter:
+    """Caps the combined throughput of all uploads sharing it.
+
+    Uploads draw one token per byte from a single token bucket as they read their source. Each
+    read reserves the next free slot in time, so concurrent uploads are served in turn, chunk by
+    chunk, and share the cap fairly. The cap can be changed, or removed, while uploads are in
+    flight.
+    """
+
+    def __init__(
+        self,
+        bytes_per_second: Optional[float] = None,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Constructs a BandwidthLimiter.
+
+        Args:
+            bytes_per_second: The cap, or None for unlimited.
+            clock: Monotonic clock returning seconds.
+            sleep: Function used by threaded callers to wait.
+        """
+        self._clock = clock
+        self._sleep = sleep
+        self._bucket: Optional[TokenBucket] = None
+        self.set_rate(bytes_per_second)
+
+    @property
+    def rate(self) -> Optional[float]:
+        """The cap in bytes per second, or None if unlimited."""
+        bucket = self._bucket
+        return None if bucket is None else bucket.rate
+
+    def set_rate(self, bytes_per_second: Optional[float]) -> None:
+        """Changes the cap.
+
+        Args:
+            bytes_per_second: The new cap, or None to remove it.
+
+        Raises:
+            ValueError: bytes_per_second is not positive.
+        """
+        if bytes_per_second is None:
+            self._bucket = None
+            return
+        if bytes_per_second <= 0:
+            raise ValueError("bytes_per_second must be positive")
+        # Allow bursts of 100ms worth of data, so that reads of a typical size don't stall
+        burst = max(16 * 1024, bytes_per_second / 10)
+        self._bucket = TokenBucket(bytes_per_second, burst, self._clock)
+
+    def consume(self, n: int) -> None:
+        """Blocks the calling thread until n more bytes may be sent."""
+        bucket = self._bucket
+        if bucket is not None and n > 0:
+            wait = bucket.reserve(n)
+            if wait > 0:
+                self._sleep(wait)
+
+    async def consume_async(self, n: int) -> None:
+        """Waits without blocking the event loop until n more bytes may be sent."""
+        bucket = self._bucket
+        if bucket is not None and n > 0:
+            wait = bucket.reserve(n)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+
+class ThrottledReader(ReaderWrapper):
+    """Wraps a readable binary file so that reading it draws from a BandwidthLimiter."""
+
+    def __init__(self, fp: IO[bytes], limiter: BandwidthLimiter) -> None:
+        """Constructs a ThrottledReader.
+
+        Args:
+            fp: The file to read from.
+            limiter: The limiter to draw from.
+        """
+        super().__init__(fp)
+        self._limiter = limiter
+
+    def _after_read(self, data: bytes) -> None:
+        self._limiter.consume(len(data))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses the value of a Retry-After header into seconds.
+
+    Example:
+        >>> from stkclient.ratelimit import parse_retry_after
+        >>> parse_retry_after("3")
+        3.0
+        >>> parse_retry_after("Thu, 01 Jan 1970 00:00:00 GMT")
+        0.0
+        >>> parse_retry_after("soon") is None
+        True
+
+    Args:
+        value: The header value, either delta-seconds or an HTTP-date.
+
+    Returns:
+        Non-negative number of seconds, or None if the value is absent or malformed.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    delta = when - datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, delta.total_seconds())
+
+
+_default_limiter = RateLimiter()
+
+
+def default_limiter() -> RateLimiter:
+    """Returns the process-wide RateLimiter used by stkclient.api."""
+    return _default_limiter
+
+
+def set_default_limiter(limiter: RateLimiter) -> None:
+    """Replaces the process-wide RateLimiter used by stkclient.api."""
+    global _default_limiter
+    _default_limiter = limiter
+
+
+_default_bandwidth_limiter = BandwidthLimiter()
+
+
+def default_bandwidth_limiter() -> BandwidthLimiter:
+    """Returns the process-wide BandwidthLimiter shared by all uploads (unlimited by default)."""
+    return _default_bandwidth_limiter
+
+
+def set_default_bandwidth_limiter(limiter: BandwidthLimiter) -> None:
+    """Replaces the process-wide BandwidthLimiter shared by all uploads."""
+    global _default_bandwidth_limiter
+    _default_bandwidth_limiter = limiter
@@ -0,0 +1,48 @@
+"""Wrappers around the files that upload bodies are read from."""
+
+from typing import IO, Any, Optional
+
+
+class ReaderWrapper:
+    """Wraps a readable binary file, delegating what it doesn't override to the file.
+
+    Subclasses hook into reads through :meth:`_before_read` and :meth:`_after_read` rather
+    than overriding read. Transports close the connection when reading a request body raises,
+    so a wrapper whose hook raises stops an upload within one chunk.
+
+    Example:
+        >>> import io
+        >>> from stkclient.readers import ReaderWrapper
+        >>> class Counting(ReaderWrapper):
+        ...     count = 0
+        ...     def _after_read(self, data):
+        ...         self.count += len(data)
+        >>> r = Counting(io.BytesIO(b"abcdef"))
+        >>> r.read(4), r.read(), r.count, r.tell()
+        (b'abcd', b'ef', 6, 6)
+    """
+
+    def __init__(self, fp: IO[bytes]) -> None:
+        """Constructs a ReaderWrapper.
+
+        Args:
+            fp: The file to read from.
+        """
+        self._fp = fp
+
+    def read(self, amt: Optional[int] = -1) -> bytes:
+        """Reads from the wrapped file, running the hooks around the read."""
+        self._before_read()
+        data = self._fp.read(-1 if amt is None else amt)
+        self._after_read(data)
+        return data
+
+    def __getattr__(self, name: str) -> Any:
+        """Delegates other attributes to the wrapped file."""
+        return getattr(self._fp, name)
+
+    def _before_read(self) -> None:
+        """Runs before each read, and raises to fail it."""
+
+    def _after_read(self, data: bytes) -> None:
+        """Runs after each read with the data read."""
@@ -0,0 +1,253 @@
+"""Streaming documents from an HTTP source into an upload without writing them to disk.
+
+:func:`open_source` starts downloading a document and returns a :class:`Source`, a readable
+stream of known size that can be passed straight to :func:`stkclient.api.upload_file`. When
+the source sends a Content-Length, its body is relayed through a bounded buffer filled by a
+background thread, so the upload starts with the first bytes, the download keeps going while
+the upload waits on the network, and memory use stays constant. Without a Content-Length the
+size isn't known up front, so the body is spooled first, in memory up to a limit and on disk
+beyond it.
+"""
+
+import contextlib
+import http.client
+import queue
+import tempfile
+import threading
+from typing import IO, Mapping, Optional, Union, cast
+
+from stkclient.timeouts import DEFAULT_TIMEOUT, Timeout
+from stkclient.transport import DEFAULT_TRANSPORT, Response, Transport
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_BUFFER_CHUNKS = 16
+DEFAULT_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+class SourceError(ValueError):
+    """Raised when the source of a document fails or returns an error status.
+
+    Attributes:
+        status: The HTTP status code of the source's response, if it returned one.
+    """
+
+    def __init__(self, msg: str, status: Optional[int] = None) -> None:
+        """Constructs a SourceError with a message and the source's HTTP status, if any."""
+        super().__init__(msg, status)  # Both in args, so that it pickles and copies whole
+        self.status = status
+
+    def __str__(self) -> str:
+        """Returns the message."""
+        return str(self.args[0])
+
+
+class Relay:
+    """Relays a body of known size from a response, read ahead on a background thread.
+
+    At most ``buffer_chunks`` chunks of ``chunk_size`` bytes are held at once. Reading raises
+    SourceError, ending the upload, if the source fails or ends before ``size`` bytes.
+    """
+
+    def __init__(
+        self,
+        source: Response,
+        size: int,
+        *,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        buffer_chunks: int = DEFAULT_BUFFER_CHUNKS,
+    ) -> None:
+        """Constructs a Relay and starts reading from source.
+
+        Args:
+            source: The response to relay the body of. It is closed with the relay.
+            size: The number of bytes to relay.
+            chunk_size: Bytes read from source at a time.
+            buffer_chunks: Maximum number of chunks read ahead.
+        """
+        self._source = source
+        self._size = size
+        self._chunk_size = chunk_size
+        self._chunks: "queue.Queue[Union[bytes, SourceError]]" = queue.Queue(buffer_chunks)
+        self._pending = b""
+        self._eof = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._fill, name="stkclient-relay", daemon=True)
+        self._thread.start()
+
+    def peek(self, n: int) -> bytes:
+        """Returns up to the first n unread bytes without consuming them, waiting for them."""
+        while len(self._pending) < n and not self._eof:
+            chunk = self._next()
+            self._pending += chunk
+        return self._pending[:n]
+
+    def read(self, amt: Optional[int] = -1) -> bytes:
+        """Reads up to amt bytes, or the rest of the body if amt is None or negative.
+
+        Args:
+            amt: Maximum number of bytes to read.
+
+        Returns:
+            The bytes read, or b"" once the whole body has been read.
+        """
+        if amt is None or amt < 0:
+            parts = [self._pending]
+            self._pending = b""
+            while not self._eof:
+                parts.append(self._next())
+            return b"".join(parts)
+        if not self._pending and not self._eof:
+            self._pending = self._next()
+        data, self._pending = self._pending[:amt], self._pending[amt:]
+        return data
+
+    def seekable(self) -> bool:
+        """Returns False: the body can only be read once."""
+        return False
+
+    def close(self) -> None:
+        """Stops reading and closes the source."""
+        self._stopped.set()
+        while self._thread.is_alive():
+            try:
+                self._chunks.get_nowait()  # Unblock the reading thread
+            except queue.Empty:
+                pass
+            self._thread.join(0.01)
+        self._source.close()
+
+    def _next(self) -> bytes:
+        item = self._chunks.get()
+        if isinstance(item, SourceError):
+            self._eof = True
+            raise item
+        if not item:
+            self._eof = True
+        return item
+
+    def _fill(self) -> None:
+        remaining = self._size
+        while remaining > 0 and not self._stopped.is_set():
+            try:
+                chunk = self._source.read(min(self._chunk_size, remaining))
+            except Exception as e:  # Any failure must reach the reader, or it waits forever
+                self._put(SourceError(f"Reading the source failed: {e}"))
+                return
+            if not chunk:
+                received = self._size - remaining
+                self._put(SourceError(f"Source ended after {received} of {self._size} bytes"))
+                return
+            remaining -= len(chunk)
+            self._put(chunk)
+        self._put(b"")
+
+    def _put(self, item: Union[bytes, SourceError]) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+class Source:
+    """A document being read from an HTTP source.
+
+    Attributes:
+        body: Readable stream of the document.
+        size: Size of the document in bytes.
+        content_type: The Content-Type of the source's response, if it sent one.
+        spooled: Whether the body was spooled because its size wasn't known up front.
+    """
+
+    def __init__(
+        self, body: Union[Relay, IO[bytes]], size: int, content_type: Optional[str]
+    ) -> None:
+        """Constructs a Source; use open_source instead.
+
+        Args:
+            body: The relay or spooled file to read the document from.
+            size: Size of the document in bytes.
+            content_type: The Content-Type of the source's response.
+        """
+        self._relay = body if isinstance(body, Relay) else None
+        self.body = cast(IO[bytes], body)
+        self.size = size
+        self.content_type = content_type
+        self.spooled = self._relay is None
+
+    def peek(self, n: int) -> bytes:
+        """Returns up to the first n bytes of the document without consuming them."""
+        if self._relay is not None:
+            return self._relay.peek(n)
+        offset = self.body.tell()
+        data = self.body.read(n)
+        self.body.seek(offset)
+        return data
+
+    def close(self) -> None:
+        """Stops reading the source and releases the body."""
+        self.body.close()
+
+    def __enter__(self) -> "Source":
+        """Returns self."""
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        """Closes the source."""
+        self.close()
+
+
+def open_source(
+    url: str,
+    *,
+    transport: Optional[Transport] = None,
+    headers: Optional[Mapping[str, str]] = None,
+    timeout: Timeout = DEFAULT_TIMEOUT,
+    spool_size: int = DEFAULT_SPOOL_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    buffer_chunks: int = DEFAULT_BUFFER_CHUNKS,
+) -> Source:
+    """Starts reading a document from url with a GET request.
+
+    Args:
+        url: The document's URL.
+        transport: Transport used for the request, or None for the default.
+        headers: Additional request headers, such as Authorization.
+        timeout: Connect timeout, and timeout for each socket read from the source.
+        spool_size: Bytes held in memory when spooling a body of unknown size, beyond which it is
+            spooled to a temporary file.
+        chunk_size: Bytes read from the source at a time when relaying.
+        buffer_chunks: Maximum number of chunks read ahead when relaying.
+
+    Returns:
+        The Source, which the caller must close.
+
+    Raises:
+        SourceError: The source returned an error status or failed while being spooled.
+    """
+    if transport is None:
+        transport = DEFAULT_TRANSPORT
+    # Ask for the body as stored, so that Content-Length is the size of the document
+    request_headers = {"Accept-Encoding": "identity", **(headers or {})}
+    r = transport.request("GET", url, headers=request_headers, timeout=timeout)
+    with contextlib.ExitStack() as stack:
+        stack.callback(r.close)
+        if not 200 <= r.status < 300:
+            raise SourceError(f"Source returned HTTP Error {r.status}: {r.reason}", r.status)
+        content_type = r.getheader("Content-Type")
+        length = r.getheader("Content-Length")
+        if length is not None and length.isdigit():
+            body = Relay(r, int(length), chunk_size=chunk_size, buffer_chunks=buffer_chunks)
+            stack.pop_all()  # The relay closes the response
+            return Source(body, int(length), content_type)
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        try:
+            for chunk in iter(lambda: r.read(chunk_size), b""):
+                spool.write(chunk)
+        except (OSError, http.client.HTTPException) as e:
+            spool.close()
+            raise SourceError(f"Reading the source failed: {e}") from e
+        size = spool.tell()
+        spool.seek(0)
+        return Source(spool, size, content_type)
@@ -1,13 +1,15 @@
 """Implements RSA request signing for amazon APIs."""
 
 import base64
-import datetime
+import concurrent.futures
+import functools
 import hashlib
+import time
 from dataclasses import dataclass
-from typing import Optional, cast
+from typing import Iterable, List, Optional, Tuple, cast
 
 import rsa
-from rsa import core, transform
+from rsa import transform
 
 from .model import DeviceInfo
 
@@ -16,6 +18,9 @@ from .model import DeviceInfo
 class Signer:
     """Implements RSA request signing for amazon APIs.
 
+    A Signer is never modified after construction, so one instance may sign requests from many
+    threads at once.
+
     Attributes:
         device_private_key: The private key used to generate the X-ADP-Request-Digest header.
         adp_token: The value to be included in the X-ADP-Authentication-Token header.
@@ -50,17 +55,56 @@ class Signer:
         if signing_date is None:
             signing_date = _get_signing_date()
         sig_data = self._make_digest_data_for_request(method, path, post_data, signing_date)
-        digest = _sha256(sig_data)
-        pad = bytes.fromhex(
-            "01ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff00"
-        )
-        padded = pad + digest
-        payload = transform.bytes2int(padded)
-        encrypted = core.encrypt_int(payload, self.device_private_key.d, self.device_private_key.n)
-        encrypted_bytes = transform.int2bytes(encrypted, 256)
+        payload = transform.bytes2int(_PADDING + _sha256(sig_data))
+        encrypted_bytes = transform.int2bytes(self._sign_int(payload), 256)
         bytes64 = base64.b64encode(encrypted_bytes).decode("utf-8")
         return f"{bytes64}:{signing_date}"
 
+    def sign_many(
+        self,
+        requests: Iterable[Tuple[str, str, str]],
+        *,
+        signing_date: Optional[str] = None,
+        executor: Optional[concurrent.futures.Executor] = None,
+        chunksize: int = 16,
+    ) -> List[str]:
+        """Computes request digests for many requests at once.
+
+        The signing date is computed at most once per second, however many requests are signed.
+        Signing is CPU-bound and holds the GIL, so only a ProcessPoolExecutor signs in parallel.
+
+        Args:
+            requests: (method, path, post_data) tuples, as for digest_header_for_request.
+            signing_date: The date included in every signature. If null, the current date is used.
+            executor: Optional executor across which chunks of requests are signed.
+            chunksize: Number of requests in each chunk submitted to the executor.
+
+        Returns:
+            The request digests, in the order of requests.
+        """
+        sign = functools.partial(self._sign_chunk, signing_date=signing_date)
+        if executor is None:
+            return sign(list(requests))
+        reqs = list(requests)
+        chunks = [reqs[i : i + chunksize] for i in range(0, len(reqs), chunksize)]
+        return [digest for digests in executor.map(sign, chunks) for digest in digests]
+
+    def _sign_chunk(
+        self, requests: List[Tuple[str, str, str]], signing_date: Optional[str]
+    ) -> List[str]:
+        return [
+            self.digest_header_for_request(method, path, post_data, signing_date)
+            for method, path, post_data in requests
+        ]
+
+    def _sign_int(self, m: int) -> int:
+        # RSA with the Chinese remainder theorem, about 3x faster than a single pow modulo n
+        k = self.device_private_key
+        m1 = pow(m, k.exp1, k.p)
+        m2 = pow(m, k.exp2, k.q)
+        h = (k.coef * (m1 - m2)) % k.p
+        return m2 + h * k.q
+
     def _make_digest_data_for_request(
         self, method: str, path: str, post_data: str, signing_date: Optional[str] = None
     ) -> bytes:
@@ -70,14 +114,21 @@ class Signer:
         return sig_data.encode("utf-8")
 
 
+_PADDING = bytes.fromhex(
+    "01ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff00"
+)
+
+_signing_date: Tuple[int, str] = (0, "")
+
+
 # 2021-10-09T05:02:38Z
 def _get_signing_date() -> str:
-    return (
-        datetime.datetime.utcnow()
-        .replace(microsecond=0, tzinfo=datetime.timezone.utc)
-        .isoformat()
-        .replace("+00:00", "Z")
-    )
+    global _signing_date
+    now = int(time.time())
+    cached = _signing_date
+    if cached[0] != now:
+        cached = _signing_date = (now, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)))
+    return cached[1]
 
 
 def _sha256(s: bytes) -> bytes:
@@ -0,0 +1,284 @@
+"""A local stand-in for the send-to-kindle service, for offline benchmarks and tests.
+
+The stand-in implements GetListOfOwnedDevices, GetUploadUrl, the upload PUT and SendToKindle
+over plain HTTP on localhost. Requests reach it through a :class:`RedirectTransport`, which
+sends every request to the stand-in whatever host its URL names, so clients are used unchanged:
+
+    >>> from stkclient.standin import StandInServer
+    >>> with StandInServer() as server:
+    ...     transport = server.transport()
+    ...     # Client(device_info, transport).send_file(...)
+"""
+
+import collections
+import http.server
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+from types import TracebackType
+from typing import (
+    Any,
+    Counter,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+)
+
+from stkclient.timeouts import DEFAULT_TIMEOUT, Timeout
+from stkclient.transport import Body, PooledTransport, Response, Transport
+
+UPLOAD_HOST = "upload.standin.invalid"
+
+DEFAULT_DEVICES: List[Mapping[str, Any]] = [
+    {
+        "deviceCapabilities": {
+            "PDF_CONTENT_ENABLED": True,
+            "WAN_ENABLED": False,
+            "WIFI_CAPABLE": True,
+        },
+        "deviceName": "Stand-in Kindle",
+        "deviceSerialNumber": "STANDIN0000000001",
+    },
+]
+
+
+class StandInServer:
+    """A threaded local HTTP server imitating the send-to-kindle endpoints.
+
+    Attributes:
+        requests: Number of requests received per path (upload paths are counted as /upload).
+        bytes_uploaded: Total bytes received by the upload endpoint.
+    """
+
+    def __init__(
+        self,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        devices: Optional[List[Mapping[str, Any]]] = None,
+    ) -> None:
+        """Constructs a StandInServer, which listens once started.
+
+        Args:
+            host: Address to listen on.
+            port: Port to listen on, or 0 to pick a free one.
+            latency: Seconds each response is delayed by, imitating network and service time.
+            devices: Devices returned by GetListOfOwnedDevices, as in the service's JSON.
+        """
+        self.latency = latency
+        self.devices = devices if devices is not None else DEFAULT_DEVICES
+        self.requests: Counter[str] = collections.Counter()
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+        self._tokens = itertools.count(1)
+        self._uploaded: Dict[str, int] = {}
+        self._server = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self  # type: ignore[attr-defined]
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server."""
+        host, port = self._server.socket.getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandInServer":
+        """Starts serving on a background thread.
+
+        Returns:
+            self.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self) -> None:
+        """Stops the server and closes its socket."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def transport(self, inner: Optional[Transport] = None) -> "RedirectTransport":
+        """Returns a transport sending all requests to this server.
+
+        Args:
+            inner: Transport used to reach the server, or None for a new PooledTransport.
+
+        Returns:
+            RedirectTransport instance.
+        """
+        return RedirectTransport(self.url, inner if inner is not None else PooledTransport())
+
+    def __enter__(self) -> "StandInServer":
+        """Starts the server."""
+        return self.start()
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        """Stops the server."""
+        self.close()
+
+    def _reply(self, method: str, path: str, body: bytes) -> "_Reply":
+        status, payload = self._handle(method, path, body)
+        data = json.dumps(payload).encode() if payload is not None else b""
+        return _Reply(status, {"Content-Type": "application/json"}, data, self.latency)
+
+    def _handle(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        if method == "PUT" and path.startswith("/upload/"):
+            token = path[len("/upload/") :]
+            with self._lock:
+                self.requests["/upload"] += 1
+                self.bytes_uploaded += len(body)
+                self._uploaded[token] = len(body)
+            return 200, None
+        with self._lock:
+            self.requests[path] += 1
+        if method != "POST":
+            return 405, {"message": "Method not allowed"}
+        if path == "/GetListOfOwnedDevices":
+            return 200, {"ownedDevices": list(self.devices), "statusCode": 0}
+        if path == "/GetUploadUrl":
+            token = f"standin{next(self._tokens):08d}"
+            return 200, {
+                "expiryTime": 3600000,
+                "statusCode": 0,
+                "stkToken": token,
+                "uploadUrl": f"https://{UPLOAD_HOST}/upload/{token}",
+            }
+        if path == "/SendToKindle":
+            token = json.loads(body).get("stkToken")
+            with self._lock:
+                uploaded = token in self._uploaded
+            if not uploaded:
+                return 400, {"message": "Unknown stkToken"}
+            return 200, {"sku": f"sku-{token}", "statusCode": 0}
+        return 404, {"message": "Not found"}
+
+
+class RedirectTransport(Transport):
+    """Sends every request to a fixed base URL, keeping the original path and query."""
+
+    def __init__(self, base_url: str, inner: Transport) -> None:
+        """Constructs a RedirectTransport.
+
+        Args:
+            base_url: Scheme, host and port to send requests to, such as http://127.0.0.1:8080.
+            inner: Transport that sends the rewritten requests.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.inner = inner
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Mapping[str, str],
+        body: Body = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+    ) -> Response:
+        """Sends the request to the base URL.
+
+        Args:
+            method: The HTTP method.
+            url: The absolute URL to request; only its path and query are kept.
+            headers: Request headers.
+            body: Request body.
+            timeout: Connect and read timeouts for the request.
+
+        Returns:
+            The Response, which the caller must close.
+        """
+        return self.inner.request(
+            method, self.rewrite(url), headers=headers, body=body, timeout=timeout
+        )
+
+    def rewrite(self, url: str) -> str:
+        """Returns url with its scheme, host and port replaced by the base URL's.
+
+        Example:
+            >>> from stkclient.standin import RedirectTransport
+            >>> from stkclient.transport import DEFAULT_TRANSPORT
+            >>> t = RedirectTransport("http://127.0.0.1:8080", DEFAULT_TRANSPORT)
+            >>> t.rewrite("https://stkservice.amazon.com/SendToKindle?x=1")
+            'http://127.0.0.1:8080/SendToKindle?x=1'
+        """
+        u = urllib.parse.urlsplit(url)
+        return self.base_url + urllib.parse.urlunsplit(("", "", u.path or "/", u.query, ""))
+
+    def warm_up(self, urls: Iterable[str], *, background: bool = False) -> None:
+        """Warms up connections to the base URL.
+
+        Args:
+            urls: URLs whose hosts will be requested soon.
+            background: If true, return immediately and warm up on a background thread.
+        """
+        self.inner.warm_up([self.rewrite(url) for url in urls], background=background)
+
+    def close(self) -> None:
+        """Closes the inner transport."""
+        self.inner.close()
+
+
+class _Reply(NamedTuple):
+    status: int
+    headers: Mapping[str, str]
+    data: Optional[bytes]  # None to close the connection without responding
+    delay: float  # Seconds before the status line and headers
+    body_delay: float = 0.0  # Seconds between the headers and the body
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, delayed ACKs add ~40ms per response
+    disable_nagle_algorithm = True
+
+    def do_POST(self) -> None:  # noqa: N802
+        self._respond("POST")
+
+    def do_PUT(self) -> None:  # noqa: N802
+        self._respond("PUT")
+
+    def do_GET(self) -> None:  # noqa: N802
+        self._respond("GET")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _respond(self, method: str) -> None:
+        standin: StandInServer = self.server.standin  # type: ignore[attr-defined]
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if len(body) < length:
+            self.close_connection = True  # The client gave up part way through the body
+            return
+        reply = standin._reply(method, urllib.parse.urlsplit(self.path).path, body)
+        if reply.delay:
+            time.sleep(reply.delay)
+        if reply.data is None:
+            self.close_connection = True
+            return
+        self.send_response(reply.status)
+        for name, value in reply.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(reply.data)))
+        self.end_headers()
+        if reply.body_delay:
+            time.sleep(reply.body_delay)
+        self.wfile.write(reply.data)
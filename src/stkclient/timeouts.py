@@ -0,0 +1,195 @@
+"""Timeouts, deadlines and hedged requests for the amazon auth and stk APIs."""
+
+import collections
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import IO, Any, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from stkclient.readers import ReaderWrapper
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when an operation does not complete before its deadline."""
+
+
+@dataclass(frozen=True)
+class Timeout:
+    """Per-phase socket timeouts for a single HTTP request.
+
+    Attributes:
+        connect: Seconds to wait for the TCP connection and TLS handshake, or None to wait forever.
+        read: Seconds to wait for each socket read or write once connected, or None to wait forever.
+    """
+
+    connect: Optional[float] = 10.0
+    read: Optional[float] = 60.0
+
+    def clip(self, deadline: Optional["Deadline"]) -> "Timeout":
+        """Returns a Timeout whose phases do not extend past deadline.
+
+        Args:
+            deadline: The deadline to respect, or None.
+
+        Returns:
+            Timeout instance.
+        """
+        if deadline is None:
+            return self
+        remaining = deadline.remaining()
+        return Timeout(
+            connect=remaining if self.connect is None else min(self.connect, remaining),
+            read=remaining if self.read is None else min(self.read, remaining),
+        )
+
+
+DEFAULT_TIMEOUT = Timeout()
+
+
+class Deadline:
+    """A point in time by which an operation spanning several requests must complete."""
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic) -> None:
+        """Constructs a Deadline that expires the given number of seconds from now.
+
+        Args:
+            seconds: Time budget for the operation.
+            clock: Monotonic clock returning seconds.
+        """
+        self._clock = clock
+        self._expires = clock() + seconds
+
+    def remaining(self) -> float:
+        """Returns the seconds left before the deadline.
+
+        Returns:
+            Remaining seconds, always positive.
+
+        Raises:
+            DeadlineExceeded: The deadline has passed.
+        """
+        remaining = self._expires - self._clock()
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline exceeded")
+        return remaining
+
+    def check(self) -> None:
+        """Raises DeadlineExceeded if the deadline has passed."""
+        self.remaining()
+
+
+class DeadlineReader(ReaderWrapper):
+    """Wraps a readable binary file so that reading it fails once a Deadline has passed."""
+
+    def __init__(self, fp: IO[bytes], deadline: Deadline) -> None:
+        """Constructs a DeadlineReader.
+
+        Args:
+            fp: The file to read from.
+            deadline: The deadline to check before each read.
+        """
+        super().__init__(fp)
+        self._deadline = deadline
+
+    def _before_read(self) -> None:
+        self._deadline.check()
+
+
+class LatencyTracker:
+    """Keeps a sliding window of observed latencies for computing percentiles."""
+
+    def __init__(self, size: int = 100) -> None:
+        """Constructs a LatencyTracker remembering the last size samples."""
+        self._samples: Deque[float] = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Returns the number of samples in the window."""
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        """Adds a latency sample."""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Returns the p-th percentile of the window (nearest rank), or None if empty."""
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))
+        return ordered[rank]
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def latency_tracker(key: str) -> LatencyTracker:
+    """Returns the process-wide LatencyTracker for an endpoint key."""
+    with _trackers_lock:
+        tracker = _trackers.get(key)
+        if tracker is None:
+            tracker = _trackers[key] = LatencyTracker()
+        return tracker
+
+
+def hedge_delay(tracker: LatencyTracker, default: float = 1.0, min_samples: int = 20) -> float:
+    """Chooses how long to wait before hedging a request, based on its p95 latency.
+
+    Args:
+        tracker: Latencies observed for the endpoint.
+        default: Delay used until enough samples have been observed.
+        min_samples: Number of samples needed before the p95 is trusted.
+
+    Returns:
+        Delay in seconds.
+    """
+    p95 = tracker.percentile(95)
+    if p95 is None or len(tracker) < min_samples:
+        return default
+    return p95
+
+
+def hedge(fn: Callable[[], T], delay: float) -> T:
+    """Calls fn, calling it again concurrently if the first call is slower than delay.
+
+    Only use this for idempotent requests. The first successful result wins; the slower call is
+    left to finish in the background and its result is discarded.
+
+    Args:
+        fn: The request to perform.
+        delay: Seconds to wait for the first call before issuing the hedged call.
+
+    Returns:
+        The result of whichever call succeeded first.
+
+    Raises:
+        error: The call failed, or both calls failed when hedged.
+    """
+    results: "queue.Queue[Tuple[bool, Any]]" = queue.Queue()
+
+    def run() -> None:
+        try:
+            results.put((True, fn()))
+        except Exception as e:
+            results.put((False, e))
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        ok, value = results.get(timeout=delay)
+    except queue.Empty:
+        threading.Thread(target=run, daemon=True).start()
+        ok, value = results.get()
+        if not ok:
+            ok, second = results.get()
+            value = second if ok else value
+    if not ok:
+        error: Exception = value
+        raise error
+    result: T = value
+    return result
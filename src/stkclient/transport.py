@@ -0,0 +1,571 @@
+"""Pluggable HTTP transports used by stkclient.api."""
+
+import abc
+import collections
+import functools
+import http.client
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass
+from types import TracebackType
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from stkclient.timeouts import DEFAULT_TIMEOUT, Timeout
+
+Body = Union[None, bytes, IO[bytes]]
+
+
+class Response(abc.ABC):
+    """An HTTP response whose body is read incrementally.
+
+    Attributes:
+        status: The HTTP status code.
+        reason: The HTTP reason phrase.
+    """
+
+    status: int
+    reason: str
+
+    @abc.abstractmethod
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Returns the value of a response header, or default if it is absent."""
+
+    @abc.abstractmethod
+    def read(self, amt: Optional[int] = None) -> bytes:
+        """Reads up to amt bytes of the body, or the rest of the body if amt is None."""
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """Releases the response and its connection."""
+
+    def __enter__(self) -> "Response":
+        """Returns self."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        """Closes the response."""
+        self.close()
+
+
+class Transport(abc.ABC):
+    """Sends HTTP requests on behalf of the stkclient.api functions.
+
+    Implementations must return responses for every HTTP status rather than raising, and may
+    raise OSError for network failures.
+    """
+
+    @abc.abstractmethod
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Mapping[str, str],
+        body: Body = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+    ) -> Response:
+        """Sends a request and returns once the response headers have been received.
+
+        Args:
+            method: The HTTP method.
+            url: The absolute URL to request.
+            headers: Request headers.
+            body: Request body, either in memory or as a readable binary file-like object to be
+                streamed. Streamed bodies require a Content-Length header.
+            timeout: Connect and read timeouts for the request.
+
+        Returns:
+            The Response, which the caller must close.
+
+        # noqa: DAR202
+        """
+
+    def warm_up(self, urls: Iterable[str], *, background: bool = False) -> None:  # noqa: B027
+        """Prepares connections to the hosts of the given URLs ahead of the first request.
+
+        The default implementation does nothing; transports that keep connections alive override
+        it.
+
+        Args:
+            urls: URLs whose hosts will be requested soon.
+            background: If true, return immediately and warm up on a background thread.
+        """
+
+    def close(self) -> None:  # noqa: B027
+        """Releases resources held by the transport."""
+
+
+class StdlibTransport(Transport):
+    """Default transport built on the standard library, opening one connection per request.
+
+    In-memory requests are sent with urllib.request; streamed bodies are sent with http.client so
+    that no headers besides the supplied ones are added.
+    """
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Mapping[str, str],
+        body: Body = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+    ) -> Response:
+        """Sends a request and returns once the response headers have been received.
+
+        Args:
+            method: The HTTP method.
+            url: The absolute URL to request.
+            headers: Request headers.
+            body: Request body, either in memory or as a readable binary file-like object.
+            timeout: Connect and read timeouts for the request.
+
+        Returns:
+            The Response, which the caller must close.
+        """
+        if body is None or isinstance(body, bytes):
+            return self._urlopen(method, url, headers, body, timeout)
+        return self._stream(method, url, headers, body, timeout)
+
+    def _urlopen(
+        self,
+        method: str,
+        url: str,
+        headers: Mapping[str, str],
+        body: Optional[bytes],
+        timeout: Timeout,
+    ) -> Response:
+        req = urllib.request.Request(url=url, data=body, headers=dict(headers), method=method)
+        opener = urllib.request.build_opener(
+            _HTTPHandler(timeout.read), _HTTPSHandler(timeout.read)
+        )
+        try:
+            r = opener.open(req, timeout=timeout.connect)
+        except urllib.error.HTTPError as e:
+            return _StdlibResponse(e.code, e.reason, e.headers.get, e.read, e.close)
+        return _StdlibResponse(r.status, r.reason, r.getheader, r.read, r.close)
+
+    def _stream(
+        self, method: str, url: str, headers: Mapping[str, str], body: IO[bytes], timeout: Timeout
+    ) -> Response:
+        u = urllib.parse.urlparse(url)
+        if u.hostname is None:
+            raise ValueError("Invalid URL")
+        cls = _HTTPSConnection if u.scheme == "https" else _HTTPConnection
+        conn = cls(u.hostname, u.port, timeout=timeout.connect, read_timeout=timeout.read)
+        try:
+            conn.request(method, url, body=body, headers=dict(headers))
+            r = conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+        def close() -> None:
+            r.close()
+            conn.close()
+
+        return _StdlibResponse(r.status, r.reason, r.getheader, r.read, close)
+
+
+@dataclass(frozen=True)
+class ConnectTiming:
+    """Time spent establishing one connection.
+
+    Attributes:
+        host: The host connected to.
+        dns: Seconds spent resolving the host name (0 when served from cache).
+        tcp: Seconds spent on the TCP handshake.
+        tls: Seconds spent on the TLS handshake (0 for plain HTTP).
+        tls_resumed: Whether the TLS handshake resumed a previous session.
+    """
+
+    host: str
+    dns: float
+    tcp: float
+    tls: float
+    tls_resumed: bool
+
+
+_PoolKey = Tuple[str, str, Optional[int]]
+# Idle connections are keyed by host and owning thread (0 unless per_thread is set)
+_IdleKey = Tuple[_PoolKey, int]
+
+# The family, type, protocol and socket address of a getaddrinfo result
+_Address = Tuple[int, int, int, Any]
+
+
+class PooledTransport(Transport):
+    """Transport that keeps connections alive and reuses them across requests.
+
+    New TLS connections resume sessions from earlier connections to the same host through a
+    shared SSLContext, DNS results are cached, and connections can be opened ahead of time with
+    :meth:`warm_up`. The pool is safe to share between threads; each connection is used by one
+    request at a time. With ``per_thread`` set, a connection returns to the thread that opened
+    it, so each thread of a server keeps its own warm connections and threads never contend
+    for one another's.
+
+    Attributes:
+        connect_timings: The most recent ConnectTiming records, newest last.
+    """
+
+    def __init__(
+        self,
+        *,
+        context: Optional[ssl.SSLContext] = None,
+        max_idle_per_host: int = 4,
+        idle_timeout: float = 30.0,
+        dns_ttl: float = 60.0,
+        per_thread: bool = False,
+    ) -> None:
+        """Constructs a PooledTransport.
+
+        Args:
+            context: SSLContext shared by all TLS connections, or None for the default context.
+            max_idle_per_host: Number of idle connections kept per host.
+            idle_timeout: Seconds after which an idle connection is discarded rather than reused.
+            dns_ttl: Seconds for which resolved addresses are reused.
+            per_thread: If true, idle connections are only reused by the thread that last used
+                them, and max_idle_per_host applies to each thread.
+        """
+        self._context = context if context is not None else ssl.create_default_context()
+        self._max_idle = max_idle_per_host
+        self._idle_timeout = idle_timeout
+        self._dns_ttl = dns_ttl
+        self._per_thread = per_thread
+        self._lock = threading.Lock()
+        self._idle: Dict[_IdleKey, List[Tuple[float, http.client.HTTPConnection]]] = {}
+        self._sessions: Dict[_PoolKey, ssl.SSLSession] = {}
+        self._dns: Dict[Tuple[str, int], Tuple[float, List[_Address]]] = {}
+        self.connect_timings: Deque[ConnectTiming] = collections.deque(maxlen=100)
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Mapping[str, str],
+        body: Body = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+    ) -> Response:
+        """Sends a request on a pooled connection and returns once headers are received.
+
+        A request that fails on a reused connection (which the server may have closed while it
+        was idle) is retried once on a new connection, unless its body is a stream.
+
+        Args:
+            method: The HTTP method.
+            url: The absolute URL to request.
+            headers: Request headers.
+            body: Request body, either in memory or as a readable binary file-like object.
+            timeout: Connect and read timeouts for the request.
+
+        Returns:
+            The Response, which the caller must close.
+
+        Raises:
+            ConnectionError: The connection failed and could not be retried.
+            http.client.BadStatusLine: The server closed the connection without responding.
+            BaseException: Any other error, after closing the connection.
+        """
+        key, target = _split_url(url)
+        idle_key = (key, self._owner())
+        retryable = body is None or isinstance(body, bytes)
+        while True:
+            conn, reused = self._checkout(idle_key, timeout)
+            try:
+                conn.request(method, target, body=body, headers=dict(headers))
+                sock = conn.sock
+                r = conn.getresponse()
+                self._save_session(key, sock)
+            except (ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if reused and retryable:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            return _PooledResponse(r, functools.partial(self._checkin, idle_key, conn, r))
+
+    def warm_up(self, urls: Iterable[str], *, background: bool = False) -> None:
+        """Resolves and opens a connection to each URL's host unless one is already idle.
+
+        Args:
+            urls: URLs whose hosts will be requested soon.
+            background: If true, return immediately and warm up on a background thread.
+        """
+        owner = self._owner()
+        keys = list(dict.fromkeys((_split_url(url)[0], owner) for url in urls))
+        if background:
+            threading.Thread(target=self._warm_up, args=(keys,), daemon=True).start()
+        else:
+            self._warm_up(keys)
+
+    def close(self) -> None:
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for _, conn in conns:
+                conn.close()
+
+    def _owner(self) -> int:
+        return threading.get_ident() if self._per_thread else 0
+
+    def _warm_up(self, keys: List[_IdleKey]) -> None:
+        for idle_key in keys:
+            with self._lock:
+                if self._idle.get(idle_key):
+                    continue
+            try:
+                conn = self._connect(idle_key[0], DEFAULT_TIMEOUT)
+            except OSError:
+                continue  # The real request will report the failure
+            self._put_idle(idle_key, conn)
+
+    def _checkout(
+        self, idle_key: _IdleKey, timeout: Timeout
+    ) -> Tuple[http.client.HTTPConnection, bool]:
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                conns = self._idle.get(idle_key)
+                if not conns:
+                    break
+                idle_since, conn = conns.pop()
+            if now - idle_since > self._idle_timeout or conn.sock is None:
+                conn.close()
+                continue
+            conn.sock.settimeout(timeout.read)
+            with self._lock:
+                self.connections_reused += 1
+            return conn, True
+        return self._connect(idle_key[0], timeout), False
+
+    def _connect(self, key: _PoolKey, timeout: Timeout) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        conn: http.client.HTTPConnection
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, context=self._context)
+        else:
+            conn = http.client.HTTPConnection(host, port)
+        start = time.monotonic()
+        addresses = self._resolve(host, conn.port)
+        resolved = time.monotonic()
+        sock = self._dial(host, conn.port, addresses, timeout.connect)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connected = time.monotonic()
+        resumed = False
+        if scheme == "https":
+            with self._lock:
+                session = self._sessions.get(key)
+            try:
+                sock = self._context.wrap_socket(sock, server_hostname=host, session=session)
+            except BaseException:
+                sock.close()
+                raise
+            resumed = isinstance(sock, ssl.SSLSocket) and bool(sock.session_reused)
+        handshaken = time.monotonic()
+        sock.settimeout(timeout.read)
+        conn.sock = sock
+        with self._lock:
+            self.connections_opened += 1
+        self.connect_timings.append(
+            ConnectTiming(
+                host=host,
+                dns=resolved - start,
+                tcp=connected - resolved,
+                tls=handshaken - connected,
+                tls_resumed=resumed,
+            )
+        )
+        return conn
+
+    def _resolve(self, host: str, port: int) -> List[_Address]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._dns.get((host, port))
+        if cached is not None and now - cached[0] < self._dns_ttl:
+            return cached[1]
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        addresses: List[_Address] = [
+            (family, kind, proto, address) for family, kind, proto, _, address in infos
+        ]
+        with self._lock:
+            self._dns[(host, port)] = (now, addresses)
+        return addresses
+
+    def _dial(
+        self, host: str, port: int, addresses: List[_Address], timeout: Optional[float]
+    ) -> socket.socket:
+        """Connects to the first of addresses that accepts, like socket.create_connection."""
+        error: Optional[OSError] = None
+        for family, kind, proto, address in addresses:
+            sock = socket.socket(family, kind, proto)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(address)
+                return sock
+            except OSError as e:
+                sock.close()
+                error = e
+        # None of the addresses answered, so resolve the host again on the next connection
+        with self._lock:
+            self._dns.pop((host, port), None)
+        if error is None:
+            raise OSError(f"getaddrinfo returned no addresses for {host}")
+        raise error
+
+    def _checkin(
+        self, idle_key: _IdleKey, conn: http.client.HTTPConnection, r: http.client.HTTPResponse
+    ) -> None:
+        if not r.isclosed() or r.will_close or conn.sock is None:
+            r.close()
+            conn.close()
+            return
+        self._put_idle(idle_key, conn)
+
+    def _save_session(self, key: _PoolKey, sock: Optional[socket.socket]) -> None:
+        # TLS 1.3 session tickets arrive after the handshake, so the session is only useful for
+        # resumption once the response has started arriving.
+        if isinstance(sock, ssl.SSLSocket) and sock.session is not None:
+            with self._lock:
+                self._sessions[key] = sock.session
+
+    def _put_idle(self, idle_key: _IdleKey, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            conns = self._idle.setdefault(idle_key, [])
+            if len(conns) < self._max_idle:
+                conns.append((time.monotonic(), conn))
+                return
+        conn.close()
+
+
+def _split_url(url: str) -> Tuple[_PoolKey, str]:
+    u = urllib.parse.urlparse(url)
+    if u.hostname is None:
+        raise ValueError("Invalid URL")
+    target = u.path or "/"
+    if u.query:
+        target += "?" + u.query
+    return (u.scheme, u.hostname, u.port), target
+
+
+class _PooledResponse(Response):
+    def __init__(self, r: http.client.HTTPResponse, release: Callable[[], None]) -> None:
+        self.status = r.status
+        self.reason = r.reason
+        self._r = r
+        self._release: Optional[Callable[[], None]] = release
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self._r.getheader(name, default)
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        return self._r.read(amt)
+
+    def close(self) -> None:
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class _StdlibResponse(Response):
+    def __init__(
+        self,
+        status: int,
+        reason: str,
+        getheader: Callable[[str, Optional[str]], Optional[str]],
+        read: Callable[..., bytes],
+        close: Callable[[], None],
+    ) -> None:
+        self.status = status
+        self.reason = reason
+        self._getheader = getheader
+        self._read = read
+        self._close = close
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self._getheader(name, default)
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        return self._read(amt)
+
+    def close(self) -> None:
+        self._close()
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection which switches from the connect timeout to the read timeout once connected."""
+
+    def __init__(self, *args: Any, read_timeout: Optional[float] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._read_timeout = read_timeout
+
+    def connect(self) -> None:
+        super().connect()
+        self.sock.settimeout(self._read_timeout)
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    """HTTPSConnection which switches from the connect timeout to the read timeout once connected."""
+
+    def __init__(self, *args: Any, read_timeout: Optional[float] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._read_timeout = read_timeout
+
+    def connect(self) -> None:
+        super().connect()
+        self.sock.settimeout(self._read_timeout)
+
+
+class _HTTPHandler(urllib.request.HTTPHandler):
+    """HTTPHandler creating connections with a separate read timeout."""
+
+    def __init__(self, read_timeout: Optional[float]) -> None:
+        super().__init__()
+        self._read_timeout = read_timeout
+
+    def http_open(self, req: urllib.request.Request) -> http.client.HTTPResponse:
+        conn = functools.partial(_HTTPConnection, read_timeout=self._read_timeout)
+        return self.do_open(conn, req)
+
+
+class _HTTPSHandler(urllib.request.HTTPSHandler):
+    """HTTPSHandler creating connections with a separate read timeout."""
+
+    def __init__(self, read_timeout: Optional[float]) -> None:
+        super().__init__()
+        self._read_timeout = read_timeout
+
+    def https_open(self, req: urllib.request.Request) -> http.client.HTTPResponse:
+        conn = functools.partial(_HTTPSConnection, read_timeout=self._read_timeout)
+        return self.do_open(conn, req)
+
+
+DEFAULT_TRANSPORT: Transport = StdlibTransport()
@@ -0,0 +1,19 @@
+from types import TracebackType
+from typing import IO, Any, Optional, Tuple, Type
+
+class Image:
+    format: Optional[str]
+    width: int
+    height: int
+    def thumbnail(self, size: Tuple[int, int]) -> None: ...
+    def save(self, fp: IO[bytes], format: str, **params: Any) -> None: ...
+    def __enter__(self) -> "Image": ...
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None: ...
+
+def new(mode: str, size: Tuple[int, int], color: Any = ...) -> Image: ...
+def open(fp: IO[bytes]) -> Image: ...
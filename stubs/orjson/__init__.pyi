@@ -0,0 +1,3 @@
+from typing import Any
+
+def dumps(__obj: Any) -> bytes: ...
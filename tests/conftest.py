@@ -1,10 +1,14 @@
 """Shared fixtures."""
 
+import http.server
+import threading
 from typing import Generator
 
 import httpretty
 import pytest
 
+SOURCE_DOCUMENT = b"%PDF-1.7\n" + bytes(range(256)) * 2000
+
 
 @pytest.fixture(autouse=True)
 def disable_network_calls() -> Generator[None, None, None]:
@@ -15,6 +19,64 @@ def disable_network_calls() -> Generator[None, None, None]:
     httpretty.reset()  # reset HTTPretty state (clean up registered urls and request history)
 
 
+@pytest.fixture()
+def real_network() -> Generator[None, None, None]:
+    """Disables the httpretty mock for tests that talk to a local server."""
+    httpretty.disable()
+    yield
+
+
+class _SourceHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path == "/missing":
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        if self.path == "/book.pdf":
+            self.send_header("Content-Length", str(len(SOURCE_DOCUMENT)))
+        elif self.path == "/short.pdf":
+            self.send_header("Content-Length", str(len(SOURCE_DOCUMENT) + 1000))
+        self.end_headers()  # Without a Content-Length, the body ends when the connection closes
+        self.wfile.write(SOURCE_DOCUMENT)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture()
+def source_server(real_network: None) -> Generator[str, None, None]:
+    """Serves source_document over HTTP on localhost, returning the base URL.
+
+    /book.pdf is served with a Content-Length, /stream.pdf without one, and /short.pdf with a
+    Content-Length longer than the body; /missing is a 404.
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _SourceHandler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def source_document() -> bytes:
+    """The document served by source_server."""
+    return SOURCE_DOCUMENT
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter() -> Generator[object, None, None]:
+    """Installs a fresh, non-sleeping default rate limiter for each test."""
+    from stkclient import ratelimit  # Import at top-level causes typeguard to fail
+
+    previous = ratelimit.default_limiter()
+    limiter = ratelimit.RateLimiter(sleep=lambda s: None)
+    ratelimit.set_default_limiter(limiter)
+    yield limiter
+    ratelimit.set_default_limiter(previous)
+
+
 @pytest.fixture()
 def device_info() -> object:
     """Example DeviceInfo object."""
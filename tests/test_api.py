@@ -1,15 +1,25 @@
 """Unit tests of stkclient.api using httpretty-based mock."""
 
+import io
 import json
+import time
+import urllib.error
 from pathlib import Path
-from typing import Any, Mapping, Tuple
+from typing import IO, Any, List, Mapping, Tuple, cast
 from unittest.mock import Mock
 
 import httpretty
 import pytest
+from pytest_mock import MockerFixture
 
 from stkclient import api, model
+from stkclient.cancel import CancelledError, CancelToken
+from stkclient.cassette import Cassette, Exchange, ReplayServer
+from stkclient.progress import Progress
+from stkclient.ratelimit import RateLimiter
 from stkclient.signer import Signer
+from stkclient.standin import StandInServer
+from stkclient.timeouts import Deadline, DeadlineExceeded
 
 ADP_TOKEN_GOOD = "adp_token_good"  # noqa S105
 STK_TOKEN_GOOD = "9214b056b98b44238db291b3f2bb786c"  # noqa S105
@@ -185,7 +195,7 @@ def test_get_list_of_owned_devices_good(signer: Mock) -> None:
         httpretty.POST, "https://stkservice.amazon.com/GetListOfOwnedDevices", body=request_callback
     )
     res = api.get_list_of_owned_devices(signer)
-    data = json.dumps({"ClientInfo": api.DEFAULT_CLIENT_INFO}, indent=4)
+    data = json.dumps({"ClientInfo": api.DEFAULT_CLIENT_INFO}, separators=(",", ":"))
     signer.digest_header_for_request.assert_called_with("POST", "/GetListOfOwnedDevices", data)
     assert res == model.GetOwnedDevicesResponse(
         owned_devices=[
@@ -244,7 +254,9 @@ def test_get_upload_url_good(signer: Mock) -> None:
         httpretty.POST, "https://stkservice.amazon.com/GetUploadUrl", body=request_callback
     )
     res = api.get_upload_url(signer, 100)
-    data = json.dumps({"ClientInfo": api.DEFAULT_CLIENT_INFO, "fileSize": 100}, indent=4)
+    data = json.dumps(
+        {"ClientInfo": api.DEFAULT_CLIENT_INFO, "fileSize": 100}, separators=(",", ":")
+    )
     signer.digest_header_for_request.assert_called_with("POST", "/GetUploadUrl", data)
     assert res == model.GetUploadUrlResponse(
         expiry_time=3600000,
@@ -339,7 +351,7 @@ def test_send_to_kindle_good(signer: Mock) -> None:
         "stkToken": STK_TOKEN_GOOD,
         "targetDevices": targets,
     }
-    data = json.dumps(body, indent=4)
+    data = json.dumps(body, separators=(",", ":"))
     signer.digest_header_for_request.assert_called_with("POST", "/SendToKindle", data)
     assert res == model.SendToKindleResponse(sku="7B672AF0FA604BECA8143275166EA316", status_code=0)
 
@@ -363,3 +375,281 @@ def test_logout_good(signer: Mock) -> None:
         "X-Adp-Request-Digest": "test_signature",
         "X-Adp-Authentication-Token": "test_adp_token",
     }
+
+
+def test_request_retries_throttled(signer: Mock, rate_limiter: RateLimiter) -> None:
+    """Check that throttled requests are retried and slow down the endpoint."""
+    statuses = [429, 503, 200]
+
+    def request_callback(
+        request: httpretty.core.HTTPrettyRequest, uri: str, response_headers: Mapping[str, Any]
+    ) -> Tuple[int, Mapping[str, Any], str]:
+        status = statuses.pop(0)
+        if status != 200:
+            return status, {**response_headers, "Retry-After": "1"}, ""
+        return 200, response_headers, json.dumps({"sku": "sku", "statusCode": 0})
+
+    httpretty.register_uri(
+        httpretty.POST, "https://stkservice.amazon.com/SendToKindle", body=request_callback
+    )
+    res = api.send_to_kindle(signer, STK_TOKEN_GOOD, ["A"], author="a", title="t", format="mobi")
+    assert res.sku == "sku"
+    assert statuses == []
+    assert rate_limiter.rate("stkservice.amazon.com/SendToKindle") < 10.0
+
+
+def test_request_throttled_gives_up(signer: Mock) -> None:
+    """Check that requests which stay throttled raise an APIError."""
+    calls = []
+
+    def request_callback(
+        request: httpretty.core.HTTPrettyRequest, uri: str, response_headers: Mapping[str, Any]
+    ) -> Tuple[int, Mapping[str, Any], str]:
+        calls.append(uri)
+        return 429, response_headers, "slow down"
+
+    httpretty.register_uri(
+        httpretty.POST, "https://stkservice.amazon.com/GetUploadUrl", body=request_callback
+    )
+    with pytest.raises(api.APIError, match="slow down"):
+        api.get_upload_url(signer, 100)
+    assert len(calls) == 5
+
+
+def test_upload_file_paced_by_host(rate_limiter: RateLimiter) -> None:
+    """Check that uploads to different presigned URLs share the upload host's rate."""
+    host = "send-to-kindle-prod.s3.amazonaws.com"
+    statuses = [503, 200, 200]
+
+    def request_callback(
+        request: httpretty.core.HTTPrettyRequest, uri: str, response_headers: Mapping[str, Any]
+    ) -> Tuple[int, Mapping[str, Any], str]:
+        return statuses.pop(0), response_headers, ""
+
+    for path in ("RpaDKq", "Xb3kQz"):
+        httpretty.register_uri(httpretty.PUT, f"https://{host}/{path}", body=request_callback)
+    initial = rate_limiter.rate(host)
+    api.upload_file(f"https://{host}/RpaDKq", 4, io.BytesIO(b"data"))
+    throttled = rate_limiter.rate(host)
+    assert throttled < initial
+    api.upload_file(f"https://{host}/Xb3kQz", 4, io.BytesIO(b"data"))
+    assert statuses == []
+    assert throttled <= rate_limiter.rate(host) < initial
+    assert set(rate_limiter._buckets) == {host}
+
+
+def test_upload_file_retries_throttled(tmp_path: Path) -> None:
+    """Check that a throttled upload rewinds the file and tries again."""
+    url = "https://send-to-kindle-prod.s3.amazonaws.com/RpaDKq"
+    file_path = tmp_path / "test.txt"
+    file_path.write_bytes(b"test file contents")
+    bodies = []
+
+    def request_callback(
+        request: httpretty.core.HTTPrettyRequest, uri: str, response_headers: Mapping[str, Any]
+    ) -> Tuple[int, Mapping[str, Any], str]:
+        bodies.append(request.body)
+        return (503 if len(bodies) == 1 else 200), response_headers, ""
+
+    httpretty.register_uri(httpretty.PUT, url, body=request_callback)
+    with open(file_path, "rb") as fr:
+        api.upload_file(url, 18, fr)
+    assert bodies == [b"test file contents", b"test file contents"]
+
+
+class _Unseekable(io.RawIOBase):
+    def __init__(self, data: bytes) -> None:
+        self._data = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: Any) -> int:
+        return self._data.readinto(b)
+
+
+@pytest.mark.parametrize("seekable", [True, False])
+def test_upload_file_retries_reset(
+    real_network: None, rate_limiter: RateLimiter, seekable: bool
+) -> None:
+    """Check that an upload dropped by the server is sent again in full on a new connection."""
+    size = 256 * 1024
+    data = bytes(range(256)) * (size // 256)
+    url = "https://upload.standin.invalid/upload/x"
+    dropped = Exchange("PUT", url, status=None, error="ConnectionResetError")
+    with ReplayServer(Cassette([dropped, Exchange("PUT", url)])) as server:
+        transport = server.transport()
+        fp = io.BytesIO(data) if seekable else _Unseekable(data)
+        api.upload_file(url, size, cast(IO[bytes], fp), transport=transport)
+        transport.close()
+    assert server.requests == {"/upload/x": 2}
+    assert server.bytes_uploaded == 2 * size
+    assert transport.inner.connections_opened == 2  # type: ignore[attr-defined]
+
+
+def test_upload_file_retry_classification(rate_limiter: RateLimiter) -> None:
+    """Check that server errors are retried, but client errors and expiring URLs are not."""
+    url = "https://send-to-kindle-prod.s3.amazonaws.com/RpaDKq"
+    statuses = [500, 200, 403]
+
+    def request_callback(
+        request: httpretty.core.HTTPrettyRequest, uri: str, response_headers: Mapping[str, Any]
+    ) -> Tuple[int, Mapping[str, Any], str]:
+        return statuses.pop(0), response_headers, "error"
+
+    httpretty.register_uri(httpretty.PUT, url, body=request_callback)
+    api.upload_file(url, 4, io.BytesIO(b"data"))
+    with pytest.raises(api.APIError, match="403"):
+        api.upload_file(url, 4, io.BytesIO(b"data"))
+    assert statuses == []
+
+    transport = Mock()
+    transport.request.side_effect = ConnectionResetError()
+    with pytest.raises(ConnectionResetError):
+        api.upload_file(
+            url, 4, io.BytesIO(b"data"), transport=transport, expires_at=time.monotonic() + 1
+        )
+    assert transport.request.call_count == 1
+    with pytest.raises(ConnectionResetError):
+        api.upload_file(url, 4, io.BytesIO(b"data"), transport=transport)
+    assert transport.request.call_count == 2 + api.DEFAULT_UPLOAD_RETRY.max_retries
+    assert not api.is_retryable(DeadlineExceeded())
+
+
+def test_upload_file_retry_budget(rate_limiter: RateLimiter) -> None:
+    """Check that throttled and failed attempts share one count of retries."""
+    url = "https://send-to-kindle-prod.s3.amazonaws.com/RpaDKq"
+    attempts: List[int] = []
+
+    def request_callback(
+        request: httpretty.core.HTTPrettyRequest, uri: str, response_headers: Mapping[str, Any]
+    ) -> Tuple[int, Mapping[str, Any], str]:
+        attempts.append(len(request.body))
+        return 503, response_headers, "slow down"
+
+    httpretty.register_uri(httpretty.PUT, url, body=request_callback)
+    with pytest.raises(api.APIError, match="503"):
+        api.upload_file(url, 4, io.BytesIO(b"data"))
+    assert attempts == [4] * (1 + rate_limiter.max_retries)
+
+    transport = Mock()
+    transport.request.side_effect = [ConnectionResetError(), PermissionError()]
+    with pytest.raises(PermissionError):
+        api.upload_file(url, 4, io.BytesIO(b"data"), transport=transport)
+    assert transport.request.call_count == 2
+    assert api.is_retryable(urllib.error.URLError(ConnectionRefusedError()))
+    assert not api.is_retryable(urllib.error.URLError("unknown url type"))
+
+
+def test_request_deadline_exceeded(signer: Mock) -> None:
+    """Check that an expired deadline fails before sending the request."""
+    deadline = Deadline(0.0)
+    with pytest.raises(DeadlineExceeded):
+        api.get_upload_url(signer, 100, deadline=deadline)
+    assert httpretty.last_request().method is None
+
+
+def test_get_list_of_owned_devices_hedged(signer: Mock) -> None:
+    """Check that a hedged request returns a response."""
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://stkservice.amazon.com/GetListOfOwnedDevices",
+        body=json.dumps({"ownedDevices": [], "statusCode": 0}),
+    )
+    res = api.get_list_of_owned_devices(signer, hedged=True)
+    assert res == model.GetOwnedDevicesResponse(owned_devices=[], status_code=0)
+
+
+def test_upload_file_progress() -> None:
+    """Check that upload progress is reported while the file is sent."""
+    url = "https://send-to-kindle-prod.s3.amazonaws.com/RpaDKq"
+    httpretty.register_uri(httpretty.PUT, url, body="")
+    reports: List[Progress] = []
+    api.upload_file(url, 1000, io.BytesIO(b"x" * 1000), progress=reports.append, progress_every=1)
+    assert httpretty.last_request().body == b"x" * 1000
+    assert reports[-1].bytes_sent == 1000
+    assert reports[-1].total == 1000
+
+
+def test_request_cancelled(signer: Mock) -> None:
+    """Check that a cancelled or draining token stops requests before they are sent."""
+    calls: List[str] = []
+
+    def callback(request: Any, uri: str, headers: Mapping[str, Any]) -> Tuple[int, Any, str]:
+        calls.append(uri)
+        return 200, headers, json.dumps({"sku": "sku", "statusCode": 0})
+
+    url = "https://stkservice.amazon.com/SendToKindle"
+    httpretty.register_uri(httpretty.POST, url, body=callback)
+    token = CancelToken()
+    token.drain()
+    # Draining lets a delivery whose upload has finished complete, but no new upload starts
+    res = api.send_to_kindle(signer, "t", [], author="a", title="t", format="f", cancel=token)
+    assert res.sku == "sku"
+    with pytest.raises(CancelledError):
+        api.upload_file("https://upload.example.com/x", 1, io.BytesIO(b"x"), cancel=token)
+    token.cancel()
+    with pytest.raises(CancelledError):
+        api.send_to_kindle(signer, "t", [], author="a", title="t", format="f", cancel=token)
+    assert calls == [url]
+
+
+def test_upload_file_cancelled(real_network: None) -> None:
+    """Check that cancelling mid-upload stops sending and closes the connection."""
+    token = CancelToken()
+
+    def progress(p: Progress) -> None:
+        token.cancel()
+
+    with StandInServer() as server:
+        transport = server.transport()
+        size = 1024 * 1024
+        with pytest.raises(CancelledError):
+            api.upload_file(
+                "https://upload.standin.invalid/upload/x",
+                size,
+                io.BytesIO(b"x" * size),
+                transport=transport,
+                progress=progress,
+                progress_every=8192,
+                cancel=token,
+            )
+        api.upload_file(
+            "https://upload.standin.invalid/upload/y", 1, io.BytesIO(b"x"), transport=transport
+        )
+        transport.close()
+    assert server.requests == {"/upload": 1}
+    assert server.bytes_uploaded == 1
+    assert transport.inner.connections_opened == 2  # type: ignore[attr-defined]
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_encode_request(mocker: MockerFixture, fast: bool) -> None:
+    """Check that both JSON backends encode request bodies to the same compact text."""
+    if not fast:
+        mocker.patch.object(api, "_fast_dumps", None)
+    body = {"fileSize": 100, "DocumentMetadata": {"title": "Café", "crc32": 0}, "archive": True}
+    expected = json.dumps({"ClientInfo": api.DEFAULT_CLIENT_INFO, **body}, separators=(",", ":"))
+    assert api._encode_request(body) == expected
+    assert api._encode_request({}) == json.dumps(
+        {"ClientInfo": api.DEFAULT_CLIENT_INFO}, separators=(",", ":")
+    )
+
+
+def test_request_signs_sent_body(signer: Mock) -> None:
+    """Check that the signed text is exactly the body that is sent."""
+    sent: List[bytes] = []
+
+    def request_callback(
+        request: httpretty.core.HTTPrettyRequest, uri: str, response_headers: Mapping[str, Any]
+    ) -> Tuple[int, Mapping[str, Any], str]:
+        sent.append(request.body)
+        return 200, response_headers, json.dumps({"sku": "sku", "statusCode": 0})
+
+    httpretty.register_uri(
+        httpretty.POST, "https://stkservice.amazon.com/SendToKindle", body=request_callback
+    )
+    api.send_to_kindle(signer, STK_TOKEN_GOOD, ["A"], author="Zoë", title="t", format="pdf")
+    signed = signer.digest_header_for_request.call_args.args[2]
+    assert sent == [signed.encode("utf-8")]
+    assert "Zo\\u00eb" in signed
@@ -0,0 +1,425 @@
+"""Unit tests of stkclient.batch."""
+
+import functools
+import os
+import pickle  # noqa: S403
+import threading
+from pathlib import Path
+from typing import Any, List
+from unittest import mock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from stkclient import Client, api, model
+from stkclient.batch import (
+    AIMDController,
+    BatchSender,
+    FairScheduler,
+    FIFOScheduler,
+    LeasePrefetcher,
+    ProcessBatchSender,
+    Scheduler,
+    SendJob,
+    ShortestJobFirstScheduler,
+)
+from stkclient.cancel import CancelledError, CancelToken
+from stkclient.transport import PooledTransport
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        """Starts the clock at zero."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Returns the current time."""
+        return self.now
+
+
+def test_aimd_controller() -> None:
+    """Check that the limit rises with throughput, holds at the knee and backs off."""
+    clock = FakeClock()
+    c = AIMDController(2, max_limit=8, clock=clock)
+
+    def window(nbytes: int, seconds: float, errors: int = 0) -> str:
+        n = c.limit
+        clock.now += seconds
+        for i in range(n):
+            decision = c.record(nbytes // n, error=i < errors)
+            assert (decision is None) == (i < n - 1)
+        assert decision is not None
+        return decision.reason
+
+    assert window(1000, 1.0) == "throughput rose"
+    assert c.limit == 3
+    assert window(1500, 1.0) == "throughput rose"
+    assert c.limit == 4
+    assert window(1520, 1.0) == "throughput flat"
+    assert c.limit == 4
+    assert window(1000, 1.0) == "throughput fell"
+    assert c.limit == 2
+    assert window(1000, 1.0, errors=1) == "errors"
+    assert c.limit == 1
+    assert [d.limit for d in c.history] == [3, 4, 4, 2, 1]
+
+    with pytest.raises(ValueError):
+        AIMDController(0)
+
+
+def test_batch_sender(tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo) -> None:
+    """Check that every job is sent, failures are reported and the limit is respected."""
+    client = Client(device_info)
+    controller = AIMDController(2, max_limit=3)
+    lock = threading.Lock()
+    in_flight: List[int] = [0]
+
+    def send_file(file_path: Path, *args: Any, **kwargs: Any) -> str:
+        with lock:
+            in_flight[0] += 1
+            assert in_flight[0] <= controller.limit
+        try:
+            if file_path.name == "bad.txt":
+                raise OSError("connection reset")
+            return "sku-" + file_path.name
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    mocker.patch.object(client, "send_file", side_effect=send_file)
+    jobs = []
+    for name in ["a.txt", "b.txt", "bad.txt", "c.txt", "d.txt"]:
+        (tmp_path / name).write_bytes(b"data")
+        jobs.append(SendJob(tmp_path / name, ["device"], author="a", title=name, format="txt"))
+    jobs.append(SendJob(tmp_path / "missing.txt", ["device"], author="a", title="", format="txt"))
+
+    results = list(BatchSender(client, controller=controller).send(jobs))
+    assert sorted(str(r.sku) for r in results if r.ok) == [
+        "sku-a.txt",
+        "sku-b.txt",
+        "sku-c.txt",
+        "sku-d.txt",
+    ]
+    assert sorted(r.job.file_path.name for r in results if not r.ok) == ["bad.txt", "missing.txt"]
+    assert all(r.bytes_sent == (4 if r.ok else 0) for r in results)
+    assert controller.history
+
+
+def test_batch_sender_ignores_job_errors(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that failures of the jobs themselves don't reduce concurrency, but resets do."""
+    client = Client(device_info)
+    errors = {
+        "rejected.txt": api.APIError("HTTP Error 400: Bad Request"),
+        "denied.txt": PermissionError("denied"),
+        "reset.txt": ConnectionResetError("reset"),
+    }
+
+    def send_file(file_path: Path, *args: Any, **kwargs: Any) -> str:
+        if file_path.name in errors:
+            raise errors[file_path.name]
+        return "sku"
+
+    mocker.patch.object(client, "send_file", side_effect=send_file)
+    jobs = [make_job(tmp_path, name, 4) for name in ["a.txt", "rejected.txt", "denied.txt"]]
+    jobs.append(SendJob(tmp_path / "missing.txt", ["d"], "a", "missing.txt", "txt"))
+    controller = AIMDController(4, max_limit=4)
+    assert len(list(BatchSender(client, controller=controller).send(jobs))) == 4
+    [decision] = controller.history
+    assert (decision.limit, decision.errors, decision.samples) == (4, 0, 4)
+    jobs = [make_job(tmp_path, name, 4) for name in ["b.txt", "c.txt", "d.txt", "reset.txt"]]
+    assert len(list(BatchSender(client, controller=controller).send(jobs))) == 4
+    assert (controller.history[-1].reason, controller.limit) == ("errors", 2)
+
+
+def test_batch_sender_fixed(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that max_workers keeps a fixed number of sends in flight, without a controller."""
+    client = Client(device_info)
+    lock = threading.Lock()
+    in_flight = [0, 0]  # Current and highest
+    both_running = threading.Barrier(2, timeout=5)
+
+    def send_file(file_path: Path, *args: Any, **kwargs: Any) -> str:
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        both_running.wait()
+        with lock:
+            in_flight[0] -= 1
+        return "sku"
+
+    mocker.patch.object(client, "send_file", side_effect=send_file)
+    sender = BatchSender(client, max_workers=2)
+    assert sender.controller is None
+    jobs = [make_job(tmp_path, str(i), 4) for i in range(6)]
+    assert all(r.ok for r in sender.send(jobs))
+    assert in_flight == [0, 2]
+    for kwargs in (
+        {"max_workers": 0},
+        {"max_workers": 2, "controller": AIMDController()},
+        {"max_queued": 0},
+    ):
+        with pytest.raises(ValueError):
+            BatchSender(client, **kwargs)
+
+
+def make_job(tmp_path: Path, name: str, size: int, target: str = "d", priority: int = 0) -> SendJob:
+    """Creates a file of the given size and a job to send it."""
+    (tmp_path / name).write_bytes(b"x" * size)
+    return SendJob(tmp_path / name, [target], "a", name, "txt", priority=priority)
+
+
+def drain(scheduler: Scheduler) -> List[str]:
+    """Pops every queued job, returning their titles."""
+    titles = []
+    while scheduler:
+        titles.append(scheduler.pop().title)
+    return titles
+
+
+def test_fifo_scheduler(tmp_path: Path) -> None:
+    """Check that the default scheduler keeps queueing order."""
+    s = FIFOScheduler()
+    for name, size in [("big", 300), ("small", 1), ("mid", 20)]:
+        s.push(make_job(tmp_path, name, size))
+    assert drain(s) == ["big", "small", "mid"]
+    with pytest.raises(IndexError):
+        s.pop()
+
+
+def test_shortest_job_first_scheduler(tmp_path: Path) -> None:
+    """Check ordering by priority class and size, and that aging prevents starvation."""
+    clock = FakeClock()
+    s = ShortestJobFirstScheduler(aging=10.0, clock=clock)
+    s.push(make_job(tmp_path, "big", 300))
+    s.push(make_job(tmp_path, "small", 1))
+    s.push(make_job(tmp_path, "urgent", 500, priority=-1))
+    s.push(SendJob(tmp_path / "missing", ["d"], "a", "missing", "txt"))
+    assert drain(s) == ["urgent", "missing", "small", "big"]
+
+    s.push(make_job(tmp_path, "big", 300))
+    clock.now = 20.0
+    s.push(make_job(tmp_path, "small", 1))
+    clock.now = 40.0
+    s.push(make_job(tmp_path, "small2", 1))
+    assert drain(s) == ["small", "big", "small2"]
+
+
+def test_fair_scheduler(tmp_path: Path) -> None:
+    """Check that groups take turns and are each ordered by their own scheduler."""
+    s = FairScheduler(scheduler=functools.partial(ShortestJobFirstScheduler, aging=0.0))
+    for name, size, target in [("a1", 3, "a"), ("a2", 2, "a"), ("a3", 1, "a"), ("b1", 5, "b")]:
+        s.push(make_job(tmp_path, name, size, target))
+    assert len(s) == 4
+    assert drain(s) == ["a3", "b1", "a2", "a1"]
+    with pytest.raises(IndexError):
+        s.pop()
+
+    s = FairScheduler(key=lambda job: job.title[0], scheduler=FIFOScheduler)
+    for name in ["x1", "x2", "y1"]:
+        s.push(make_job(tmp_path, name, 1))
+    assert drain(s) == ["x1", "y1", "x2"]
+
+
+def test_batch_sender_scheduler(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that the batch sender starts jobs in the scheduler's order."""
+    client = Client(device_info)
+    send_file = mocker.patch.object(client, "send_file", return_value="sku")
+    jobs = [make_job(tmp_path, name, size) for name, size in [("big", 300), ("small", 1)]]
+    sender = BatchSender(
+        client, controller=AIMDController(1, max_limit=1), scheduler=ShortestJobFirstScheduler()
+    )
+    assert [r.job.title for r in sender.send(jobs)] == ["small", "big"]
+    assert [c.args[0].name for c in send_file.call_args_list] == ["small", "big"]
+
+
+def test_batch_sender_aging(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that jobs are queued as the scheduler has room, so a large job ages and is promoted."""
+    client = Client(device_info)
+    clock = FakeClock()
+
+    def send_file(*args: Any, **kwargs: Any) -> str:
+        clock.now += 1.0
+        return "sku"
+
+    mocker.patch.object(client, "send_file", side_effect=send_file)
+    small = [f"s{i}" for i in range(40)]
+    jobs = [make_job(tmp_path, "big", 300)] + [make_job(tmp_path, name, 1) for name in small]
+    for aging, expected in [(10.0, small[:31] + ["big"] + small[31:]), (0.0, small + ["big"])]:
+        clock.now = 0.0
+        scheduler = ShortestJobFirstScheduler(aging=aging, clock=clock)
+        sender = BatchSender(client, max_workers=1, scheduler=scheduler, max_queued=2)
+        assert [r.job.title for r in sender.send(iter(jobs))] == expected
+
+
+def fake_send_file(self: Client, file_path: Path, *args: Any, **kwargs: Any) -> str:
+    """Stands in for Client.send_file in worker processes."""
+    if file_path.name == "bad.txt":
+        raise api.APIError("HTTP Error 400: Bad Request", b'{"error": "bad"}')
+    return f"{os.getpid()}-{file_path.name}"
+
+
+def patch_worker() -> None:
+    """Worker initializer replacing Client.send_file."""
+    mock.patch.object(Client, "send_file", fake_send_file).start()
+
+
+def test_client_pickle(device_info: model.DeviceInfo) -> None:
+    """Check that a pickled client keeps its parsed key but not its transport."""
+    client = Client(device_info, PooledTransport())
+    client._upload_url = "https://upload.example.com/"
+    restored = pickle.loads(pickle.dumps(client))  # noqa: S301
+    assert restored == client
+    assert restored._signer == client._signer
+    assert restored.transport is None
+    assert restored._upload_url is None
+
+
+def test_process_batch_sender(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that jobs are sent from worker processes and errors are returned."""
+    client = Client(device_info)
+    from_device_info = mocker.patch("stkclient.signer.Signer.from_device_info")
+    jobs = [make_job(tmp_path, name, 1) for name in ["a.txt", "b.txt", "bad.txt"]]
+    sender = ProcessBatchSender(client, processes=2, initializer=patch_worker)
+    results = {r.job.title: r for r in sender.send(jobs)}
+    assert results["a.txt"].ok and results["b.txt"].ok
+    assert str(results["a.txt"].sku).endswith("-a.txt")
+    assert str(results["a.txt"].sku).split("-")[0] != str(os.getpid())
+    assert isinstance(results["bad.txt"].error, api.APIError)
+    assert str(results["bad.txt"].error) == 'HTTP Error 400: Bad Request {"error": "bad"}'
+    from_device_info.assert_not_called()
+
+
+def test_lease_prefetcher(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that leases are fetched per job and discarded close to expiry."""
+    clock = FakeClock()
+    client = Client(device_info)
+    upload = model.GetUploadUrlResponse(60000, 0, "token", "url")
+    sizes: List[int] = []
+
+    def get_upload_lease(file_size: int, **kwargs: Any) -> model.UploadLease:
+        sizes.append(file_size)
+        if file_size == 13:
+            raise OSError("connection reset")
+        return model.UploadLease.from_response(upload, file_size, clock.now)
+
+    mocker.patch.object(client, "get_upload_lease", side_effect=get_upload_lease)
+    prefetcher = LeasePrefetcher(client, margin=10.0, clock=clock)
+    a, b, c, d = (
+        make_job(tmp_path, name, size) for name, size in [("a", 1), ("b", 2), ("c", 13), ("d", 4)]
+    )
+    for job in (a, b, c):
+        prefetcher.prefetch(job)
+    assert prefetcher.acquire(a) == model.UploadLease(upload, 1, 60.0)
+    assert prefetcher.acquire(a) is None  # Leases are used once
+    assert prefetcher.acquire(c) is None  # Failed requests are left to the send
+    assert prefetcher.acquire(d) is None  # Never prefetched
+    clock.now = 50.0
+    assert prefetcher.acquire(b) is None  # Too close to expiry
+    assert sorted(sizes) == [1, 2, 13]
+    prefetcher.close()
+
+
+def test_lease_prefetcher_refresh(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that leases close to expiry are requested again ahead of their job."""
+    clock = FakeClock()
+    client = Client(device_info)
+    upload = model.GetUploadUrlResponse(60000, 0, "token", "url")
+    requested: List[float] = []
+
+    def get_upload_lease(file_size: int, **kwargs: Any) -> model.UploadLease:
+        requested.append(clock.now)
+        return model.UploadLease.from_response(upload, file_size, clock.now)
+
+    mocker.patch.object(client, "get_upload_lease", side_effect=get_upload_lease)
+    prefetcher = LeasePrefetcher(client, margin=10.0, clock=clock)
+    job = make_job(tmp_path, "a", 1)
+    prefetcher.prefetch(job)
+    prefetcher._leases[id(job)][1].result()
+    clock.now = 35.0
+    prefetcher.refresh()  # 25s left is plenty
+    clock.now = 45.0
+    prefetcher.refresh()  # 15s left is close to the margin
+    lease = prefetcher.acquire(job)
+    assert requested == [0.0, 45.0]
+    assert lease is not None and lease.expires_at == 105.0
+    prefetcher.close()
+
+
+def test_batch_sender_prefetch(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that the batch sender prefetches leases and passes them to send_file."""
+    client = Client(device_info)
+    upload = model.GetUploadUrlResponse(3600000, 0, "token", "url")
+    get_upload_url = mocker.patch("stkclient.api.get_upload_url", return_value=upload)
+    send_file = mocker.patch.object(client, "send_file", return_value="sku")
+    jobs = [make_job(tmp_path, str(i), i) for i in range(5)]
+    prefetcher = LeasePrefetcher(client, lookahead=2)
+    sender = BatchSender(client, controller=AIMDController(1, max_limit=1), prefetcher=prefetcher)
+    assert [r.job.title for r in sender.send(jobs)] == ["0", "1", "2", "3", "4"]
+    prefetcher.close()
+    # The first job starts without waiting for a lease; the rest were prefetched
+    leases = [c.kwargs["lease"] for c in send_file.call_args_list]
+    assert leases[0] is None
+    assert [lease.file_size for lease in leases[1:]] == [1, 2, 3, 4]
+    assert get_upload_url.call_count == 4
+
+
+def test_batch_sender_drain(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that draining stops new sends and reports the unsent jobs, queued or not."""
+    client = Client(device_info)
+    send_file = mocker.patch.object(client, "send_file", return_value="sku")
+    jobs = [make_job(tmp_path, f"{i}.txt", 10) for i in range(5)]
+    token = CancelToken()
+    sender = BatchSender(client, controller=AIMDController(1, max_limit=1), max_queued=2)
+    results = []
+    for result in sender.send(jobs, cancel=token):
+        results.append(result)
+        token.drain()
+    assert [r.job.title for r in results] == ["0.txt", "1.txt", "2.txt", "3.txt", "4.txt"]
+    assert results[0].ok
+    assert all(isinstance(r.error, CancelledError) for r in results[1:])
+    assert send_file.call_count == 1
+    assert send_file.call_args.kwargs["cancel"] is token
+
+
+def test_batch_sender_drain_prefetched(
+    tmp_path: Path, mocker: MockerFixture, device_info: model.DeviceInfo
+) -> None:
+    """Check that draining drops prefetched leases and the prefetcher's threads."""
+    client = Client(device_info)
+    upload = model.GetUploadUrlResponse(3600000, 0, "token", "url")
+    get_upload_url = mocker.patch("stkclient.api.get_upload_url", return_value=upload)
+    mocker.patch.object(client, "send_file", return_value="sku")
+    prefetcher = LeasePrefetcher(client, lookahead=3)
+    close = mocker.spy(prefetcher, "close")
+    discard = mocker.spy(prefetcher, "discard")
+    sender = BatchSender(client, controller=AIMDController(1, max_limit=1), prefetcher=prefetcher)
+    token = CancelToken()
+    results = []
+    for result in sender.send([make_job(tmp_path, str(i), 10) for i in range(6)], cancel=token):
+        results.append(result)
+        token.drain()
+    assert [r.ok for r in results] == [True] + [False] * 5
+    assert get_upload_url.call_count <= 3
+    assert discard.call_count == 5
+    close.assert_called_once()
+    assert prefetcher._leases == {} and prefetcher._pool is None
@@ -0,0 +1,28 @@
+"""Unit tests of stkclient.bench."""
+
+from stkclient import Client, bench, model, ratelimit
+
+
+def test_run_offline(real_network: None, device_info: model.DeviceInfo) -> None:
+    """Check that an offline run measures every phase against the stand-in."""
+    limiter = ratelimit.default_limiter()
+    report = bench.run(
+        Client(device_info).dumps(), offline=True, requests=5, payload_size=4096, signatures=3
+    )
+    assert ratelimit.default_limiter() is limiter
+    assert report.offline
+    assert report.key_load > 0
+    assert report.signing_rate > 0
+    assert [c.host for c in report.connections] == [
+        "stkservice.amazon.com",
+        "upload.standin.invalid",
+    ]
+    latency = report.owned_devices_latency
+    assert list(latency) == ["p50", "p90", "p99", "min", "max"]
+    assert 0 < latency["min"] <= latency["p50"] <= latency["p99"] <= latency["max"]
+    assert report.owned_devices_requests == 5
+    assert (report.upload_bytes, report.upload_rate > 0) == (4096, True)
+    assert report.to_dict()["upload_rate"] == report.upload_rate
+    text = report.format()
+    assert "GetListOfOwnedDevices  n=5" in text
+    assert "upload.standin.invalid" in text
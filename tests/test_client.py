@@ -1,10 +1,21 @@
 """Tests for the stkclient module."""
+import concurrent.futures
+import time
+import zipfile
 from pathlib import Path
-from typing import IO, Any
+from typing import IO, Any, List
 
+import pytest
 from pytest_mock import MockerFixture
 
-from stkclient import Client, OAuth2, model
+from stkclient import Client, OAuth2, SourceError, model, standin, timeouts
+from stkclient.cancel import CancelledError, CancelToken
+from stkclient.epub import Minimizer, MinimizeReport
+from stkclient.formats import DEFAULT_POLICY, Policy, PreflightError
+from stkclient.progress import Progress
+from stkclient.standin import StandInServer
+from stkclient.timeouts import DEFAULT_TIMEOUT, DeadlineExceeded
+from stkclient.transport import PooledTransport, Transport
 
 
 def test_oauth2(mocker: MockerFixture, device_info: model.DeviceInfo) -> None:
@@ -26,9 +37,9 @@ def test_oauth2(mocker: MockerFixture, device_info: model.DeviceInfo) -> None:
     client = auth.create_client(redirect_url)
     assert client._device_info == device_info
     token_exchange.assert_called_once_with(
-        "authorization_code_good", "Hzm57JLosyUt1fcQ7LsT1NZPFXrDJHIBNgoEZBW7u90"
+        "authorization_code_good", "Hzm57JLosyUt1fcQ7LsT1NZPFXrDJHIBNgoEZBW7u90", transport=None
     )
-    register_device.assert_called_once_with("access_token_good")
+    register_device.assert_called_once_with("access_token_good", transport=None)
 
 
 def test_client_get_owned_devices(mocker: MockerFixture, device_info: model.DeviceInfo) -> None:
@@ -59,7 +70,9 @@ def test_client_get_owned_devices(mocker: MockerFixture, device_info: model.Devi
     )
     c = Client(device_info)
     assert c.get_owned_devices() == devices
-    get_list_of_owned_devices.assert_called_once_with(c._signer)
+    get_list_of_owned_devices.assert_called_once_with(
+        c._signer, transport=None, timeout=DEFAULT_TIMEOUT, hedged=False, cancel=None
+    )
 
 
 def test_client_send_file(
@@ -84,7 +97,7 @@ def test_client_send_file(
     )
 
     # Mock api.upload_file. Use a custom implementation so we can read out the file.
-    def handle_upload(url: str, file_size: int, fp: IO[Any]) -> None:
+    def handle_upload(url: str, file_size: int, fp: IO[Any], **kwargs: Any) -> None:
         d = fp.read()
         assert len(d) == file_size
         assert d == test_file_contents.encode()
@@ -103,7 +116,14 @@ def test_client_send_file(
         test_file_path, [test_device_id], author=test_author, title=test_title, format="mobi"
     )
     assert sku == test_sku
-    get_upload_url.assert_called_once_with(c._signer, len(test_file_contents))
+    get_upload_url.assert_called_once_with(
+        c._signer,
+        len(test_file_contents),
+        transport=None,
+        timeout=DEFAULT_TIMEOUT,
+        deadline=None,
+        cancel=None,
+    )
     upload_file.assert_called_once()  # assertions done in the implementation
     send_to_kindle.assert_called_once_with(
         c._signer,
@@ -112,6 +132,10 @@ def test_client_send_file(
         author=test_author,
         title=test_title,
         format="mobi",
+        transport=None,
+        timeout=DEFAULT_TIMEOUT,
+        deadline=None,
+        cancel=None,
     )
 
 
@@ -142,3 +166,233 @@ def test_client_repr(device_info: model.DeviceInfo) -> None:
     assert device_info.adp_token not in s
     assert "adp_token" not in s
     assert "adp_token" not in s
+
+
+def test_client_warm_up(mocker: MockerFixture, device_info: model.DeviceInfo) -> None:
+    """Test that warm_up pre-connects to stkservice and the last upload host."""
+    transport = mocker.Mock(spec=Transport)
+    Client(device_info).warm_up()  # no-op without a transport
+    c = Client(device_info, transport)
+    c.warm_up()
+    transport.warm_up.assert_called_once_with(["https://stkservice.amazon.com/"], background=False)
+    c._upload_url = "https://upload.example.com/x"
+    c.warm_up(background=True)
+    transport.warm_up.assert_called_with(
+        ["https://stkservice.amazon.com/", "https://upload.example.com/x"], background=True
+    )
+
+
+def test_client_send_file_lease(
+    mocker: MockerFixture, tmp_path: Path, device_info: model.DeviceInfo
+) -> None:
+    """Test that send_file uses a valid lease and replaces a stale or mismatched one."""
+    upload = model.GetUploadUrlResponse(60000, 0, "fresh_token", "fresh_url")
+    get_upload_url = mocker.patch("stkclient.api.get_upload_url", return_value=upload)
+    upload_file = mocker.patch("stkclient.api.upload_file")
+    send_to_kindle = mocker.patch(
+        "stkclient.api.send_to_kindle", return_value=model.SendToKindleResponse("sku", 0)
+    )
+    path = tmp_path / "test_file.txt"
+    path.write_bytes(b"data")
+    c = Client(device_info)
+
+    before = time.monotonic()
+    lease = c.get_upload_lease(4)
+    assert (lease.upload, lease.file_size) == (upload, 4)
+    assert before + 60 <= lease.expires_at <= time.monotonic() + 60
+    assert not lease.expired(margin=10.0)
+    assert lease.expired(margin=60.0, clock=lambda: lease.expires_at - 59.0)
+    get_upload_url.reset_mock()
+
+    now = time.monotonic()
+    prefetched = model.UploadLease(
+        model.GetUploadUrlResponse(60000, 0, "lease_token", "lease_url"), 4, now + 60.0
+    )
+    stale = model.UploadLease(prefetched.upload, 4, now)
+    wrong_size = model.UploadLease(prefetched.upload, 5, now + 60.0)
+    for lease, token in [
+        (prefetched, "lease_token"),
+        (stale, "fresh_token"),
+        (wrong_size, "fresh_token"),
+    ]:
+        c.send_file(path, ["device"], author="a", title="t", format="txt", lease=lease)
+        assert send_to_kindle.call_args.args[1] == token
+        assert upload_file.call_args.args[0] == token.replace("token", "url")
+    assert get_upload_url.call_count == 2
+
+
+def test_client_send_file_preflight(
+    mocker: MockerFixture, tmp_path: Path, device_info: model.DeviceInfo
+) -> None:
+    """Check that files the service would reject fail before any request is made."""
+    get_upload_url = mocker.patch("stkclient.api.get_upload_url")
+    c = Client(device_info)
+    mobi = tmp_path / "book.mobi"
+    mobi.write_bytes(bytes(60) + b"BOOKMOBI" + bytes(100))
+    pdf = tmp_path / "book.pdf"
+    pdf.write_bytes(b"%PDF-1.7\n" + bytes(100))
+    for path, format, policy in [
+        (mobi, None, Policy(formats=frozenset(["pdf"]))),
+        (pdf, "epub", DEFAULT_POLICY),
+        (pdf, None, Policy(max_size=100)),
+    ]:
+        with pytest.raises(PreflightError):
+            c.send_file(path, ["d"], author="a", title="t", format=format, policy=policy)
+    with pytest.raises(ValueError, match="format is required"):
+        c.send_file(pdf, ["d"], author="a", title="t", policy=None)
+    get_upload_url.assert_not_called()
+
+
+def test_client_send_file_minimize(
+    real_network: None, tmp_path: Path, device_info: model.DeviceInfo
+) -> None:
+    """Check that an EPUB is uploaded minimized and the savings are reported."""
+    book = tmp_path / "book.epub"
+    with zipfile.ZipFile(book, "w") as z:
+        z.writestr("mimetype", "application/epub+zip")
+        z.writestr("chapter.xhtml", "<p>All work and no play.</p>" * 1000)
+    notes = tmp_path / "notes.txt"
+    notes.write_text("All work and no play." * 1000)
+    reports: List[MinimizeReport] = []
+    minimizer = Minimizer(tmp_path / "cache", on_report=reports.append)
+    with StandInServer() as server:
+        c = Client(device_info, server.transport())
+        c.send_file(book, ["d"], author="a", title="t", minimizer=minimizer)
+        c.send_file(notes, ["d"], author="a", title="t", minimizer=minimizer)
+        c.transport.close()  # type: ignore[union-attr]
+    [report] = reports
+    assert report.source == book and report.upload_seconds is not None
+    assert server.bytes_uploaded == report.size + notes.stat().st_size
+
+
+def test_client_send_from_url(
+    source_server: str, source_document: bytes, device_info: model.DeviceInfo
+) -> None:
+    """Check that documents are relayed or spooled from a source into the upload."""
+    source_transport = PooledTransport()
+    with StandInServer() as server:
+        c = Client(device_info, server.transport())
+        for path in ("book.pdf", "stream.pdf"):
+            sku = c.send_from_url(
+                f"{source_server}/{path}",
+                ["d"],
+                author="a",
+                title="t",
+                source_transport=source_transport,
+            )
+            assert sku.startswith("sku-")
+        with pytest.raises(PreflightError):
+            c.send_from_url(
+                f"{source_server}/book.pdf",
+                ["d"],
+                author="a",
+                title="t",
+                format="epub",
+                source_transport=source_transport,
+            )
+        with pytest.raises(SourceError):
+            c.send_from_url(
+                f"{source_server}/short.pdf",
+                ["d"],
+                author="a",
+                title="t",
+                source_transport=source_transport,
+            )
+        c.transport.close()  # type: ignore[union-attr]
+    source_transport.close()
+    assert server.bytes_uploaded == 2 * len(source_document)
+    assert server.requests["/SendToKindle"] == 2
+
+
+def test_client_shared_between_threads(
+    real_network: None, tmp_path: Path, device_info: model.DeviceInfo
+) -> None:
+    """Stress a single Client with hundreds of concurrent calls against a local stand-in."""
+    threads, calls = 16, 200
+    path = tmp_path / "book.pdf"
+    path.write_bytes(b"x" * 10000)
+    with StandInServer() as server:
+        pool = PooledTransport(per_thread=True)
+        c = Client(device_info, server.transport(pool))
+
+        def call(i: int) -> str:
+            if i % 2:
+                return c.get_owned_devices()[0].device_serial_number
+            return c.send_file(path, ["STANDIN0000000001"], author="a", title=str(i), format="pdf")
+
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            results = list(executor.map(call, range(calls)))
+        pool.close()
+    skus = results[::2]
+    assert len(set(skus)) == calls // 2
+    assert all(sku.startswith("sku-standin") for sku in skus)
+    assert set(results[1::2]) == {"STANDIN0000000001"}
+    assert server.requests == {
+        "/GetListOfOwnedDevices": calls // 2,
+        "/GetUploadUrl": calls // 2,
+        "/upload": calls // 2,
+        "/SendToKindle": calls // 2,
+    }
+    assert server.bytes_uploaded == 10000 * calls // 2
+    # At most one connection per thread, plus one per thread opened by background warm-ups
+    assert pool.connections_opened <= 2 * threads
+
+
+def test_client_send_file_drain(
+    real_network: None, tmp_path: Path, device_info: model.DeviceInfo
+) -> None:
+    """Check that draining finishes a send that is uploading but starts no new one."""
+    path = tmp_path / "book.pdf"
+    path.write_bytes(b"x" * 100000)
+    token = CancelToken()
+
+    def progress(p: Progress) -> None:
+        token.drain()
+
+    with StandInServer() as server:
+        c = Client(device_info, server.transport())
+        sku = c.send_file(
+            path, ["d"], author="a", title="t", format="pdf", progress=progress, cancel=token
+        )
+        assert sku.startswith("sku-")
+        with pytest.raises(CancelledError):
+            c.send_file(path, ["d"], author="a", title="t", format="pdf", cancel=token)
+        assert c.get_owned_devices(cancel=token)  # Draining only stops new sends
+        token.cancel()
+        with pytest.raises(CancelledError):
+            c.get_owned_devices(cancel=token)
+        c.transport.close()  # type: ignore[union-attr]
+    assert server.requests == {
+        "/GetUploadUrl": 1,
+        "/upload": 1,
+        "/SendToKindle": 1,
+        "/GetListOfOwnedDevices": 1,
+    }
+
+
+def test_client_send_file_deadline(
+    real_network: None, tmp_path: Path, device_info: model.DeviceInfo
+) -> None:
+    """Check that a deadline passing mid-upload stops the upload and the send."""
+    path = tmp_path / "book.pdf"
+    path.write_bytes(b"x" * 600 * 1024)
+
+    def progress(p: Progress) -> None:
+        time.sleep(0.2)  # Reported every 256 KiB, so about 1.25 MiB/s
+
+    with StandInServer() as server:
+        c = Client(device_info, server.transport())
+        assert c.send_file(path, ["d"], author="a", title="t", format="pdf")
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            c.send_file(
+                path, ["d"], author="a", title="t", format="pdf", progress=progress, deadline=0.3
+            )
+        assert time.monotonic() - start < 0.6  # Without the deadline, the upload takes 0.6s
+        c.transport.close()  # type: ignore[union-attr]
+    assert server.requests == {"/GetUploadUrl": 2, "/upload": 1, "/SendToKindle": 1}
+    assert server.bytes_uploaded == path.stat().st_size
+    # Uploads to every presigned URL of a host share one latency tracker
+    assert [k for k in timeouts._trackers if k.startswith(standin.UPLOAD_HOST)] == [
+        standin.UPLOAD_HOST
+    ]
@@ -0,0 +1,224 @@
+"""Tests for the stkclient.epub module."""
+import io
+import os
+import time
+import zipfile
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from stkclient.epub import Minimizer, MinimizeReport, Options
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>"""
+
+OPF = """<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <metadata/>
+  <manifest>
+    <item id="ch1" href="ch1.xhtml" media-type="application/xhtml+xml"/>
+    <item id="css" href="style.css" media-type="text/css"/>
+    <item id="cover" href="img/cover.png" media-type="image/png" properties="cover-image"/>
+    <item id="fig" href="img/fig.png" media-type="image/png"/>
+    <item id="orphan" href="img/orphan.png" media-type="image/png"></item>
+    <item id="serif" href="fonts/serif.otf" media-type="application/vnd.ms-opentype"/>
+    <item id="sans" href="fonts/sans.woff" media-type="font/woff"/>
+  </manifest>
+  <spine><itemref idref="ch1"/></spine>
+</package>"""
+
+
+def _write_epub(path: Path, compression: int = zipfile.ZIP_STORED) -> None:
+    entries = {
+        "mimetype": b"application/epub+zip",
+        "META-INF/container.xml": CONTAINER.encode(),
+        "OEBPS/content.opf": OPF.encode(),
+        "OEBPS/ch1.xhtml": b'<html><body><img src="img/fig.png"/>' + b"<p>text</p>" * 2000,
+        "OEBPS/style.css": b"@font-face { src: url(fonts/sans.woff); }",
+        "OEBPS/img/cover.png": b"cover",
+        "OEBPS/img/fig.png": b"fig",
+        "OEBPS/img/orphan.png": b"orphan" * 100,
+        "OEBPS/fonts/serif.otf": b"serif" * 1000,
+        "OEBPS/fonts/sans.woff": b"sans",
+    }
+    with zipfile.ZipFile(path, "w", compression) as z:
+        for name, data in entries.items():
+            z.writestr(name, data)
+
+
+def test_minimize(tmp_path: Path) -> None:
+    """Check that entries are recompressed and unused resources dropped from zip and manifest."""
+    book = tmp_path / "book.epub"
+    _write_epub(book)
+    report = Minimizer(tmp_path / "cache").minimize(book)
+    assert report.path.parent == tmp_path / "cache"
+    assert report.size == report.path.stat().st_size < report.original_size
+    assert report.bytes_saved > 20000
+    assert not report.cached and report.upload_seconds_saved is None
+    assert report.dropped == ("OEBPS/fonts/serif.otf", "OEBPS/img/orphan.png")
+    with zipfile.ZipFile(report.path) as z:
+        infos = z.infolist()
+        assert infos[0].filename == "mimetype"
+        assert infos[0].compress_type == zipfile.ZIP_STORED
+        names = {i.filename for i in infos}
+        assert names == {
+            "mimetype",
+            "META-INF/container.xml",
+            "OEBPS/content.opf",
+            "OEBPS/ch1.xhtml",
+            "OEBPS/style.css",
+            "OEBPS/img/cover.png",
+            "OEBPS/img/fig.png",
+            "OEBPS/fonts/sans.woff",
+        }
+        assert z.getinfo("OEBPS/ch1.xhtml").compress_type == zipfile.ZIP_DEFLATED
+        assert z.read("OEBPS/img/fig.png") == b"fig"
+        opf = z.read("OEBPS/content.opf").decode()
+    assert 'id="orphan"' not in opf and 'id="serif"' not in opf
+    assert opf.count("<item ") == 5
+
+
+def test_minimize_cache(tmp_path: Path) -> None:
+    """Check that results are cached by content, including files that can't be shrunk."""
+    book = tmp_path / "book.epub"
+    _write_epub(book)
+    m = Minimizer(tmp_path / "cache")
+    first = m.minimize(book)
+    copy = tmp_path / "copy.epub"
+    copy.write_bytes(book.read_bytes())
+    second = m.minimize(copy)
+    assert second.cached and second.path == first.path and second.source == copy
+    assert not Minimizer(tmp_path / "cache", Options(jpeg_quality=50)).minimize(book).cached
+
+    # Minimizing a minimized file doesn't help, and that is cached too
+    again = m.minimize(first.path)
+    assert (again.path, again.bytes_saved, again.cached) == (first.path, 0, False)
+    assert m.minimize(first.path).cached
+
+    not_zip = tmp_path / "book2.epub"
+    not_zip.write_bytes(b"not a zip")
+    report = m.minimize(not_zip)
+    assert (report.path, report.bytes_saved) == (not_zip, 0)
+    assert sorted(p.suffix for p in (tmp_path / "cache").iterdir()) == [
+        ".epub",
+        ".epub",
+        ".unchanged",
+    ]
+
+
+def test_minimize_cache_eviction(tmp_path: Path) -> None:
+    """Check that the least recently used results are evicted past the size and age limits."""
+    cache = tmp_path / "cache"
+    books = []
+    for i in range(3):
+        book = tmp_path / f"book{i}.epub"
+        _write_epub(book)
+        with zipfile.ZipFile(book, "a") as z:
+            z.writestr(f"OEBPS/extra{i}.txt", str(i))
+        books.append(book)
+    m = Minimizer(cache)
+    first = m.minimize(books[0])
+    size = first.size
+    second = m.minimize(books[1])
+    past = time.time() - 60
+    os.utime(first.path, (past, past))
+    os.utime(second.path, (past - 60, past - 60))
+    assert m.minimize(books[0]).cached  # Using a result makes it the most recent
+
+    m.max_cache_size = 2 * size + 100
+    third = m.minimize(books[2])
+    assert sorted(cache.iterdir()) == sorted([first.path, third.path])
+
+    # Minimizing a minimized file stores an .unchanged marker, evicting the expired first result
+    os.utime(first.path, (past, past))
+    m.max_cache_age = 30
+    m.minimize(third.path)
+    assert sorted(p.suffix for p in cache.iterdir()) == [".epub", ".unchanged"]
+    assert third.path.exists()
+
+
+def test_minimize_encoded_href(tmp_path: Path) -> None:
+    """Check that references are resolved against their entry, not matched by basename."""
+    book = tmp_path / "book.epub"
+    opf = OPF.replace("img/fig.png", "img/fig%201.png").replace("ch1.xhtml", "text/ch1.xhtml")
+    entries = {
+        "mimetype": b"application/epub+zip",
+        "META-INF/container.xml": CONTAINER.encode(),
+        "OEBPS/content.opf": opf.encode(),
+        # orphan.png is only named in the text, and sans.woff from the wrong directory
+        "OEBPS/text/ch1.xhtml": b'<img src="../img/fig%201.png"/><p>orphan.png</p>' * 500,
+        "OEBPS/style.css": b"@font-face { src: url('../fonts/sans.woff'); }",
+        "OEBPS/img/cover.png": b"cover",
+        "OEBPS/img/fig 1.png": b"fig",
+        "OEBPS/img/orphan.png": b"orphan",
+        "OEBPS/fonts/serif.otf": b"serif",
+        "OEBPS/fonts/sans.woff": b"sans",
+    }
+    with zipfile.ZipFile(book, "w") as z:
+        for name, data in entries.items():
+            z.writestr(name, data)
+    report = Minimizer(tmp_path / "cache").minimize(book)
+    assert report.dropped == (
+        "OEBPS/fonts/sans.woff",
+        "OEBPS/fonts/serif.otf",
+        "OEBPS/img/orphan.png",
+    )
+    with zipfile.ZipFile(report.path) as z:
+        assert z.read("OEBPS/img/fig 1.png") == b"fig"
+
+
+def test_minimize_unsupported_compression(tmp_path: Path) -> None:
+    """Check that an EPUB compressed with a method zipfile can't read is sent as it is."""
+    book = tmp_path / "book.epub"
+    _write_epub(book)
+    data = bytearray(book.read_bytes())
+    # Mark every entry as compressed with method 99 (AES), in local and central headers
+    for signature, offset in ((b"PK\x03\x04", 8), (b"PK\x01\x02", 10)):
+        start = data.find(signature)
+        while start != -1:
+            data[start + offset : start + offset + 2] = (99).to_bytes(2, "little")
+            start = data.find(signature, start + 4)
+    book.write_bytes(bytes(data))
+    report = Minimizer(tmp_path / "cache").minimize(book)
+    assert (report.path, report.bytes_saved) == (book, 0)
+
+
+def test_minimize_keep_unused(tmp_path: Path) -> None:
+    """Check that drop_unused=False keeps every entry."""
+    book = tmp_path / "book.epub"
+    _write_epub(book)
+    report = Minimizer(tmp_path / "cache", Options(drop_unused=False)).minimize(book)
+    assert report.dropped == ()
+    with zipfile.ZipFile(report.path) as z:
+        assert len(z.infolist()) == 10
+
+
+def test_minimize_images(tmp_path: Path) -> None:
+    """Check that images larger than max_image_size are downscaled."""
+    image_module = pytest.importorskip("PIL.Image")
+    buf = io.BytesIO()
+    image_module.new("RGB", (3000, 2000), (200, 10, 10)).save(buf, "PNG")
+    book = tmp_path / "book.epub"
+    with zipfile.ZipFile(book, "w") as z:
+        z.writestr("mimetype", "application/epub+zip")
+        z.writestr("img/big.png", buf.getvalue())
+        z.writestr("img/small.png", b"not decoded")
+    report = Minimizer(tmp_path / "cache", Options(max_image_size=(600, 800))).minimize(book)
+    with zipfile.ZipFile(report.path) as z:
+        with image_module.open(io.BytesIO(z.read("img/big.png"))) as image:
+            assert (image.width, image.height) == (600, 400)
+        assert z.read("img/small.png") == b"not decoded"
+
+
+def test_report_upload_seconds_saved() -> None:
+    """Check the estimate of upload time saved."""
+    report = MinimizeReport(Path("a"), Path("b"), 3000, 1000, False, upload_seconds=2.0)
+    assert report.upload_seconds_saved == 4.0
+    reports: List[MinimizeReport] = []
+    Minimizer(Path("unused"), on_report=reports.append).report(report)
+    assert reports == [report]
@@ -0,0 +1,118 @@
+"""Tests for the stkclient.formats module."""
+import io
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from stkclient.formats import (
+    DEFAULT_POLICY,
+    Policy,
+    PreflightError,
+    normalize,
+    sniff,
+    sniff_file,
+)
+
+
+def _zip(*names: str) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        for name in names:
+            data = b"application/epub+zip" if name == "mimetype" else b"<xml/>"
+            z.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        (b"%PDF-1.4\n%\xe2\xe3\xcf\xd3", "pdf"),
+        (_zip("mimetype", "META-INF/container.xml"), "epub"),
+        (_zip("[Content_Types].xml", "_rels/.rels", "word/document.xml"), "docx"),
+        (_zip("readme.txt"), None),
+        (b"Title".ljust(60, b"\x00") + b"BOOKMOBI" + bytes(10), "mobi"),
+        (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + bytes(100), "doc"),
+        (b"{\\rtf1\\ansi hello}", "rtf"),
+        (b"\x89PNG\r\n\x1a\n" + bytes(20), "png"),
+        (b"GIF89a" + bytes(20), "gif"),
+        (b"\xff\xd8\xff\xe0" + bytes(20), "jpeg"),
+        (b"BM" + bytes(12) + b"\x28" + bytes(20), "bmp"),
+        (b"\xef\xbb\xbf  <!DOCTYPE html><html></html>", "html"),
+        (b"<HTML><body>hi</body></HTML>", "html"),
+        ("Café au lait\n".encode() * 10 + b"\xc3", "txt"),
+        (b"\x00\x01\x02\x03", None),
+        (b"\xff\xfe\xfd", None),
+        (b"", "txt"),
+    ],
+)
+def test_sniff(header: bytes, expected: str) -> None:
+    """Check format detection from the first bytes of a file."""
+    assert sniff(header) == expected
+
+
+def test_sniff_file_reads_header_only(tmp_path: Path) -> None:
+    """Check that sniffing a large file reads only its start."""
+    path = tmp_path / "big.pdf"
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.7\n")
+        f.truncate(1024 * 1024 * 1024)
+    assert sniff_file(path) == "pdf"
+
+
+def test_sniff_file_zip_directory(tmp_path: Path) -> None:
+    """Check that archives whose identifying entries come late are recognized by their names."""
+    path = tmp_path / "report"
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("[Content_Types].xml", b"<Types/>")
+        z.writestr("docProps/thumbnail.jpeg", bytes(range(256)) * 64)
+        z.writestr("word/document.xml", b"<w:document/>")
+    assert sniff(path.read_bytes()[:4096]) is None
+    assert sniff_file(path) == "docx"
+    assert DEFAULT_POLICY.check(path) == "docx"
+    path.write_bytes(_zip("readme.txt"))
+    assert sniff_file(path) is None
+
+
+def test_normalize() -> None:
+    """Check format name aliases."""
+    assert [normalize(f) for f in ("JPG", ".htm", "azw", "EPUB")] == [
+        "jpeg",
+        "html",
+        "mobi",
+        "epub",
+    ]
+
+
+def test_policy_check(tmp_path: Path) -> None:
+    """Check the outcome of each pre-flight check."""
+    pdf = tmp_path / "book.pdf"
+    pdf.write_bytes(b"%PDF-1.7\n" + bytes(100))
+    text = tmp_path / "notes"
+    text.write_text("notes")
+    binary = tmp_path / "blob"
+    binary.write_bytes(bytes(100))
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+    mobi = tmp_path / "book.azw"
+    mobi.write_bytes(bytes(60) + b"BOOKMOBI" + bytes(100))
+
+    assert DEFAULT_POLICY.check(pdf) == "pdf"
+    assert DEFAULT_POLICY.check(pdf, "PDF") == "PDF"
+    assert DEFAULT_POLICY.check(text) == "txt"
+    assert DEFAULT_POLICY.check(text, "html") == "html"  # text doesn't contradict a declaration
+    assert DEFAULT_POLICY.check(binary, "docx") == "docx"  # unknown content is trusted
+    assert DEFAULT_POLICY.check(mobi) == "mobi"
+    assert DEFAULT_POLICY.check(binary, "azw") == "azw"
+    assert DEFAULT_POLICY.check(mobi, "azw3") == "azw3"
+    assert DEFAULT_POLICY.check(binary, "doc") == "doc"
+    for path, format, policy, message in [
+        (pdf, "epub", DEFAULT_POLICY, "declared as epub but looks like pdf"),
+        (pdf, None, Policy(max_size=100), "more than the limit of 100"),
+        (pdf, None, Policy(formats=frozenset(["epub"])), "pdf files can't be sent"),
+        (binary, None, DEFAULT_POLICY, "Could not detect"),
+        (binary, "mobi", Policy(formats=frozenset(["pdf"])), "mobi files can't be sent"),
+        (empty, "txt", DEFAULT_POLICY, "is empty"),
+    ]:
+        with pytest.raises(PreflightError, match=message):
+            policy.check(path, format)
@@ -0,0 +1,176 @@
+"""Test cases for the httplog module."""
+
+import importlib
+import io
+import json
+import logging
+from typing import Any, Generator, List, Mapping, Tuple
+from unittest.mock import Mock
+
+import httpretty
+import pytest
+from pytest_mock import MockerFixture
+
+from stkclient import api, httplog
+from stkclient.ratelimit import RateLimiter
+from stkclient.signer import Signer
+
+
+class _Records(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+@pytest.fixture()
+def records() -> Generator[List[logging.LogRecord], None, None]:
+    """Collects the records logged to stkclient.http, and turns logging off afterwards."""
+    handler = _Records()
+    httplog.logger.addHandler(handler)
+    yield handler.records
+    httplog.logger.removeHandler(handler)
+    httplog.configure(0)
+
+
+@pytest.fixture()
+def signer() -> Signer:
+    """Fixture provides a mock implementation of the Signer class."""
+    m = Mock(spec=Signer)
+    m.adp_token = "test_adp_token"  # noqa S105
+    m.digest_header_for_request.return_value = "test_signature"
+    return m
+
+
+def _register_throttled_upload_url() -> None:
+    statuses = [429, 200]
+
+    def request_callback(
+        request: httpretty.core.HTTPrettyRequest, uri: str, response_headers: Mapping[str, Any]
+    ) -> Tuple[int, Mapping[str, Any], str]:
+        status = statuses.pop(0)
+        headers = {**response_headers, "x-amzn-RequestId": f"req-{status}"}
+        if status != 200:
+            return status, {**headers, "Retry-After": "1"}, "slow down"
+        body = {"expiryTime": 60000, "statusCode": 0, "stkToken": "t", "uploadUrl": "u"}
+        return 200, headers, json.dumps(body)
+
+    httpretty.register_uri(
+        httpretty.POST, "https://stkservice.amazon.com/GetUploadUrl", body=request_callback
+    )
+
+
+def test_redact_headers() -> None:
+    """Check that credentials are redacted, whatever their case."""
+    headers = {
+        "X-ADP-Request-Digest": "digest",
+        "x-adp-authentication-token": "token",
+        "Authorization": "Bearer token",
+        "X-Amz-Security-Token": "token",
+        "Content-Type": "application/json",
+    }
+    assert httplog.redact_headers(headers) == {
+        "X-ADP-Request-Digest": httplog.REDACTED,
+        "x-adp-authentication-token": httplog.REDACTED,
+        "Authorization": httplog.REDACTED,
+        "X-Amz-Security-Token": httplog.REDACTED,
+        "Content-Type": "application/json",
+    }
+
+
+def test_log_request_info(
+    signer: Mock, rate_limiter: RateLimiter, records: List[logging.LogRecord]
+) -> None:
+    """Check that each attempt is logged at INFO without headers."""
+    out = io.StringIO()
+    httplog.configure(1, out)
+    _register_throttled_upload_url()
+    api.get_upload_url(signer, 100)
+    assert [r.levelno for r in records] == [logging.INFO, logging.INFO]
+    first, second = (r.http for r in records)  # type: ignore[attr-defined]
+    assert first["endpoint"] == "stkservice.amazon.com/GetUploadUrl"
+    assert (first["status"], first["attempt"], first["bytes_received"]) == (429, 0, 9)
+    assert (second["status"], second["attempt"], second["error"]) == (200, 1, None)
+    assert second["bytes_sent"] > 0
+    assert second["total"] >= second["response"] + second["read"] >= 0
+    assert "request_headers" not in second
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 2
+    assert "POST stkservice.amazon.com/GetUploadUrl 429" in lines[0]
+
+
+def test_log_request_debug(
+    signer: Mock, rate_limiter: RateLimiter, records: List[logging.LogRecord]
+) -> None:
+    """Check that DEBUG records carry redacted headers, and no credentials reach the output."""
+    out = io.StringIO()
+    httplog.configure(2, out)
+    _register_throttled_upload_url()
+    api.get_upload_url(signer, 100)
+    record = records[-1].http  # type: ignore[attr-defined]
+    assert records[-1].levelno == logging.DEBUG
+    assert record["request_headers"]["X-ADP-Authentication-Token"] == httplog.REDACTED
+    assert record["request_headers"]["Content-Type"] == "application/json"
+    assert record["response_headers"]["x-amzn-RequestId"] == "req-200"
+    assert "test_adp_token" not in out.getvalue()
+    assert "test_signature" not in out.getvalue()
+
+
+def test_log_request_error(rate_limiter: RateLimiter, records: List[logging.LogRecord]) -> None:
+    """Check that attempts which fail without a response are logged with their error."""
+    httplog.configure(1, io.StringIO())
+    transport = Mock()
+    transport.request.side_effect = OSError("unreachable")
+    with pytest.raises(OSError):
+        api.upload_file("https://upload.example.com/x", 3, io.BytesIO(b"abc"), transport=transport)
+    assert len(records) == 1  # Errors other than network ones are not retried
+    record = records[0].http  # type: ignore[attr-defined]
+    assert record["status"] is None
+    assert record["error"] == "OSError: unreachable"
+    assert record["bytes_sent"] == 3
+
+
+def test_disabled(signer: Mock, mocker: MockerFixture, records: List[logging.LogRecord]) -> None:
+    """Check that no record is built while logging is off."""
+    httplog.configure(0)
+    log_request = mocker.spy(httplog, "log_request")
+    _register_throttled_upload_url()
+    api.get_upload_url(signer, 100)
+    assert log_request.call_count == 0
+    assert records == []
+
+
+def test_silent_by_default(records: List[logging.LogRecord]) -> None:
+    """Check that only the logger's own level turns logging on, and import leaves it alone."""
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(logging.INFO)
+    try:
+        httplog.configure(0)
+        assert not httplog.enabled()
+        httplog.configure(1, io.StringIO())
+        assert httplog.enabled()
+        httplog.configure(0)
+        httplog.logger.setLevel(logging.ERROR)
+        importlib.reload(httplog)
+        assert httplog.logger.level == logging.ERROR
+        httplog.logger.setLevel(logging.INFO)  # Set by the application
+        assert httplog.enabled()
+    finally:
+        root.setLevel(level)
+
+
+def test_configure_from_env(records: List[logging.LogRecord]) -> None:
+    """Check the values accepted by STKCLIENT_HTTP_LOG."""
+    httplog.configure_from_env({})
+    assert not httplog.enabled()
+    httplog.configure_from_env({httplog.ENV_VAR: "debug"})
+    assert httplog.logger.isEnabledFor(logging.DEBUG)
+    httplog.configure_from_env({httplog.ENV_VAR: "1"})
+    assert httplog.enabled() and not httplog.logger.isEnabledFor(logging.DEBUG)
+    with pytest.warns(UserWarning, match="STKCLIENT_HTTP_LOG"):
+        httplog.configure_from_env({httplog.ENV_VAR: "loud"})
+    httplog.configure_from_env({httplog.ENV_VAR: "0"})
+    assert not httplog.enabled()
@@ -0,0 +1,47 @@
+"""Unit tests of stkclient.loadtest."""
+
+import random
+from typing import List
+
+import pytest
+
+from stkclient import Client, loadtest, model
+
+
+def test_size_distributions() -> None:
+    """Check that the size distributions stay in range and are repeatable."""
+    rng = random.Random(1)  # noqa: S311
+    assert loadtest.fixed(10)(rng) == 10
+    assert all(5 <= loadtest.uniform(5, 7)(rng) <= 7 for _ in range(100))
+    lognormal = loadtest.lognormal(1000, 1.0)
+
+    def sample() -> List[int]:
+        rng = random.Random(2)  # noqa: S311
+        return sorted(lognormal(rng) for _ in range(1001))
+
+    sizes = sample()
+    assert 800 < sizes[500] < 1250
+    assert sizes[-1] > 5 * sizes[500]
+    assert sizes == sample()
+
+
+def test_run_drain_timeout(real_network: None, device_info: model.DeviceInfo) -> None:
+    """Check that sends still queued after the drain timeout are cancelled and reported."""
+    report = loadtest.run(
+        Client(device_info),
+        rate=200.0,
+        duration=0.2,
+        sizes=loadtest.fixed(1024),
+        concurrency=1,
+        service_latency=0.05,
+        drain_timeout=0.0,
+        seed=1,
+    )
+    assert report.arrivals == report.completed + report.failed + report.unfinished
+    assert report.unfinished > 0
+    assert report.failed == 0
+    assert report.bytes_sent == 1024 * report.completed
+    assert report.phases[0].phase == "queue"
+    assert "unfinished" in report.format()
+    with pytest.raises(ValueError):
+        loadtest.run(Client(device_info), rate=0, duration=1, sizes=loadtest.fixed(1))
@@ -1,11 +1,18 @@
 """Test cases for the __main__ module."""
+import argparse
+import io
+import json
+import pstats
 from pathlib import Path
+from typing import Any, List
 
+import httpretty
 import pytest
 from pytest_mock import MockerFixture
 
 import stkclient
-from stkclient.__main__ import main
+from stkclient import httplog
+from stkclient.__main__ import _parse_rate, _ProgressBar, main
 from stkclient.model import DeviceInfo
 
 
@@ -28,3 +35,250 @@ def test_login(tmp_path: Path, mocker: MockerFixture, device_info: DeviceInfo) -
 
     # Unless passing -f
     main(["login", "--client", str(client_path), "-f"])
+
+
+def test_progress_bar() -> None:
+    """Test rendering of the send progress bar."""
+    out = io.StringIO()
+    bar = _ProgressBar(out, width=10)
+    bar(stkclient.Progress(512, 1024, 2048.0, 1024.0, 0.5))
+    bar(stkclient.Progress(1024, 1024, 2048.0, 1024.0, 0.0))
+    assert out.getvalue() == (
+        "\r[#####-----]  50% 512B/1.0KiB 2.0KiB/s (avg 1.0KiB/s) ETA 0s "
+        "\r[##########] 100% 1.0KiB/1.0KiB 2.0KiB/s (avg 1.0KiB/s) ETA 0s \n"
+    )
+
+
+def test_parse_rate() -> None:
+    """Check parsing of --limit-rate values."""
+    assert _parse_rate("500") == 500.0
+    assert _parse_rate("1.5k") == 1536.0
+    assert _parse_rate("2M") == 2 * 1024 * 1024
+    for value in ("", "fast", "0", "-1K"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            _parse_rate(value)
+
+
+def test_send_profile(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str], device_info: DeviceInfo
+) -> None:
+    """Check that --profile-dump prints a phase breakdown and writes cProfile statistics."""
+    client_path = tmp_path / "client.json"
+    with open(client_path, "w") as f:
+        stkclient.Client(device_info).dump(f)
+    book = tmp_path / "book.pdf"
+    book.write_bytes(b"data")
+    dump = tmp_path / "send.prof"
+    responses = {
+        "GetListOfOwnedDevices": {"ownedDevices": [], "statusCode": 0},
+        "GetUploadUrl": {
+            "expiryTime": 60000,
+            "statusCode": 0,
+            "stkToken": "token",
+            "uploadUrl": "https://upload.example.com/x",
+        },
+        "SendToKindle": {"sku": "sku", "statusCode": 0},
+    }
+    for name, body in responses.items():
+        httpretty.register_uri(
+            httpretty.POST, f"https://stkservice.amazon.com/{name}", body=json.dumps(body)
+        )
+    httpretty.register_uri(httpretty.PUT, "https://upload.example.com/x", body="")
+    args = ["--title", "t", "--author", "a", "--format", "pdf", str(book), "all"]
+    main(["--profile-dump", str(dump), "send", "--client", str(client_path), *args])
+    phases = [line.split()[0] for line in capsys.readouterr().err.splitlines()[1:]]
+    assert phases == [
+        "send",
+        "preflight",
+        "client",
+        "key",
+        "device",
+        "GetListOfOwnedDevices",
+        "sign",
+        "rate",
+        "GetUploadUrl",
+        "sign",
+        "rate",
+        "upload",
+        "rate",
+        "SendToKindle",
+        "sign",
+        "rate",
+    ]
+    assert pstats.Stats(str(dump)).total_calls > 0  # type: ignore[attr-defined]
+
+
+def test_verbose(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str], device_info: DeviceInfo
+) -> None:
+    """Check that -v logs each HTTP request to stderr without credentials."""
+    client_path = tmp_path / "client.json"
+    with open(client_path, "w") as f:
+        stkclient.Client(device_info).dump(f)
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://stkservice.amazon.com/GetListOfOwnedDevices",
+        body=json.dumps({"ownedDevices": [], "statusCode": 0}),
+    )
+    try:
+        main(["-vv", "devices", "--client", str(client_path)])
+    finally:
+        httplog.configure(0)
+    (line,) = capsys.readouterr().err.splitlines()
+    assert "stkclient.http POST stkservice.amazon.com/GetListOfOwnedDevices 200" in line
+    assert "'X-ADP-Authentication-Token': '<redacted>'" in line
+    assert device_info.adp_token not in line
+
+
+def test_send_preflight(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str], device_info: DeviceInfo
+) -> None:
+    """Check that send rejects an unsendable file before loading the client."""
+    book = tmp_path / "book.txt"
+    book.write_bytes(b"")
+    with pytest.raises(SystemExit) as e:
+        main(
+            [
+                "send",
+                "--client",
+                str(tmp_path / "missing.json"),
+                "--title",
+                "t",
+                "--author",
+                "a",
+                str(book),
+                "all",
+            ]
+        )
+    assert e.value.code == 1
+    assert capsys.readouterr() == ("", f"{book} is empty\n")
+
+
+def test_send_one(
+    tmp_path: Path,
+    mocker: MockerFixture,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+    device_info: DeviceInfo,
+) -> None:
+    """Check the legacy form, which sends a single file quietly and keeps literal braces."""
+    client_path = tmp_path / "client.json"
+    with open(client_path, "w") as f:
+        stkclient.Client(device_info).dump(f)
+    book = tmp_path / "notes.txt"
+    book.write_text("notes")
+    other = tmp_path / "other.txt"
+    other.write_text("other")
+    send_file = mocker.patch.object(stkclient.Client, "send_file", return_value="sku")
+    args = ["send", "--client", str(client_path), "--author", "{me}"]
+    main([*args, "--title", "{stem} {draft}", str(book), "K1", "K2"])
+    assert send_file.call_args.args == (book, ["K1", "K2"])
+    assert send_file.call_args.kwargs["policy"] is None  # Checked once, before loading the client
+    assert (send_file.call_args.kwargs["title"], send_file.call_args.kwargs["author"]) == (
+        "notes {draft}",
+        "{me}",
+    )
+    assert capsys.readouterr() == ("", "")
+    (tmp_path / "K1").write_text("a file named like a device")
+    with monkeypatch.context() as m:
+        m.chdir(tmp_path)
+        main([*args, "notes.txt", "K1"])
+    assert send_file.call_args.args == (Path("notes.txt"), ["K1"])
+    for files in (["notes.txt", "other.txt"], [str(book), str(other)], ["*.txt", "K1"]):
+        with pytest.raises(SystemExit) as e:
+            main([*args, *files])
+        assert e.value.code == 2
+        assert "--target" in capsys.readouterr().err
+    assert send_file.call_count == 2
+
+
+def test_send_many(
+    tmp_path: Path,
+    mocker: MockerFixture,
+    capsys: pytest.CaptureFixture[str],
+    device_info: DeviceInfo,
+) -> None:
+    """Check a concurrent send of globbed files with templated titles and a partial failure."""
+    client_path = tmp_path / "client.json"
+    with open(client_path, "w") as f:
+        stkclient.Client(device_info).dump(f)
+    for name in ("a.txt", "b.txt", "c.txt"):
+        (tmp_path / name).write_text(f"contents of {name}")
+    (tmp_path / "empty.txt").write_text("")
+    devices = mocker.patch.object(
+        stkclient.Client,
+        "get_owned_devices",
+        return_value=[stkclient.OwnedDevice({}, "Kindle", serial) for serial in ("K1", "K2")],
+    )
+
+    def send_file(path: Path, target: List[str], **kwargs: Any) -> str:
+        assert target == ["K1", "K2"]
+        assert kwargs["title"] == f"{path.stem} by me" and kwargs["format"] == "txt"
+        assert kwargs["policy"] is None
+        if path.name == "b.txt":
+            raise stkclient.api.APIError("Rejected")
+        return f"sku-{path.stem}"
+
+    mocker.patch.object(stkclient.Client, "send_file", side_effect=send_file)
+    with pytest.raises(SystemExit) as e:
+        main(
+            [
+                "send",
+                "--client",
+                str(client_path),
+                "--title",
+                "{stem} by {author}",
+                "--author",
+                "me",
+                "-j",
+                "2",
+                "-t",
+                "all",
+                str(tmp_path / "*.txt"),
+            ]
+        )
+    assert e.value.code == 3
+    devices.assert_called_once()
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[-1] == "2 of 4 files sent"
+    assert sorted(line.split()[0] + " " + line.split()[-1] for line in lines[:-1]) == [
+        "error Rejected",
+        "error empty",
+        "sent sku-a",
+        "sent sku-c",
+    ]
+
+
+def test_bench_json(
+    real_network: None, tmp_path: Path, capsys: pytest.CaptureFixture[str], device_info: DeviceInfo
+) -> None:
+    """Check that the bench command prints JSON results of an offline run."""
+    client_path = tmp_path / "client.json"
+    with open(client_path, "w") as f:
+        stkclient.Client(device_info).dump(f)
+    main(["bench", "--client", str(client_path), "--offline", "--json", "--requests", "3"])
+    report = json.loads(capsys.readouterr().out)
+    assert report["offline"] is True
+    assert report["owned_devices_requests"] == 3
+    assert report["upload_bytes"] == 1024 * 1024
+    assert set(report["connections"][0]) == {"host", "dns", "tcp", "tls", "ttfb"}
+
+
+def test_loadtest(
+    real_network: None, tmp_path: Path, capsys: pytest.CaptureFixture[str], device_info: DeviceInfo
+) -> None:
+    """Check that the loadtest command reports every arrival and per-phase latency."""
+    client_path = tmp_path / "client.json"
+    with open(client_path, "w") as f:
+        stkclient.Client(device_info).dump(f)
+    args = ["--rate", "40", "--duration", "0.5", "--sizes", "uniform:1K:64K", "--seed", "3"]
+    main(["loadtest", "--client", str(client_path), *args, "--json"])
+    report = json.loads(capsys.readouterr().out)
+    assert report["arrivals"] > 0
+    assert report["completed"] == report["arrivals"]
+    assert report["error_rate"] == 0.0
+    phases = {p["phase"]: p for p in report["phases"]}
+    assert {"queue", "send", "send/GetUploadUrl", "send/upload", "send/SendToKindle"} <= set(phases)
+    assert phases["send"]["count"] == report["arrivals"]
+    with pytest.raises(SystemExit):
+        main(["loadtest", "--client", str(client_path), "--rate", "1", "--sizes", "normal:1M"])
@@ -0,0 +1,63 @@
+"""Unit tests of stkclient.model."""
+
+import copy
+import dataclasses
+import json
+import pickle  # noqa: S403
+
+import pytest
+
+from stkclient.model import GetOwnedDevicesResponse, OwnedDevice
+
+DEVICES = [
+    {
+        "deviceCapabilities": {"PDF_CONTENT_ENABLED": True, "WIFI_CAPABLE": True},
+        "deviceName": "Kindle",
+        "deviceSerialNumber": "A",
+    },
+    {
+        "deviceCapabilities": {"WIFI_CAPABLE": True, "PDF_CONTENT_ENABLED": True},
+        "deviceName": "Phone",
+        "deviceSerialNumber": "B",
+    },
+    {
+        "deviceCapabilities": {"PDF_CONTENT_ENABLED": False},
+        "deviceName": "Old Kindle",
+        "deviceSerialNumber": "C",
+    },
+]
+
+
+def test_owned_device_compact() -> None:
+    """Check that devices are slotted, frozen and share equal capability mappings."""
+    a, b, c = (OwnedDevice.from_dict(d) for d in DEVICES)
+    assert not hasattr(a, "__dict__")
+    assert a.device_capabilities is b.device_capabilities
+    assert a.device_capabilities == DEVICES[0]["deviceCapabilities"]
+    assert c.device_capabilities == {"PDF_CONTENT_ENABLED": False}
+    with pytest.raises(TypeError):
+        a.device_capabilities["WIFI_CAPABLE"] = False  # type: ignore[index]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        a.device_name = "x"  # type: ignore[misc]
+    assert a == OwnedDevice({"WIFI_CAPABLE": True, "PDF_CONTENT_ENABLED": True}, "Kindle", "A")
+    restored = pickle.loads(pickle.dumps(a))  # noqa: S301
+    assert restored == a
+    assert restored.device_capabilities is a.device_capabilities
+
+
+def test_owned_device_serializable() -> None:
+    """Check that shared capabilities serialize, copy and pickle like the plain dicts they were."""
+    res = GetOwnedDevicesResponse.from_dict({"ownedDevices": DEVICES, "statusCode": 0})
+    device = res.owned_devices[0]
+    assert dataclasses.asdict(device) == {
+        "device_capabilities": {"PDF_CONTENT_ENABLED": True, "WIFI_CAPABLE": True},
+        "device_name": "Kindle",
+        "device_serial_number": "A",
+    }
+    assert json.loads(json.dumps(device.device_capabilities)) == DEVICES[0]["deviceCapabilities"]
+    assert isinstance(device.device_capabilities, dict)
+    assert copy.deepcopy(res) == res
+    assert pickle.loads(pickle.dumps(res)) == res  # noqa: S301
+    assert dataclasses.asdict(res)["owned_devices"][2]["device_capabilities"] == {
+        "PDF_CONTENT_ENABLED": False
+    }
@@ -0,0 +1,37 @@
+"""Unit tests of stkclient.phases."""
+
+import threading
+
+from stkclient import phases
+
+
+def test_phase_timer() -> None:
+    """Check that phases are only timed with a timer installed, and nest per thread."""
+    with phases.phase("untimed"):
+        pass
+    timer = phases.PhaseTimer()
+    phases.set_phase_timer(timer)
+    try:
+        assert phases.phase_timer() is timer
+
+        def work() -> None:
+            with phases.phase("worker"):
+                pass
+
+        with phases.phase("outer"):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+            for _ in range(3):
+                with phases.phase("inner"):
+                    pass
+    finally:
+        phases.set_phase_timer(None)
+    stats = timer.stats()
+    assert [(s.path, s.calls) for s in stats] == [
+        (("outer",), 1),
+        (("worker",), 1),
+        (("outer", "inner"), 3),
+    ]
+    assert stats[0].seconds >= stats[2].seconds
+    assert (stats[2].name, stats[2].depth) == ("inner", 1)
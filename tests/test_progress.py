@@ -0,0 +1,50 @@
+"""Unit tests of stkclient.progress."""
+
+import io
+from typing import List
+
+from stkclient.progress import Progress, ProgressReader
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        """Starts the clock at zero."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Returns the current time."""
+        return self.now
+
+
+def test_progress_reader_reports() -> None:
+    """Check that reports are rate limited by byte count and include throughput."""
+    clock = FakeClock()
+    reports: List[Progress] = []
+    r = ProgressReader(io.BytesIO(b"x" * 100), 100, reports.append, every=40, clock=clock)
+    clock.now = 1.0
+    assert r.read(30) == b"x" * 30
+    assert reports == []
+    clock.now = 2.0
+    r.read(30)
+    assert reports == [Progress(60, 100, 30.0, 30.0, 40 / 30)]
+    clock.now = 4.0
+    r.read(30)
+    r.read(30)
+    assert r.read(30) == b""
+    assert reports[-1] == Progress(100, 100, 20.0, 25.0, 0.0)
+    assert reports[-1].fraction == 1.0
+    assert len(reports) == 2
+
+
+def test_progress_reader_seek() -> None:
+    """Check that rewinding the file rewinds progress."""
+    reports: List[Progress] = []
+    r = ProgressReader(io.BytesIO(b"abcdef"), 6, reports.append, every=1)
+    assert r.seekable()
+    r.read(4)
+    r.seek(0)
+    assert r.tell() == 0
+    assert r.read() == b"abcdef"
+    assert [p.bytes_sent for p in reports] == [4, 6]
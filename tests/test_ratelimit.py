@@ -0,0 +1,132 @@
+"""Unit tests of stkclient.ratelimit."""
+
+import asyncio
+import io
+from typing import List
+
+import pytest
+
+from stkclient.ratelimit import (
+    BandwidthLimiter,
+    RateLimiter,
+    ThrottledReader,
+    TokenBucket,
+    parse_retry_after,
+)
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        """Starts the clock at zero."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Returns the current time."""
+        return self.now
+
+
+def test_token_bucket_burst_then_wait() -> None:
+    """Check that a bucket allows a burst and then paces requests at its rate."""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, burst=2.0, clock=clock)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+    clock.now = 1.0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def test_token_bucket_invalid() -> None:
+    """Check that a bucket rejects non-positive parameters."""
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, burst=1)
+
+
+def test_rate_limiter_aimd() -> None:
+    """Check additive increase on success and multiplicative decrease on throttling."""
+    limiter = RateLimiter(rate=4.0, increase=1.0, decrease=0.5, min_rate=1.5, max_rate=5.5)
+    limiter.on_success("a")
+    assert limiter.rate("a") == 5.0
+    limiter.on_success("a")
+    assert limiter.rate("a") == 5.5
+    limiter.on_throttle("a")
+    assert limiter.rate("a") == 2.75
+    limiter.on_throttle("a")
+    limiter.on_throttle("a")
+    assert limiter.rate("a") == 1.5
+    assert limiter.rate("b") == 4.0
+
+
+def test_rate_limiter_retry_after_blocks_key() -> None:
+    """Check that Retry-After blocks only the throttled key until it elapses."""
+    clock = FakeClock()
+    slept: List[float] = []
+    limiter = RateLimiter(rate=100.0, burst=100.0, clock=clock, sleep=slept.append)
+    limiter.on_throttle("a", retry_after=3.0)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    assert slept == [3.0]
+    clock.now = 3.0
+    limiter.acquire("a")
+    assert slept == [3.0]
+
+
+def test_rate_limiter_backoff() -> None:
+    """Check that backoff is jittered, capped and honors Retry-After."""
+    limiter = RateLimiter(backoff_base=1.0, backoff_cap=4.0, rng=lambda: 0.5)
+    assert limiter.backoff(0) == 0.5
+    assert limiter.backoff(1) == 1.0
+    assert limiter.backoff(5) == 2.0
+    assert limiter.backoff(0, retry_after=7.0) == 7.0
+
+
+def test_rate_limiter_acquire_async() -> None:
+    """Check that async callers share the same buckets as threaded callers."""
+    clock = FakeClock()
+    limiter = RateLimiter(rate=1000.0, burst=1.0, clock=clock)
+    limiter.acquire("a")
+    asyncio.run(limiter.acquire_async("a"))
+    assert limiter.reserve("a") == pytest.approx(0.002)
+
+
+def test_parse_retry_after() -> None:
+    """Check parsing of both Retry-After formats."""
+    assert parse_retry_after(None) is None
+    assert parse_retry_after(" 12 ") == 12.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("garbage") is None
+
+
+def test_bandwidth_limiter() -> None:
+    """Check that the cap is enforced across readers and can be changed or removed."""
+    clock = FakeClock()
+    slept: List[float] = []
+    limiter = BandwidthLimiter(100_000.0, clock=clock, sleep=slept.append)
+    a = ThrottledReader(io.BytesIO(b"a" * 30_000), limiter)
+    b = ThrottledReader(io.BytesIO(b"b" * 30_000), limiter)
+    assert a.read(16_384) == b"a" * 16_384  # Within the burst
+    assert slept == []
+    b.read(10_000)
+    a.read(10_000)
+    assert slept == [pytest.approx(0.1), pytest.approx(0.2)]
+    assert a.tell() == 26_384
+
+    limiter.set_rate(None)
+    assert limiter.rate is None
+    assert len(b.read()) == 20_000
+    assert len(slept) == 2
+    with pytest.raises(ValueError):
+        limiter.set_rate(0)
+
+
+def test_bandwidth_limiter_consume_async() -> None:
+    """Check that async uploads draw from the same bucket."""
+    clock = FakeClock()
+    limiter = BandwidthLimiter(1000.0, clock=clock)
+    asyncio.run(limiter.consume_async(16_384))
+    assert limiter.rate == 1000.0
+    assert limiter._bucket is not None
+    assert limiter._bucket.reserve(1000) == pytest.approx(1.0)
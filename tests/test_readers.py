@@ -0,0 +1,48 @@
+"""Unit tests of stkclient.readers."""
+
+import io
+from typing import List
+
+import pytest
+
+from stkclient.cancel import CancellableReader, CancelledError, CancelToken
+from stkclient.readers import ReaderWrapper
+
+
+class Recording(ReaderWrapper):
+    """Records the hooks run around each read."""
+
+    def __init__(self, fp: io.BytesIO) -> None:
+        """Constructs a Recording reader with no hooks run yet."""
+        super().__init__(fp)
+        self.calls: List[str] = []
+
+    def _before_read(self) -> None:
+        self.calls.append("before")
+
+    def _after_read(self, data: bytes) -> None:
+        self.calls.append(f"after {data!r}")
+
+
+def test_reader_wrapper() -> None:
+    """Check that hooks run around each read and other attributes reach the wrapped file."""
+    r = Recording(io.BytesIO(b"abc"))
+    assert r.read(2) == b"ab"
+    assert r.read(None) == b"c"
+    assert r.calls == ["before", "after b'ab'", "before", "after b'c'"]
+    assert r.seekable() and r.tell() == 3
+    r.seek(1)
+    assert r.read() == b"bc"
+
+
+def test_reader_wrapper_nested() -> None:
+    """Check that a raising hook stops the read before it reaches the wrapped readers."""
+    inner = Recording(io.BytesIO(b"abc"))
+    token = CancelToken()
+    r = CancellableReader(inner, token)  # type: ignore[arg-type]
+    assert r.read(1) == b"a"
+    token.cancel()
+    with pytest.raises(CancelledError):
+        r.read(1)
+    assert inner.calls == ["before", "after b'a'"]
+    assert r.tell() == 1
@@ -0,0 +1,54 @@
+"""Tests for the stkclient.relay module."""
+import copy
+import pickle  # noqa: S403
+
+import pytest
+
+from stkclient.relay import SourceError, open_source
+from stkclient.transport import PooledTransport
+
+
+def test_open_source_relay(source_server: str, source_document: bytes) -> None:
+    """Check that a body with a Content-Length is relayed in chunks through a bounded buffer."""
+    with open_source(f"{source_server}/book.pdf", chunk_size=1000, buffer_chunks=2) as source:
+        assert (source.size, source.content_type, source.spooled) == (
+            len(source_document),
+            "application/pdf",
+            False,
+        )
+        assert not source.body.seekable()
+        assert source.peek(4096) == source_document[:4096]
+        chunks = list(iter(lambda: source.body.read(8192), b""))
+    assert max(len(c) for c in chunks) <= 8192
+    assert b"".join(chunks) == source_document
+
+
+def test_open_source_spool(source_server: str, source_document: bytes) -> None:
+    """Check that a body without a Content-Length is spooled."""
+    with open_source(f"{source_server}/stream.pdf", spool_size=1000) as source:
+        assert (source.size, source.spooled) == (len(source_document), True)
+        assert source.peek(10) == source_document[:10]
+        assert source.body.read() == source_document
+
+
+def test_open_source_errors(source_server: str) -> None:
+    """Check that source failures raise SourceError."""
+    transport = PooledTransport()
+    with pytest.raises(SourceError) as e:
+        open_source(f"{source_server}/missing", transport=transport)
+    assert e.value.status == 404
+    for clone in (pickle.loads(pickle.dumps(e.value)), copy.copy(e.value)):  # noqa: S301
+        assert (str(clone), clone.status) == (str(e.value), 404)
+    assert str(e.value) == "Source returned HTTP Error 404: Not Found"
+    with open_source(f"{source_server}/short.pdf", transport=transport) as source:
+        with pytest.raises(SourceError, match="Source ended after"):
+            source.body.read()
+    transport.close()
+
+
+def test_relay_close_unread(source_server: str) -> None:
+    """Check that closing a relay that is blocked on a full buffer stops its thread."""
+    source = open_source(f"{source_server}/book.pdf", chunk_size=100, buffer_chunks=1)
+    source.peek(10)
+    source.close()
+    assert not source._relay._thread.is_alive()  # type: ignore[union-attr]
@@ -1,7 +1,12 @@
 """Unit tests of stkclient.signer."""
 
+import concurrent.futures
+import time
+
+from pytest_mock import MockerFixture
+
 from stkclient.model import DeviceInfo
-from stkclient.signer import Signer
+from stkclient.signer import Signer, _get_signing_date
 
 EXPECTED_SIG = "czUzgbTkzXs2/esqFMcbGuIAdVkRPBzYJFsOnHNep0sW/xyW5hCtOgphRAqZGnUP4jXVvHTf+dRsRg5wdSzcp8CG5POxXZ6Qi+0KeKWiraMNmdRP7+L1RLXJ5cgd/HLbrBqGYAK5+VEpNDRitNXBm4KJOysPWyvf5mU6tu0KoHCfEm0biNNjTEn54J+FaQlB0xYIb8WHct/vqTQGmKoKhZGsPe1L5HwzTZfg5Wdld9SjujgaW8uQmWJ7QpDJ0dw5Fv1W0x6fK+pM/rM/rPQ5XrbPYIeXSSPL6KKoqeIPpbwNrVHdgpeZAU/1BMIF7+zXQKv4L8IjFizgf+L2tqa6Yg==:2020-04-10T14:21:40Z"
 
@@ -13,3 +18,33 @@ def test_signer(device_info: DeviceInfo) -> None:
     signer = Signer.from_device_info(device_info)
     sig = signer.digest_header_for_request("GET", request_path, "", date)
     assert sig == EXPECTED_SIG
+
+
+def test_sign_many(device_info: DeviceInfo) -> None:
+    """Check that batch signing matches signing requests one at a time."""
+    date = "2020-04-10T14:21:40Z"
+    signer = Signer.from_device_info(device_info)
+    requests = [("GET", "/FirsProxy/getStoreCredentials", "")] + [
+        ("POST", "/SendToKindle", f'{{"n":{i}}}') for i in range(5)
+    ]
+    expected = [signer.digest_header_for_request(*r, signing_date=date) for r in requests]
+    assert expected[0] == EXPECTED_SIG
+    assert signer.sign_many(requests, signing_date=date) == expected
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        assert (
+            signer.sign_many(iter(requests), signing_date=date, executor=executor, chunksize=4)
+            == expected
+        )
+    assert signer.sign_many([]) == []
+
+
+def test_signing_date(mocker: MockerFixture) -> None:
+    """Check that the signing date is formatted once per second."""
+    now = mocker.patch("time.time", return_value=1586528500.25)
+    gmtime = mocker.spy(time, "gmtime")
+    assert _get_signing_date() == "2020-04-10T14:21:40Z"
+    now.return_value = 1586528500.75
+    assert _get_signing_date() == "2020-04-10T14:21:40Z"
+    now.return_value = 1586528501.0
+    assert _get_signing_date() == "2020-04-10T14:21:41Z"
+    assert gmtime.call_count == 2
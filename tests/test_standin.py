@@ -0,0 +1,56 @@
+"""Unit tests of stkclient.standin."""
+
+import io
+import json
+from typing import Generator
+
+import pytest
+
+from stkclient import api
+from stkclient.signer import Signer
+from stkclient.standin import StandInServer
+from stkclient.transport import PooledTransport
+
+
+@pytest.fixture()
+def standin(real_network: None) -> Generator[StandInServer, None, None]:
+    """Runs a stand-in server for the duration of a test."""
+    with StandInServer() as server:
+        yield server
+
+
+def test_standin_endpoints(standin: StandInServer, device_info: object) -> None:
+    """Check that the api functions work against the stand-in through a redirect transport."""
+    signer = Signer.from_device_info(device_info)  # type: ignore[arg-type]
+    transport = standin.transport()
+    devices = api.get_list_of_owned_devices(signer, transport=transport).owned_devices
+    assert [d.device_serial_number for d in devices] == ["STANDIN0000000001"]
+    upload = api.get_upload_url(signer, 5, transport=transport)
+    api.upload_file(upload.upload_url, 5, io.BytesIO(b"hello"), transport=transport)
+    sku = api.send_to_kindle(
+        signer,
+        upload.stk_token,
+        ["STANDIN0000000001"],
+        author="a",
+        title="t",
+        format="pdf",
+        transport=transport,
+    ).sku
+    assert sku == f"sku-{upload.stk_token}"
+    assert standin.bytes_uploaded == 5
+    assert standin.requests == {
+        "/GetListOfOwnedDevices": 1,
+        "/GetUploadUrl": 1,
+        "/upload": 1,
+        "/SendToKindle": 1,
+    }
+    with pytest.raises(api.APIError):
+        api.send_to_kindle(
+            signer, "unknown", [], author="a", title="t", format="pdf", transport=transport
+        )
+    inner = transport.inner
+    assert isinstance(inner, PooledTransport)
+    assert inner.connections_opened == 1
+    with PooledTransport().request("POST", standin.url + "/Missing", headers={}) as r:
+        assert (r.status, json.loads(r.read())) == (404, {"message": "Not found"})
+    transport.close()
@@ -0,0 +1,102 @@
+"""Unit tests of stkclient.timeouts."""
+
+import threading
+from typing import List
+
+import pytest
+
+from stkclient.timeouts import (
+    Deadline,
+    DeadlineExceeded,
+    LatencyTracker,
+    Timeout,
+    hedge,
+    hedge_delay,
+)
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+
+    def __init__(self) -> None:
+        """Starts the clock at zero."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Returns the current time."""
+        return self.now
+
+
+def test_deadline() -> None:
+    """Check that a deadline counts down and then raises."""
+    clock = FakeClock()
+    d = Deadline(5.0, clock=clock)
+    assert d.remaining() == 5.0
+    clock.now = 4.0
+    d.check()
+    assert Timeout(connect=10.0, read=None).clip(d) == Timeout(connect=1.0, read=1.0)
+    assert Timeout(connect=0.5, read=2.0).clip(d) == Timeout(connect=0.5, read=1.0)
+    clock.now = 5.0
+    with pytest.raises(DeadlineExceeded):
+        d.check()
+
+
+def test_timeout_clip_without_deadline() -> None:
+    """Check that clipping without a deadline is a no-op."""
+    t = Timeout(connect=1.0, read=2.0)
+    assert t.clip(None) is t
+
+
+def test_latency_tracker() -> None:
+    """Check percentiles over the sliding window."""
+    tracker = LatencyTracker(size=100)
+    assert tracker.percentile(95) is None
+    assert hedge_delay(tracker, default=2.0) == 2.0
+    for i in range(1, 201):
+        tracker.record(float(i))
+    assert len(tracker) == 100
+    assert tracker.percentile(50) == 150.0
+    assert tracker.percentile(95) == 195.0
+    assert hedge_delay(tracker) == 195.0
+
+
+def test_hedge_fast_call_not_hedged() -> None:
+    """Check that a call faster than the delay is issued once."""
+    calls: List[int] = []
+
+    def fn() -> str:
+        calls.append(1)
+        return "ok"
+
+    assert hedge(fn, delay=5.0) == "ok"
+    assert calls == [1]
+
+
+def test_hedge_slow_call_is_hedged() -> None:
+    """Check that a slow call is raced against a second call."""
+    release = threading.Event()
+    calls: List[int] = []
+
+    def fn() -> int:
+        calls.append(1)
+        n = len(calls)
+        if n == 1:
+            release.wait(5.0)
+        return n
+
+    try:
+        assert hedge(fn, delay=0.01) == 2
+    finally:
+        release.set()
+
+
+def test_hedge_errors() -> None:
+    """Check that errors propagate when no call succeeds."""
+
+    def fn() -> None:
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        hedge(fn, delay=5.0)
+    with pytest.raises(ValueError):
+        hedge(fn, delay=0.0)
@@ -0,0 +1,238 @@
+"""Unit tests of stkclient.transport."""
+
+import http.server
+import io
+import json
+import socket
+import threading
+from typing import Any, Generator, List, Mapping, Optional, Tuple
+
+import httpretty
+import pytest
+from pytest_mock import MockerFixture
+
+from stkclient import api
+from stkclient.signer import Signer
+from stkclient.timeouts import DEFAULT_TIMEOUT, Timeout
+from stkclient.transport import (
+    Body,
+    PooledTransport,
+    Response,
+    StdlibTransport,
+    Transport,
+)
+
+
+class FakeResponse(Response):
+    """In-memory Response."""
+
+    def __init__(self, status: int, body: bytes, headers: Optional[Mapping[str, str]] = None):
+        """Constructs a FakeResponse."""
+        self.status = status
+        self.reason = "Fake"
+        self._body = io.BytesIO(body)
+        self._headers = headers or {}
+        self.closed = False
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Returns a header."""
+        return self._headers.get(name, default)
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        """Reads the body."""
+        return self._body.read(amt)
+
+    def close(self) -> None:
+        """Marks the response closed."""
+        self.closed = True
+
+
+class FakeTransport(Transport):
+    """Transport that records requests and replays canned responses."""
+
+    def __init__(self, *responses: FakeResponse) -> None:
+        """Constructs a FakeTransport."""
+        self.responses = list(responses)
+        self.requests: List[Tuple[str, str, Mapping[str, str], bytes, Timeout]] = []
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Mapping[str, str],
+        body: Body = None,
+        timeout: Timeout = DEFAULT_TIMEOUT,
+    ) -> Response:
+        """Records the request and returns the next response."""
+        data = body if body is None or isinstance(body, bytes) else body.read()
+        self.requests.append((method, url, headers, data or b"", timeout))
+        return self.responses.pop(0)
+
+
+def test_api_uses_supplied_transport(device_info: Any) -> None:
+    """Check that api functions send requests through the supplied transport."""
+    signer = Signer.from_device_info(device_info)
+    res = FakeResponse(200, json.dumps({"sku": "s", "statusCode": 0}).encode())
+    transport = FakeTransport(res)
+    timeout = Timeout(connect=1.0, read=2.0)
+    sku = api.send_to_kindle(
+        signer,
+        "tok",
+        ["A"],
+        author="a",
+        title="t",
+        format="pdf",
+        transport=transport,
+        timeout=timeout,
+    )
+    assert sku.sku == "s"
+    assert res.closed
+    [(method, url, headers, body, t)] = transport.requests
+    assert (method, url, t) == ("POST", "https://stkservice.amazon.com/SendToKindle", timeout)
+    assert headers["X-ADP-Authentication-Token"] == device_info.adp_token
+    assert json.loads(body)["stkToken"] == "tok"
+
+
+def test_api_transport_error_status() -> None:
+    """Check that error statuses returned by a transport become APIErrors."""
+    transport = FakeTransport(FakeResponse(403, b'{"message": "denied"}'))
+    with pytest.raises(api.APIError, match="denied"):
+        api.upload_file("https://example.com/x", 1, io.BytesIO(b"x"), transport=transport)
+    assert transport.requests[0][3] == b"x"
+
+
+def test_stdlib_transport() -> None:
+    """Check that the stdlib transport returns responses for success and error statuses."""
+    httpretty.register_uri(httpretty.GET, "https://example.com/ok", body="hello")
+    httpretty.register_uri(
+        httpretty.PUT,
+        "https://example.com/bad",
+        body=lambda request, uri, response_headers: (400, response_headers, "nope"),
+    )
+    t = StdlibTransport()
+    with t.request("GET", "https://example.com/ok", headers={}) as r:
+        assert (r.status, r.read()) == (200, b"hello")
+    body = io.BytesIO(b"data")
+    with t.request(
+        "PUT", "https://example.com/bad", headers={"Content-Length": "4"}, body=body
+    ) as r:
+        assert (r.status, r.read()) == (400, b"nope")
+    assert httpretty.last_request().body == b"data"
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    """Echoes request bodies over HTTP/1.1 keep-alive connections."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self) -> None:  # noqa: N802
+        """Responds with the request body."""
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Silences request logging."""
+
+
+@pytest.fixture()
+def keep_alive_server(real_network: None) -> Generator[str, None, None]:
+    """Runs a local keep-alive HTTP server and yields its base URL."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_pooled_transport_reuses_connections(keep_alive_server: str) -> None:
+    """Check that sequential requests share one connection and warm-up pre-connects."""
+    t = PooledTransport()
+    t.warm_up([keep_alive_server + "/warm"])
+    assert t.connections_opened == 1
+    for i in range(3):
+        body = f"req{i}".encode()
+        with t.request("PUT", keep_alive_server + "/x?y=1", headers={}, body=body) as r:
+            assert r.read() == body
+    stream = io.BytesIO(b"streamed")
+    with t.request(
+        "PUT", keep_alive_server + "/x", headers={"Content-Length": "8"}, body=stream
+    ) as r:
+        assert r.read() == b"streamed"
+    assert t.connections_opened == 1
+    assert t.connections_reused == 4
+    [timing] = t.connect_timings
+    assert timing.host == "127.0.0.1"
+    assert timing.tls == 0 or not timing.tls_resumed
+    t.close()
+
+
+def test_pooled_transport_tries_each_address(keep_alive_server: str, mocker: MockerFixture) -> None:
+    """Check that every resolved address is tried in turn, and the list is cached."""
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))
+    refused = closed.getsockname()
+    closed.close()
+    port = int(keep_alive_server.rsplit(":", 1)[1])
+    getaddrinfo = mocker.patch(
+        "socket.getaddrinfo",
+        return_value=[
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", refused),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port)),
+        ],
+    )
+    t = PooledTransport()
+    for _ in range(2):
+        with t.request("PUT", f"http://stkclient.test:{port}", headers={}, body=b"abc") as r:
+            assert r.read(1) == b"a"  # Not reading it all closes the connection
+    assert t.connections_opened == 2
+    getaddrinfo.assert_called_once()
+    getaddrinfo.return_value = getaddrinfo.return_value[:1]
+    t2 = PooledTransport()
+    with pytest.raises(ConnectionRefusedError):
+        t2.request("PUT", f"http://stkclient.test:{port}", headers={}, body=b"abc")
+    assert not t2._dns
+
+
+def test_pooled_transport_unread_response_not_reused(keep_alive_server: str) -> None:
+    """Check that a connection whose response was not fully read is discarded."""
+    t = PooledTransport()
+    with t.request("PUT", keep_alive_server, headers={}, body=b"abc") as r:
+        assert r.read(1) == b"a"
+    with t.request("PUT", keep_alive_server, headers={}, body=b"abc") as r:
+        assert r.read() == b"abc"
+    assert t.connections_opened == 2
+
+
+def test_pooled_transport_https(device_info: Any) -> None:
+    """Check that the pooled transport works for TLS hosts."""
+    httpretty.register_uri(httpretty.PUT, "https://example.com/up", body="done")
+    t = PooledTransport()
+    with t.request("PUT", "https://example.com/up", headers={}, body=b"x") as r:
+        assert (r.status, r.read()) == (200, b"done")
+    assert httpretty.last_request().body == b"x"
+
+
+def test_pooled_transport_per_thread(keep_alive_server: str) -> None:
+    """Check that per-thread pools give each thread its own reused connection."""
+    t = PooledTransport(per_thread=True)
+
+    def work() -> None:
+        for _ in range(3):
+            with t.request("PUT", keep_alive_server, headers={}, body=b"abc") as r:
+                assert r.read() == b"abc"
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert t.connections_opened == 4
+    assert t.connections_reused == 8
+    work()
+    assert t.connections_opened == 5
+    t.close()